@@ -0,0 +1,98 @@
+import math
+import threading
+import time
+from collections import deque
+
+# Admission control in front of the inference path. At most max_in_flight
+# units (images) are between admission and a finished forward pass; up to
+# max_queue further requests wait in FIFO order, each for at most timeout
+# seconds. Anything beyond that is turned away immediately, so under a burst
+# the admitted requests keep their latency instead of everyone timing out.
+
+class Overloaded(Exception):
+    def __init__(self, reason, retry_after):
+        super().__init__("Server overloaded (%s)" % reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+class AdmissionGate:
+    def __init__(self, max_in_flight, max_queue, timeout):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.cond = threading.Condition()
+        self.in_flight = 0
+        self.waiters = deque()
+        # Moving average of how long an admitted request holds its slot, for Retry-After
+        self.hold_seconds = 0.1
+        self.admitted = 0
+        self.rejected = {"queue_full": 0, "timeout": 0}
+
+    def acquire(self, cost=1):
+        """Take cost units, waiting if needed; returns the seconds spent waiting.
+
+        Raises Overloaded if the wait queue is full or the deadline passes.
+        """
+        cost = min(cost, self.max_in_flight)
+        start = time.monotonic()
+        with self.cond:
+            if not self.waiters and self.in_flight + cost <= self.max_in_flight:
+                self.in_flight += cost
+                self.admitted += 1
+                return 0.0
+            if len(self.waiters) >= self.max_queue:
+                self.rejected["queue_full"] += 1
+                raise Overloaded("queue_full", self._retry_after())
+            ticket = object()
+            self.waiters.append(ticket)
+            deadline = start + self.timeout
+            try:
+                while self.waiters[0] is not ticket or self.in_flight + cost > self.max_in_flight:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected["timeout"] += 1
+                        raise Overloaded("timeout", self._retry_after())
+                    self.cond.wait(remaining)
+            finally:
+                self.waiters.remove(ticket)
+                # The next waiter may now be at the head of the queue
+                self.cond.notify_all()
+            self.in_flight += cost
+            self.admitted += 1
+        return time.monotonic() - start
+
+    def try_acquire(self, cost=1):
+        """Take cost units only if they are free right now and nobody is waiting."""
+        cost = min(cost, self.max_in_flight)
+        with self.cond:
+            if self.waiters or self.in_flight + cost > self.max_in_flight:
+                return False
+            self.in_flight += cost
+            self.admitted += 1
+            return True
+
+    def release(self, cost=1, held=None):
+        cost = min(cost, self.max_in_flight)
+        with self.cond:
+            self.in_flight -= cost
+            if held is not None:
+                self.hold_seconds += 0.1 * (held - self.hold_seconds)
+            self.cond.notify_all()
+
+    def _retry_after(self):
+        # Time for everything already queued to drain, in whole seconds (caller holds cond)
+        drain = (len(self.waiters) + 1) * self.hold_seconds / self.max_in_flight
+        return max(1, min(60, math.ceil(drain)))
+
+    def stats(self):
+        with self.cond:
+            return {
+                "max_in_flight": self.max_in_flight,
+                "max_queue": self.max_queue,
+                "timeout_ms": self.timeout * 1000.0,
+                "in_flight": self.in_flight,
+                "waiting": len(self.waiters),
+                "admitted": self.admitted,
+                "rejected": dict(self.rejected),
+                "hold_ms": self.hold_seconds * 1000.0,
+            }
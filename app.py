@@ -1,32 +1,217 @@
-from flask import Flask, request, render_template_string, redirect, url_for, jsonify
-import tensorflow as tf
+from flask import Flask, Request, Response, g, request, render_template_string, redirect, url_for, jsonify, stream_with_context
 import numpy as np
-from tensorflow.keras.preprocessing import image
-from tensorflow.keras.applications.inception_v3 import preprocess_input
+from PIL import Image, UnidentifiedImageError
+from admission import AdmissionGate, Overloaded
+from backends import load_backend
+from cache import PredictionCache, content_key, file_digest
+from calibration import load_temperature, temperature_scale
+from classes import IMAGE_EXTENSIONS, TOP_K, UNCERTAIN_THRESHOLD, class_names, prediction_result, prediction_results
+from history import HistoryWriter, daily_counts, query_history
+from jobs import JobRunner
+from payloads import PrecomputedResponse
+import history
+import metrics
+import tiles
+import tta
+from preprocessing import INPUT_SHAPE, decode_image, load_image_array, new_batch, preprocess_inplace, thread_buffer
 import os
+import atexit
 import uuid
 import base64
+import time
+import queue
+import threading
+import json
+import itertools
+import zipfile
+from concurrent.futures import Future, ThreadPoolExecutor
 from io import BytesIO
+from urllib.parse import unquote
+
+class InMemoryRequest(Request):
+    # Keep uploaded files in memory instead of spooling large ones to a temp file;
+    # request size is bounded by MAX_CONTENT_LENGTH
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return BytesIO()
 
 app = Flask(__name__)
+app.request_class = InMemoryRequest
 
 UPLOAD_FOLDER = "static/uploads"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
+app.config["MAX_CONTENT_LENGTH"] = int(os.environ.get("MAX_CONTENT_LENGTH", 256 * 1024 * 1024))
+
+# Keep a copy of each uploaded original; written off the request path
+app.config["SAVE_UPLOADS"] = os.environ.get("SAVE_UPLOADS", "1") == "1"
+
+# Prediction history and saved uploads go through one background writer.
+# HISTORY_OVERFLOW is "drop" (never stall a request) or "block" (never lose a record).
+app.config["HISTORY_DB"] = os.environ.get("HISTORY_DB", "plantguard.db")
+app.config["HISTORY_QUEUE_SIZE"] = int(os.environ.get("HISTORY_QUEUE_SIZE", 10000))
+app.config["HISTORY_OVERFLOW"] = os.environ.get("HISTORY_OVERFLOW", "drop")
+
+# Asynchronous jobs (POST /jobs, GET /jobs/<id>): inputs are spooled to JOBS_DIR,
+# state and results live in HISTORY_DB. JOB_WORKERS threads per process run them
+# JOB_CHUNK_SIZE images at a time; a job whose process stops heartbeating for
+# JOB_LEASE seconds is picked up again. JOB_CALLBACKS=1 allows a callback_url that
+# is POSTed the final status.
+app.config["JOBS_DIR"] = os.environ.get("JOBS_DIR", "job_spool")
+app.config["JOB_WORKERS"] = int(os.environ.get("JOB_WORKERS", 1))
+app.config["JOB_CHUNK_SIZE"] = int(os.environ.get("JOB_CHUNK_SIZE", 32))
+app.config["JOB_LEASE"] = float(os.environ.get("JOB_LEASE", 60))
+app.config["JOB_MAX_IMAGES"] = int(os.environ.get("JOB_MAX_IMAGES", 100000))
+app.config["JOB_CALLBACKS"] = os.environ.get("JOB_CALLBACKS", "0") == "1"
+
+# Micro-batching: wait at most BATCH_TIMEOUT_MS to gather up to BATCH_MAX_SIZE images
+app.config["BATCH_MAX_SIZE"] = int(os.environ.get("BATCH_MAX_SIZE", 16))
+app.config["BATCH_TIMEOUT_MS"] = float(os.environ.get("BATCH_TIMEOUT_MS", 10))
+
+# Admission control: at most ADMISSION_MAX_IN_FLIGHT images between admission and a
+# finished forward pass, ADMISSION_MAX_QUEUE requests waiting behind them for up to
+# ADMISSION_TIMEOUT_MS each; the rest get an immediate 503 with Retry-After
+app.config["ADMISSION_MAX_IN_FLIGHT"] = int(os.environ.get("ADMISSION_MAX_IN_FLIGHT", 2 * app.config["BATCH_MAX_SIZE"]))
+app.config["ADMISSION_MAX_QUEUE"] = int(os.environ.get("ADMISSION_MAX_QUEUE", 64))
+app.config["ADMISSION_TIMEOUT_MS"] = float(os.environ.get("ADMISSION_TIMEOUT_MS", 1000))
+
+# /predict/batch limits and parallel decode pool. One batch request holds at most
+# BATCH_MAX_IN_FLIGHT admission slots at a time (default a quarter of the gate), so
+# a large batch cannot crowd out /upload
+app.config["BATCH_MAX_IMAGES"] = int(os.environ.get("BATCH_MAX_IMAGES", 1000))
+# Zip archives (/predict/batch, /jobs) are checked against these before anything is
+# inflated: uncompressed bytes per image member and in total per request
+app.config["ZIP_MAX_MEMBER_BYTES"] = int(os.environ.get("ZIP_MAX_MEMBER_BYTES", 32 * 1024 * 1024))
+app.config["ZIP_MAX_TOTAL_BYTES"] = int(os.environ.get("ZIP_MAX_TOTAL_BYTES", 2 * app.config["MAX_CONTENT_LENGTH"]))
+app.config["BATCH_MAX_IN_FLIGHT"] = int(os.environ.get("BATCH_MAX_IN_FLIGHT", 0)) or \
+    max(1, app.config["ADMISSION_MAX_IN_FLIGHT"] // 4)
+# Job workers are lower priority still: each takes at most JOB_MAX_IN_FLIGHT free
+# slots (default an eighth of the gate) and never queues for them
+app.config["JOB_MAX_IN_FLIGHT"] = int(os.environ.get("JOB_MAX_IN_FLIGHT", 0)) or \
+    max(1, app.config["ADMISSION_MAX_IN_FLIGHT"] // 8)
+app.config["DECODE_WORKERS"] = int(os.environ.get("DECODE_WORKERS", os.cpu_count() or 4))
+
+# /upload/raw takes the request body as the image itself: a pre-resized RGB tensor
+# (application/x-rgb, exactly 224*224*3 bytes) or a small encoded image. Anything
+# larger than RAW_MAX_BYTES, or wider/taller than RAW_MAX_SIDE, is refused before decode.
+app.config["RAW_MAX_BYTES"] = int(os.environ.get("RAW_MAX_BYTES", 512 * 1024))
+app.config["RAW_MAX_SIDE"] = int(os.environ.get("RAW_MAX_SIDE", 1024))
+RAW_RGB_TYPE = "application/x-rgb"
+RAW_RGB_BYTES = INPUT_SHAPE[0] * INPUT_SHAPE[1] * INPUT_SHAPE[2]
+RAW_IMAGE_TYPES = {"image/jpeg": ".jpg", "image/png": ".png", "image/webp": ".webp"}
 
-# Load trained model
-model = tf.keras.models.load_model("model.h5")
-
-# Class mapping
-class_names = [
-    'Anthracnose',
-    'Bacterial Canker',
-    'Cutting Weevil',
-    'Die Back',
-    'Gall Midge',
-    'Healthy'
+# Prediction cache keyed by image bytes + model version; CACHE_DB enables the persistent tier
+app.config["MODEL_PATH"] = os.environ.get("MODEL_PATH", "model.h5")
+# keras, tflite or onnx; empty picks from the MODEL_PATH extension
+app.config["INFERENCE_BACKEND"] = os.environ.get("INFERENCE_BACKEND", "")
+# Intra-op threads for the backend; serve.py sets this to each worker's core slice
+app.config["INFERENCE_THREADS"] = int(os.environ.get("INFERENCE_THREADS", 0)) or None
+# TFLITE_XNNPACK=0 runs .tflite models without the XNNPACK delegate: slower, but
+# the weights stay in the shared page cache instead of a private copy per process
+# (less memory per serve.py worker only with a small BATCH_MAX_SIZE, see README)
+app.config["TFLITE_XNNPACK"] = os.environ.get("TFLITE_XNNPACK", "1") == "1"
+app.config["CACHE_MAX_ENTRIES"] = int(os.environ.get("CACHE_MAX_ENTRIES", 10000))
+app.config["CACHE_TTL"] = float(os.environ.get("CACHE_TTL", 24 * 3600))
+app.config["CACHE_DB"] = os.environ.get("CACHE_DB", "")
+# Rows kept in CACHE_DB (default 10 x CACHE_MAX_ENTRIES); older and expired rows are pruned
+app.config["CACHE_DB_MAX_ENTRIES"] = int(os.environ.get("CACHE_DB_MAX_ENTRIES", 0)) or None
+
+# Every prediction lists its TOP_K classes and is flagged uncertain when the top
+# confidence is below UNCERTAIN_THRESHOLD percent (defaults read in classes.py). Confidences
+# are temperature-scaled with MODEL_PATH's calibration file (written by calibration.py)
+# when there is one.
+app.config["TOP_K"] = TOP_K
+app.config["UNCERTAIN_THRESHOLD"] = UNCERTAIN_THRESHOLD
+app.config["TEMPERATURE"] = load_temperature(app.config["MODEL_PATH"])
+
+# Test-time augmentation for /upload: "off", "always", or "adaptive" (only when the plain
+# prediction's confidence is below TTA_THRESHOLD percent). ?tta=<mode> overrides per request.
+app.config["TTA_MODE"] = os.environ.get("TTA_MODE", "off")
+app.config["TTA_THRESHOLD"] = float(os.environ.get("TTA_THRESHOLD", 70))
+TTA_MODES = ("off", "always", "adaptive")
+
+# Tiled inference (POST /predict/tiles) for photos of whole branches: overlapping
+# 224x224 tiles cut from a working copy at most TILE_MAX_SIDE px long, no more than
+# TILE_MAX_TILES of them, skipping tiles under TILE_MIN_LEAF green coverage.
+# TILE_AGGREGATE combines tiles by coverage-weighted "mean" or per-class "max".
+app.config["TILE_MAX_SIDE"] = int(os.environ.get("TILE_MAX_SIDE", 1120))
+app.config["TILE_MAX_TILES"] = int(os.environ.get("TILE_MAX_TILES", 48))
+app.config["TILE_OVERLAP"] = float(os.environ.get("TILE_OVERLAP", 0.25))
+app.config["TILE_MIN_LEAF"] = float(os.environ.get("TILE_MIN_LEAF", 0.1))
+app.config["TILE_AGGREGATE"] = os.environ.get("TILE_AGGREGATE", "mean")
+TILE_AGGREGATES = ("mean", "max")
+
+# Send a Server-Timing header on every response; clients can also opt in per request with ?timing=1
+app.config["SERVER_TIMING"] = os.environ.get("SERVER_TIMING", "0") == "1"
+
+# Batch sizes run once through the model before /readyz reports ready
+app.config["WARMUP_BATCH_SIZES"] = [
+    int(size) for size in os.environ.get("WARMUP_BATCH_SIZES", "1,%d" % app.config["BATCH_MAX_SIZE"]).split(",") if size
 ]
 
+# Trained model (an inference backend), loaded lazily in the background so Flask
+# can answer straight away. TensorFlow is only imported by the loader thread.
+model = None
+model_status = {"state": "idle", "error": None, "load_seconds": None, "warmup_seconds": None}
+_model_lock = threading.Lock()
+_model_done = threading.Event()
+_model_version = None
+
+def start_model_loading():
+    # Called once a process starts serving; jobs queued before a restart resume here too
+    job_runner.start()
+    with _model_lock:
+        if model_status["state"] != "idle":
+            return
+        model_status["state"] = "loading"
+    threading.Thread(target=_load_model, name="model-loader", daemon=True).start()
+
+def _load_model():
+    global model
+    try:
+        start = time.perf_counter()
+        loaded = load_backend(
+            app.config["MODEL_PATH"],
+            app.config["INFERENCE_BACKEND"] or None,
+            num_threads=app.config["INFERENCE_THREADS"],
+            xnnpack=app.config["TFLITE_XNNPACK"],
+        )
+        model_status["load_seconds"] = time.perf_counter() - start
+        MODEL_LOAD_SECONDS.set(model_status["load_seconds"])
+        model_status["state"] = "warming"
+        start = time.perf_counter()
+        warm_up(loaded)
+        model_status["warmup_seconds"] = time.perf_counter() - start
+        MODEL_WARMUP_SECONDS.set(model_status["warmup_seconds"])
+        model = loaded
+        model_status["state"] = "ready"
+    except Exception as e:
+        model_status["state"] = "failed"
+        model_status["error"] = str(e)
+    finally:
+        _model_done.set()
+
+def warm_up(loaded):
+    # Trace the predict function for every batch size we expect to serve
+    for size in app.config["WARMUP_BATCH_SIZES"]:
+        loaded.predict(np.zeros((size, 224, 224, 3), dtype=np.float32))
+
+def get_model():
+    if model is None:
+        start_model_loading()
+        _model_done.wait()
+        if model is None:
+            raise RuntimeError("Model failed to load: %s" % model_status["error"])
+    return model
+
+def model_version():
+    # Cached results carry top_k and the uncertain flag, so the result settings are part of the key
+    global _model_version
+    if _model_version is None:
+        _model_version = "%s:T=%.6g:k=%d:u=%g" % (
+            os.environ.get("MODEL_VERSION") or file_digest(app.config["MODEL_PATH"]), app.config["TEMPERATURE"],
+            app.config["TOP_K"], app.config["UNCERTAIN_THRESHOLD"])
+    return _model_version
+
 # Rich disease information
 disease_info = {
     'Anthracnose': {
@@ -127,15 +312,426 @@ disease_info = {
     }
 }
 
-def predict_disease(img_path):
-    img = image.load_img(img_path, target_size=(224, 224))
-    img_array = image.img_to_array(img)
-    img_array = np.expand_dims(img_array, axis=0)
-    img_array = preprocess_input(img_array)
-    prediction = model.predict(img_array)[0]
-    predicted_class = class_names[np.argmax(prediction)]
-    confidence = float(np.max(prediction)) * 100
-    return predicted_class, confidence
+# Metrics, exposed at /metrics. Label children used on the request path are created
+# here once so recording a request only increments existing series.
+# "queue" is time spent waiting for admission, kept apart from decode and inference
+STAGES = ("parse", "cache", "queue", "decode", "preprocess", "inference", "tta", "persist", "serialize")
+PARSE, CACHE, QUEUE, DECODE, PREPROCESS, INFERENCE, TTA, PERSIST, SERIALIZE = range(len(STAGES))
+
+REQUESTS = metrics.Counter("plantguard_requests_total", "HTTP requests by endpoint and status code", ("endpoint", "status"))
+REQUEST_ERRORS = metrics.Counter("plantguard_request_errors_total", "HTTP 5xx responses by endpoint", ("endpoint",))
+REQUEST_SECONDS = metrics.Histogram("plantguard_request_seconds", "Time to response by endpoint", ("endpoint",))
+STAGE_SECONDS = metrics.Histogram("plantguard_upload_stage_seconds", "/upload time spent per stage", ("stage",))
+STAGE_HISTOGRAMS = [STAGE_SECONDS.labels(stage) for stage in STAGES]
+BATCH_SIZE = metrics.Histogram("plantguard_batch_size", "Images per forward pass", buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+FORWARD_SECONDS = metrics.Histogram("plantguard_forward_seconds", "Duration of one batched forward pass")
+PREDICTIONS = metrics.Counter("plantguard_predictions_total", "Predictions served per class", ("disease",))
+PREDICTION_COUNTERS = {name: PREDICTIONS.labels(name) for name in class_names}
+MODEL_LOAD_SECONDS = metrics.Gauge("plantguard_model_load_seconds", "Time to load the model")
+MODEL_WARMUP_SECONDS = metrics.Gauge("plantguard_model_warmup_seconds", "Time to run warm-up batches")
+ADMISSION_WAIT_SECONDS = metrics.Histogram("plantguard_admission_wait_seconds", "Time admitted requests waited for a slot")
+ADMISSION_REJECTED = metrics.Counter("plantguard_admission_rejected_total", "Requests shed with 503", ("reason",))
+JOB_QUEUE_SECONDS = metrics.Histogram("plantguard_job_queue_seconds", "Time from job submission to its first worker",
+                                      buckets=(0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0, 3600.0))
+JOB_IMAGES = metrics.Counter("plantguard_job_images_total", "Images classified by job workers")
+JOB_PROCESSING_SECONDS = metrics.Counter("plantguard_job_processing_seconds_total", "Time job workers spent on chunks")
+metrics.CallbackMetric("plantguard_model_ready", "1 once the model is loaded and warmed", "gauge",
+                       lambda: int(model_status["state"] == "ready"))
+
+_timers = []
+
+class MicroBatcher:
+    """Collects concurrent single-image requests into one batched forward pass."""
+
+    def __init__(self, predict_fn, max_batch_size, timeout_ms):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.timeout = timeout_ms / 1000.0
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self._carry = None
+        # histograms indexed by batch size / queue depth seen when a batch is formed
+        self.batch_size_hist = [0] * (max_batch_size + 1)
+        self.queue_depth_hist = {}
+        self.batches = 0
+        self.images = 0
+        self._worker = None
+        self._pid = None
+
+    def submit(self, img_array):
+        future = Future()
+        self._ensure_worker()
+        self.queue.put((img_array, future))
+        return future
+
+    def predict(self, img_array):
+        return self.submit(img_array).result()
+
+    def _ensure_worker(self):
+        # Threads do not survive fork(), so each worker process starts its own
+        if self._worker is not None and self._pid == os.getpid() and self._worker.is_alive():
+            return
+        with self.lock:
+            if self._worker is None or self._pid != os.getpid() or not self._worker.is_alive():
+                self._pid = os.getpid()
+                self._worker = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+                self._worker.start()
+
+    def _collect(self):
+        # Batches are bounded by image count; an item that does not fit waits for the next batch
+        if self._carry is not None:
+            batch, self._carry = [self._carry], None
+        else:
+            batch = [self.queue.get()]
+        size = len(batch[0][0])
+        deadline = time.monotonic() + self.timeout
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    item = self.queue.get(timeout=remaining)
+                else:
+                    item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if size + len(item[0]) > self.max_batch_size:
+                self._carry = item
+                break
+            batch.append(item)
+            size += len(item[0])
+        return batch, size
+
+    def _run(self):
+        while True:
+            batch, size = self._collect()
+            depth = self.queue.qsize()
+            with self.lock:
+                self.batch_size_hist[min(size, self.max_batch_size)] += 1
+                self.queue_depth_hist[depth] = self.queue_depth_hist.get(depth, 0) + 1
+                self.batches += 1
+                self.images += size
+            BATCH_SIZE.observe(size)
+            try:
+                inputs = batch[0][0] if len(batch) == 1 else np.concatenate([img_array for img_array, _ in batch])
+                start = time.perf_counter()
+                predictions = self.predict_fn(inputs)
+                FORWARD_SECONDS.observe(time.perf_counter() - start)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            offset = 0
+            for img_array, future in batch:
+                n = len(img_array)
+                future.set_result(predictions[offset:offset + n])
+                offset += n
+
+    def stats(self):
+        with self.lock:
+            return {
+                "max_batch_size": self.max_batch_size,
+                "timeout_ms": self.timeout * 1000.0,
+                "queue_depth": self.queue.qsize(),
+                "batches": self.batches,
+                "images": self.images,
+                "batch_size_histogram": {str(size): count for size, count in enumerate(self.batch_size_hist) if count},
+                "queue_depth_histogram": {str(depth): count for depth, count in sorted(self.queue_depth_hist.items())},
+            }
+
+batcher = MicroBatcher(
+    lambda batch: temperature_scale(get_model().predict(batch), app.config["TEMPERATURE"]),
+    app.config["BATCH_MAX_SIZE"],
+    app.config["BATCH_TIMEOUT_MS"],
+)
+
+prediction_cache = PredictionCache(
+    app.config["CACHE_MAX_ENTRIES"],
+    app.config["CACHE_TTL"],
+    app.config["CACHE_DB"] or None,
+    app.config["CACHE_DB_MAX_ENTRIES"],
+)
+
+admission_gate = AdmissionGate(
+    app.config["ADMISSION_MAX_IN_FLIGHT"],
+    app.config["ADMISSION_MAX_QUEUE"],
+    app.config["ADMISSION_TIMEOUT_MS"] / 1000.0,
+)
+
+metrics.CallbackMetric("plantguard_admission_in_flight", "Images admitted and not yet predicted", "gauge",
+                       lambda: admission_gate.in_flight)
+metrics.CallbackMetric("plantguard_admission_waiting", "Requests waiting for admission", "gauge",
+                       lambda: len(admission_gate.waiters))
+metrics.CallbackMetric("plantguard_batch_queue_depth", "Requests waiting for the micro-batcher", "gauge",
+                       lambda: batcher.queue.qsize())
+metrics.CallbackMetric("plantguard_cache_hits_total", "Prediction cache hits", "counter",
+                       lambda: prediction_cache.hits)
+metrics.CallbackMetric("plantguard_cache_misses_total", "Prediction cache misses", "counter",
+                       lambda: prediction_cache.misses)
+
+decode_pool = ThreadPoolExecutor(max_workers=app.config["DECODE_WORKERS"], thread_name_prefix="decode")
+history_writer = HistoryWriter(
+    app.config["HISTORY_DB"],
+    max_queue=app.config["HISTORY_QUEUE_SIZE"],
+    overflow=app.config["HISTORY_OVERFLOW"],
+)
+
+metrics.CallbackMetric("plantguard_history_queued", "Records waiting for the history writer", "gauge",
+                       lambda: history_writer.queue.qsize())
+metrics.CallbackMetric("plantguard_history_dropped_total", "History records dropped on overflow", "counter",
+                       lambda: history_writer.dropped)
+
+def save_upload_async(filename, data):
+    file_path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
+    return file_path if history_writer.save_file(file_path, data) else None
+
+_history_db = None
+_history_db_lock = threading.Lock()
+
+def history_query(fn, *args, **kwargs):
+    # One shared read connection per process; WAL lets it read while the writer commits
+    global _history_db
+    with _history_db_lock:
+        if _history_db is None:
+            _history_db = history.connect(app.config["HISTORY_DB"])
+        return fn(_history_db, *args, **kwargs)
+
+def shutdown():
+    job_runner.stop()
+    history_writer.close()
+    prediction_cache.close()
+
+atexit.register(shutdown)
+
+def admit(cost=1):
+    # Returns the time the slot was taken; pass it to release()
+    try:
+        wait = admission_gate.acquire(cost)
+    except Overloaded as e:
+        ADMISSION_REJECTED.labels(e.reason).inc()
+        raise
+    ADMISSION_WAIT_SECONDS.observe(wait)
+    return time.monotonic()
+
+def release(cost, admitted_at):
+    admission_gate.release(cost, time.monotonic() - admitted_at)
+
+def predict_disease(img_path, tta_mode="off"):
+    img_array = load_image_array(img_path)
+    prediction, _ = apply_tta(img_array, batcher.predict(img_array)[0], tta_mode)
+    return prediction_result(prediction)
+
+def tta_mode(value):
+    # Per-request ?tta= value, falling back to TTA_MODE; ValueError if unknown
+    mode = value or app.config["TTA_MODE"]
+    if mode not in TTA_MODES:
+        raise ValueError("tta must be one of %s" % ", ".join(TTA_MODES))
+    return mode
+
+def apply_tta(img_array, prediction, mode):
+    """(prediction, report): prediction averaged over tta.VARIANTS when mode calls for it.
+
+    All variants go through the model as one batch. They need admission slots of
+    their own; when none are free TTA is skipped rather than queued behind other
+    requests. report is None when mode is "off".
+    """
+    if mode == "off":
+        return prediction, None
+    disease, confidence = prediction_result(prediction)
+    report = {"mode": mode, "applied": False, "disease_before": disease, "confidence_before": confidence}
+    if mode == "adaptive" and confidence >= app.config["TTA_THRESHOLD"]:
+        return prediction, report
+    cost = len(tta.VARIANTS)
+    if not admission_gate.try_acquire(cost):
+        report["skipped"] = "overloaded"
+        return prediction, report
+    start = time.perf_counter()
+    try:
+        variant_predictions = batcher.predict(tta.make_variants(img_array))
+    finally:
+        admission_gate.release(cost)
+    prediction = tta.aggregate(prediction, variant_predictions)
+    disease, confidence = prediction_result(prediction)
+    report.update(
+        applied=True,
+        variants=cost,
+        extra_ms=(time.perf_counter() - start) * 1000.0,
+        confidence_delta=confidence - report["confidence_before"],
+        disease_changed=disease != report["disease_before"],
+    )
+    return prediction, report
+
+def serving_results(predictions):
+    # prediction_results with this app's TOP_K and UNCERTAIN_THRESHOLD
+    return prediction_results(predictions, app.config["TOP_K"], app.config["UNCERTAIN_THRESHOLD"])
+
+def _decode_into(batch, index, source):
+    # source is the image bytes or a file path
+    try:
+        decode_image(BytesIO(source) if isinstance(source, bytes) else source, batch[index])
+        return True
+    except Exception:
+        return False
+
+class UploadTooLarge(ValueError):
+    pass
+
+def read_batch_uploads(files, max_images):
+    """Flatten multipart files and zip archives into (name, bytes) pairs.
+
+    Zip members are counted and sized from the archive's directory before any is
+    inflated (reading a member never returns more than its recorded file_size), so
+    a zip bomb is refused without being expanded. Raises UploadTooLarge past
+    max_images images, ZIP_MAX_MEMBER_BYTES per member or ZIP_MAX_TOTAL_BYTES.
+    """
+    sources = []
+    count = total = 0
+    for file in files:
+        data = file.read()
+        if zipfile.is_zipfile(BytesIO(data)):
+            archive = zipfile.ZipFile(BytesIO(data))
+            members = [member for member in archive.infolist() if not member.is_dir()
+                       and os.path.splitext(member.filename)[1].lower() in IMAGE_EXTENSIONS]
+            for member in members:
+                if member.file_size > app.config["ZIP_MAX_MEMBER_BYTES"]:
+                    raise UploadTooLarge("Archive member too large: %s (max %d bytes)" % (
+                        member.filename, app.config["ZIP_MAX_MEMBER_BYTES"]))
+            count += len(members)
+            total += sum(member.file_size for member in members)
+            sources.append((archive, members))
+        elif file.filename:
+            count += 1
+            sources.append((None, [(file.filename, data)]))
+        if count > max_images:
+            raise UploadTooLarge("Too many images (max %d)" % max_images)
+        if total > app.config["ZIP_MAX_TOTAL_BYTES"]:
+            raise UploadTooLarge("Archives too large uncompressed (max %d bytes)" % app.config["ZIP_MAX_TOTAL_BYTES"])
+    uploads = []
+    for archive, members in sources:
+        if archive is None:
+            uploads.extend(members)
+            continue
+        with archive:
+            uploads.extend((member.filename, archive.read(member)) for member in members)
+    return uploads
+
+def submit_admitted(batch):
+    # Slots for the batch's images, given back as soon as its forward pass resolves
+    cost = len(batch)
+    admitted_at = admit(cost)
+    future = batcher.submit(batch)
+    future.add_done_callback(lambda _: release(cost, admitted_at))
+    return future
+
+def iter_batch_predictions(uploads):
+    """Results for uploads in order, a chunk at a time.
+
+    Chunk i+1 decodes in the pool while chunk i is in the forward pass; cache hits
+    skip both. Each chunk takes its admission slots just before it is submitted,
+    and two chunks fit in BATCH_MAX_IN_FLIGHT, so slots are never held while the
+    client reads. Raises Overloaded if a chunk is shed before the first result is
+    out; after that, a shed chunk's images are reported as failed.
+    """
+    size = max(1, min(app.config["BATCH_MAX_SIZE"], app.config["BATCH_MAX_IN_FLIGHT"] // 2))
+    pending = None
+    for start in range(0, len(uploads), size):
+        chunk = uploads[start:start + size]
+        keys = [content_key(data, model_version()) for _, data in chunk]
+        cached = [prediction_cache.get(key) for key in keys]
+        todo = [i for i, hit in enumerate(cached) if hit is None]
+        batch = new_batch(len(todo))
+        decoded = list(decode_pool.map(_decode_into, [batch] * len(todo), range(len(todo)), [chunk[i][1] for i in todo]))
+        errors = {i: None if ok else "Could not decode image" for i, ok in zip(todo, decoded)}
+        if not all(decoded):
+            batch = batch[np.asarray(decoded, dtype=bool)]
+        future = None
+        if len(batch):
+            try:
+                future = submit_admitted(preprocess_inplace(batch))
+            except Overloaded:
+                if start <= size:
+                    raise  # the first or second chunk: nothing has been yielded yet
+                errors = {i: error or "Server busy, retry later" for i, error in errors.items()}
+        if pending is not None:
+            yield from _chunk_results(*pending)
+        pending = (chunk, keys, cached, errors, future)
+    if pending is not None:
+        yield from _chunk_results(*pending)
+
+def _chunk_results(chunk, keys, cached, errors, future):
+    results = iter(serving_results(future.result())) if future is not None else iter(())
+    for i, (name, _) in enumerate(chunk):
+        if cached[i] is not None:
+            result = cached[i]
+        elif errors[i] is not None:
+            yield {"success": False, "filename": name, "error": errors[i]}
+            continue
+        else:
+            result = next(results)
+            prediction_cache.put(keys[i], dict(result, image_path=None))
+        disease = result["disease"]
+        history_writer.record(name, disease, result["confidence"])
+        PREDICTION_COUNTERS[disease].inc()
+        yield {
+            "success": True,
+            "filename": name,
+            "disease": disease,
+            "confidence": result["confidence"],
+            "info": disease_info[disease],
+            "top_k": [{"class_id": index, "disease": class_names[index], "confidence": value}
+                      for index, value in result["top_k"]],
+            "uncertain": result["uncertain"],
+        }
+
+JOB_ADMISSION_POLL_SECONDS = 0.02
+
+def classify_job_chunk(paths, heartbeat):
+    """Job worker side: [(disease, confidence, uncertain, top_k, error)] for spooled image files."""
+    batch = new_batch(len(paths))
+    decoded = list(decode_pool.map(_decode_into, [batch] * len(paths), range(len(paths)), paths))
+    ok = np.asarray(decoded, dtype=bool)
+    inputs = preprocess_inplace(batch[ok])
+    predictions = []
+    # Background work only takes slots that are free with nobody waiting (try_acquire
+    # never joins the FIFO /upload waits in), JOB_MAX_IN_FLIGHT images at a time
+    step = app.config["JOB_MAX_IN_FLIGHT"]
+    for start in range(0, len(inputs), step):
+        piece = inputs[start:start + step]
+        while not admission_gate.try_acquire(len(piece)):
+            # Keep the job's lease while backing off (raises jobs.LeaseLost if it was taken over)
+            heartbeat()
+            time.sleep(JOB_ADMISSION_POLL_SECONDS)
+        admitted_at = time.monotonic()
+        try:
+            predictions.append(batcher.predict(piece))
+        finally:
+            release(len(piece), admitted_at)
+    results = iter(serving_results(np.concatenate(predictions))) if predictions else iter(())
+    rows = []
+    for path_ok in decoded:
+        if not path_ok:
+            rows.append((None, None, None, None, "Could not decode image"))
+            continue
+        result = next(results)
+        PREDICTION_COUNTERS[result["disease"]].inc()
+        top = [{"class_id": index, "disease": class_names[index], "confidence": value} for index, value in result["top_k"]]
+        rows.append((result["disease"], result["confidence"], result["uncertain"], top, None))
+    return rows
+
+def _job_progress(images, seconds):
+    JOB_IMAGES.inc(images)
+    JOB_PROCESSING_SECONDS.inc(seconds)
+
+job_runner = JobRunner(
+    app.config["HISTORY_DB"],
+    app.config["JOBS_DIR"],
+    classify_job_chunk,
+    workers=app.config["JOB_WORKERS"],
+    chunk_size=app.config["JOB_CHUNK_SIZE"],
+    lease=app.config["JOB_LEASE"],
+    callbacks=app.config["JOB_CALLBACKS"],
+    on_start=JOB_QUEUE_SECONDS.observe,
+    on_progress=_job_progress,
+)
 
 # Main HTML template
 INDEX_TEMPLATE = """
@@ -803,6 +1399,38 @@ INDEX_TEMPLATE = """
                 fileInput.click();
             });
             
+            // Disease details are fetched once (and cached by the browser), so each
+            // prediction only needs to carry the class id and confidence
+            let diseases = null;
+            fetch('/diseases')
+                .then(response => response.ok ? response.json() : null)
+                .then(data => { diseases = data; })
+                .catch(() => {});
+            
+            // Shrink the photo on the device before sending it. The model only sees
+            // 224x224, so a JPEG with a ~299 px short side carries everything it needs
+            // in tens of KB instead of megabytes. Very elongated photos are also
+            // clamped to the server's RAW_MAX_SIDE on the long side.
+            const CLIENT_SHORT_SIDE = 299;
+            const CLIENT_MAX_SIDE = {{ raw_max_side }};
+            function downscale(img) {
+                return new Promise(resolve => {
+                    if (!img.naturalWidth || !img.naturalHeight) {
+                        resolve(null);
+                        return;
+                    }
+                    const scale = Math.min(1, CLIENT_SHORT_SIDE / Math.min(img.naturalWidth, img.naturalHeight),
+                                           CLIENT_MAX_SIDE / Math.max(img.naturalWidth, img.naturalHeight));
+                    const canvas = document.createElement('canvas');
+                    canvas.width = Math.max(1, Math.round(img.naturalWidth * scale));
+                    canvas.height = Math.max(1, Math.round(img.naturalHeight * scale));
+                    const ctx = canvas.getContext('2d');
+                    ctx.imageSmoothingQuality = 'high';
+                    ctx.drawImage(img, 0, 0, canvas.width, canvas.height);
+                    canvas.toBlob(resolve, 'image/jpeg', 0.85);
+                });
+            }
+            
             // Form submission
             uploadForm.addEventListener('submit', function(e) {
                 e.preventDefault();
@@ -818,14 +1446,34 @@ INDEX_TEMPLATE = """
                 uploadBtn.style.display = 'none';
                 loader.style.display = 'block';
                 
-                // Send request
-                fetch('/upload', {
+                // Send the downscaled JPEG as the raw body; fall back to the original
+                // file as multipart if the browser could not re-encode it or the
+                // raw route refused it as too large
+                const query = diseases ? '?compact=1' : '';
+                const multipart = () => fetch('/upload' + query, {
                     method: 'POST',
                     body: formData
-                })
+                });
+                downscale(previewImage)
+                .catch(() => null)
+                .then(blob => blob
+                    ? fetch('/upload/raw' + query, {
+                        method: 'POST',
+                        headers: {
+                            'Content-Type': 'image/jpeg',
+                            'X-Filename': encodeURIComponent(fileInput.files[0].name)
+                        },
+                        body: blob
+                    }).then(response => response.status === 413 ? multipart() : response)
+                    : multipart())
                 .then(response => response.json())
                 .then(data => {
                     if (data.success) {
+                        if (data.class_id !== undefined) {
+                            const entry = diseases.classes[data.class_id];
+                            data.disease = entry.name;
+                            data.info = entry.info;
+                        }
                         displayResults(data);
                     } else {
                         alert('Error: ' + data.error);
@@ -843,13 +1491,14 @@ INDEX_TEMPLATE = """
             
             // Display results
             function displayResults(data) {
-                // Set image
-                document.getElementById('result-image').src = '/' + data.image_path;
+                // Set image (the saved copy may still be in flight, so show the local preview)
+                document.getElementById('result-image').src = previewImage.src;
                 
                 // Set disease info
                 document.getElementById('result-title').textContent = data.disease + ' Detected';
                 document.getElementById('disease-name').textContent = data.disease;
-                document.getElementById('confidence').textContent = 'Confidence: ' + data.confidence.toFixed(1) + '%';
+                document.getElementById('confidence').textContent = 'Confidence: ' + data.confidence.toFixed(1) + '%' +
+                    (data.uncertain ? ' (uncertain, try another photo)' : '');
                 document.getElementById('confidence-value').style.width = data.confidence + '%';
                 document.getElementById('disease-description').textContent = data.info.description;
                 
@@ -916,9 +1565,265 @@ INDEX_TEMPLATE = """
 </html>
 """
 
+def json_body(payload):
+    # The text jsonify() produces outside debug mode (sorted keys, compact)
+    return app.json.dumps(payload, separators=(",", ":")) + "\n"
+
+# Serialized once: the per-class info fragments spliced into /upload responses,
+# the catalogue behind /diseases, and the index page (it has no template variables)
+CLASS_IDS = {name: index for index, name in enumerate(class_names)}
+CLASS_NAMES_JSON = [json.dumps(name) for name in class_names]
+DISEASE_INFO_JSON = {name: app.json.dumps(info, separators=(",", ":")) for name, info in disease_info.items()}
+DISEASES_PAGE = PrecomputedResponse(
+    json_body({"classes": [{"id": CLASS_IDS[name], "name": name, "info": disease_info[name]} for name in class_names]}),
+    "application/json",
+    "public, max-age=86400",
+)
+with app.app_context():
+    INDEX_PAGE = PrecomputedResponse(render_template_string(INDEX_TEMPLATE, raw_max_side=app.config["RAW_MAX_SIDE"]), "text/html; charset=utf-8")
+
+def upload_payload(result, file_path, compact=False, tta_report=None):
+    """JSON text of an /upload result (see prediction_results), keys in jsonify's sorted order.
+
+    compact leaves out the disease names and details; clients look them up by
+    class_id in /diseases. tta_report, when given, is added under "tta".
+    """
+    disease, confidence = result["disease"], result["confidence"]
+    PREDICTION_COUNTERS[disease].inc()
+    if compact:
+        top = ",".join('{"class_id":%d,"confidence":%s}' % (index, json.dumps(value))
+                       for index, value in result["top_k"])
+    else:
+        top = ",".join('{"class_id":%d,"confidence":%s,"disease":%s}' % (index, json.dumps(value), CLASS_NAMES_JSON[index])
+                       for index, value in result["top_k"])
+    tail = '"success":true,"top_k":[%s],%s"uncertain":%s}\n' % (
+        top,
+        '"tta":%s,' % app.json.dumps(tta_report, separators=(",", ":")) if tta_report is not None else "",
+        "true" if result["uncertain"] else "false",
+    )
+    if compact:
+        return '{"class_id":%d,"confidence":%s,"image_path":%s,%s' % (
+            CLASS_IDS[disease], json.dumps(confidence), json.dumps(file_path), tail)
+    return '{"confidence":%s,"disease":%s,"image_path":%s,"info":%s,%s' % (
+        json.dumps(confidence), json.dumps(disease), json.dumps(file_path), DISEASE_INFO_JSON[disease], tail)
+
+def precomputed(page):
+    status, body, headers = page.respond(request.headers.get("Accept-Encoding"), request.headers.get("If-None-Match"))
+    return Response(body, status, headers)
+
+def classify_upload(stream, filename, timer, compact=False, decode=decode_image, tta_mode="off"):
+    """Body of /upload shared with the ASGI server: returns (JSON text, status).
+
+    stream is a BytesIO holding the whole file; decode(stream, out) fills one
+    (224, 224, 3) slot. Raises Overloaded when the admission gate sheds the request.
+    """
+    # Identical bytes under the same model (and TTA policy) always give the same answer
+    version = model_version()
+    if tta_mode != "off":
+        version += "|tta=%s:%g" % (tta_mode, app.config["TTA_THRESHOLD"])
+    with stream.getbuffer() as data:
+        key = content_key(data, version)
+    cached = prediction_cache.get(key)
+    timer.lap(CACHE)
+    if cached is not None:
+        file_path = cached["image_path"]
+        if app.config["SAVE_UPLOADS"] and file_path is None:
+            file_path = save_upload_async(str(uuid.uuid4()) + os.path.splitext(filename)[1], stream.getvalue())
+            prediction_cache.put(key, dict(cached, image_path=file_path))
+        history_writer.record(os.path.basename(file_path or filename), cached["disease"], cached["confidence"])
+        timer.lap(PERSIST)
+        tta_report = dict(cached["tta"], cached=True) if cached.get("tta") else None
+        return upload_payload(cached, file_path, compact, tta_report), 200
+
+    # Cache misses need a forward pass; wait for a slot or shed the request
+    admitted_at = admit()
+    timer.lap(QUEUE)
+    try:
+        # Decode straight from the in-memory request stream
+        img_array = thread_buffer()
+        try:
+            decode(stream, img_array[0])
+        except (UnidentifiedImageError, OSError):
+            return json_body({"error": "Could not decode image"}), 400
+        timer.lap(DECODE)
+        preprocess_inplace(img_array)
+        timer.lap(PREPROCESS)
+
+        # Make prediction
+        prediction = batcher.predict(img_array)[0]
+        timer.lap(INFERENCE)
+        prediction, tta_report = apply_tta(img_array, prediction, tta_mode)
+        timer.lap(TTA)
+    finally:
+        release(1, admitted_at)
+    result = serving_results(prediction[np.newaxis])[0]
+
+    file_path = None
+    if app.config["SAVE_UPLOADS"]:
+        # Generate unique filename
+        file_path = save_upload_async(str(uuid.uuid4()) + os.path.splitext(filename)[1], stream.getvalue())
+
+    prediction_cache.put(key, dict(result, image_path=file_path, tta=tta_report))
+    history_writer.record(os.path.basename(file_path or filename), result["disease"], result["confidence"])
+    timer.lap(PERSIST)
+    return upload_payload(result, file_path, compact, tta_report), 200
+
+def classify_tiles(stream, timer, use_mask=True, aggregate="mean"):
+    """Tiled prediction for one large photo: returns (payload dict, status).
+
+    The image-level verdict comes from all scored tiles; "tiles" holds the grid
+    in original-image pixels and a per-tile heatmap (None for skipped tiles).
+    """
+    overlap = app.config["TILE_OVERLAP"]
+    try:
+        image, original = tiles.decode_working(stream, app.config["TILE_MAX_SIDE"], app.config["TILE_MAX_TILES"],
+                                               overlap)
+    except (UnidentifiedImageError, OSError):
+        return {"error": "Could not decode image"}, 400
+    timer.lap(DECODE)
+    ys, xs = tiles.grid_offsets(image.shape[0], overlap), tiles.grid_offsets(image.shape[1], overlap)
+    coverage = tiles.tile_coverage(tiles.leaf_mask(image), ys, xs)
+    keep = tiles.select(coverage, app.config["TILE_MIN_LEAF"], app.config["TILE_MAX_TILES"], use_mask)
+    rows, cols = np.nonzero(keep)
+    batch = tiles.extract(image, zip(ys[rows], xs[cols]), new_batch(len(rows)))
+    timer.lap(PREPROCESS)
+
+    # All tiles in one forward pass
+    admitted_at = admit(len(rows))
+    timer.lap(QUEUE)
+    try:
+        predictions = batcher.predict(batch)
+    finally:
+        release(len(rows), admitted_at)
+    timer.lap(INFERENCE)
+
+    result = serving_results(tiles.aggregate(predictions, coverage[keep], aggregate)[np.newaxis])[0]
+    PREDICTION_COUNTERS[result["disease"]].inc()
+    heatmap = [[None] * len(xs) for _ in ys]
+    healthy = CLASS_IDS["Healthy"]
+    for row, col, prediction in zip(rows, cols, predictions):
+        index = int(prediction.argmax())
+        heatmap[row][col] = {
+            "class_id": index,
+            "confidence": float(prediction[index]) * 100,
+            "disease_score": float(1.0 - prediction[healthy]) * 100,
+            "leaf": float(coverage[row, col]),
+        }
+    scale = original[0] / image.shape[1]
+    return {
+        "success": True,
+        "disease": result["disease"],
+        "confidence": result["confidence"],
+        "info": disease_info[result["disease"]],
+        "top_k": [{"class_id": index, "disease": class_names[index], "confidence": value}
+                  for index, value in result["top_k"]],
+        "uncertain": result["uncertain"],
+        "tiles": {
+            "image_size": list(original),
+            "tile_size": round(tiles.TILE * scale),
+            "x": [round(x * scale) for x in xs],
+            "y": [round(y * scale) for y in ys],
+            "scored": len(rows),
+            "skipped": int(keep.size - len(rows)),
+            "aggregate": aggregate,
+            "heatmap": heatmap,
+        },
+    }, 200
+
+def raw_body_limit(content_type):
+    # Largest body /upload/raw reads for this type; None if the type is not accepted
+    if content_type == RAW_RGB_TYPE:
+        return RAW_RGB_BYTES
+    if content_type in RAW_IMAGE_TYPES:
+        return app.config["RAW_MAX_BYTES"]
+    return None
+
+def decode_rgb(source, out):
+    # Pre-resized tensor: row-major uint8 RGB, already at the model's input size
+    out[...] = np.frombuffer(source.getvalue(), dtype=np.uint8).reshape(out.shape)
+
+def check_raw_upload(content_type, data):
+    """(JSON text, status) if a fully read /upload/raw body must be refused, else None."""
+    if content_type == RAW_RGB_TYPE:
+        if len(data) != RAW_RGB_BYTES:
+            return json_body({"error": "Expected %d bytes of 224x224 RGB" % RAW_RGB_BYTES}), 400
+        return None
+    if len(data) > app.config["RAW_MAX_BYTES"]:
+        return json_body({"error": "Image too large (max %d bytes)" % app.config["RAW_MAX_BYTES"]}), 413
+    # Dimensions come from the header alone, so a huge image is never decoded
+    try:
+        with Image.open(BytesIO(data)) as img:
+            size = img.size
+    except (UnidentifiedImageError, OSError):
+        return json_body({"error": "Could not decode image"}), 400
+    if max(size) > app.config["RAW_MAX_SIDE"]:
+        return json_body({"error": "Image too large (max %d px per side)" % app.config["RAW_MAX_SIDE"]}), 413
+    return None
+
+@app.before_request
+def _ensure_model_loading():
+    start_model_loading()
+
+def new_timer():
+    # Stage timers are recycled between requests rather than allocated per request
+    try:
+        timer = _timers.pop()
+    except IndexError:
+        timer = metrics.StageTimer(STAGES)
+    timer.start()
+    return timer
+
+def record_request(endpoint, status, timer, timing=False):
+    """Record one request's metrics; returns a Server-Timing value if timing is set."""
+    header = None
+    if timer is not None:
+        elapsed = time.perf_counter() - timer.started
+        REQUEST_SECONDS.labels(endpoint).observe(elapsed)
+        for histogram, seconds in zip(STAGE_HISTOGRAMS, timer.times):
+            if seconds:
+                histogram.observe(seconds)
+        if timing:
+            stages = timer.server_timing()
+            header = (stages + ", " if stages else "") + "total;dur=%.2f" % (elapsed * 1000.0)
+        _timers.append(timer)
+    REQUESTS.labels(endpoint, status).inc()
+    if status >= 500:
+        REQUEST_ERRORS.labels(endpoint).inc()
+    return header
+
+@app.before_request
+def _start_timer():
+    g.timer = new_timer()
+
+@app.after_request
+def _record_request(response):
+    header = record_request(
+        request.endpoint or "unknown",
+        response.status_code,
+        g.pop("timer", None),
+        app.config["SERVER_TIMING"] or request.args.get("timing") == "1",
+    )
+    if header:
+        response.headers["Server-Timing"] = header
+    return response
+
+@app.errorhandler(Overloaded)
+def overloaded(e):
+    timer = g.get("timer")
+    if timer is not None:
+        timer.lap(QUEUE)
+    response = jsonify({"error": "Server busy, retry later", "reason": e.reason})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response
+
 @app.route("/", methods=["GET"])
 def index():
-    return render_template_string(INDEX_TEMPLATE)
+    return precomputed(INDEX_PAGE)
+
+@app.route("/diseases", methods=["GET"])
+def diseases():
+    return precomputed(DISEASES_PAGE)
 
 @app.route("/upload", methods=["POST"])
 def upload():
@@ -926,25 +1831,182 @@ def upload():
         return jsonify({"error": "No file part"}), 400
     
     file = request.files["file"]
-    
+    timer = g.timer
+    timer.lap(PARSE)
+
     if file.filename == "":
         return jsonify({"error": "No selected file"}), 400
     
-    # Generate unique filename
-    filename = str(uuid.uuid4()) + os.path.splitext(file.filename)[1]
-    file_path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-    file.save(file_path)
-    
-    # Make prediction
-    disease, confidence = predict_disease(file_path)
-    
+    try:
+        mode = tta_mode(request.args.get("tta"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    body, status = classify_upload(file.stream, file.filename, timer, request.args.get("compact") == "1",
+                                   tta_mode=mode)
+    response = Response(body, status, mimetype="application/json")
+    timer.lap(SERIALIZE)
+    return response
+
+@app.route("/predict/tiles", methods=["POST"])
+def predict_tiles():
+    if "file" not in request.files:
+        return jsonify({"error": "No file part"}), 400
+    file = request.files["file"]
+    timer = g.timer
+    timer.lap(PARSE)
+    aggregate = request.args.get("aggregate", app.config["TILE_AGGREGATE"])
+    if aggregate not in TILE_AGGREGATES:
+        return jsonify({"error": "aggregate must be one of %s" % ", ".join(TILE_AGGREGATES)}), 400
+    payload, status = classify_tiles(file.stream, timer, request.args.get("mask", "1") != "0", aggregate)
+    response = jsonify(payload)
+    timer.lap(SERIALIZE)
+    return response, status
+
+@app.route("/upload/raw", methods=["POST"])
+def upload_raw():
+    try:
+        mode = tta_mode(request.args.get("tta"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    content_type = request.mimetype
+    limit = raw_body_limit(content_type)
+    if limit is None:
+        return jsonify({"error": "Unsupported Content-Type (use %s or %s)" % (
+            RAW_RGB_TYPE, ", ".join(sorted(RAW_IMAGE_TYPES)))}), 415
+    # Refuse on the declared length before reading any of the body
+    if request.content_length is not None and request.content_length > limit:
+        return jsonify({"error": "Payload too large (max %d bytes)" % limit}), 413
+    data = request.stream.read(limit + 1)
+    timer = g.timer
+    timer.lap(PARSE)
+    rejected = check_raw_upload(content_type, data)
+    if rejected is not None:
+        return Response(rejected[0], rejected[1], mimetype="application/json")
+
+    extension = ".rgb" if content_type == RAW_RGB_TYPE else RAW_IMAGE_TYPES[content_type]
+    # Keep the client's name for history, with the extension of what was actually sent
+    filename = (os.path.splitext(unquote(request.headers.get("X-Filename", "")))[0] or "upload") + extension
+    body, status = classify_upload(
+        BytesIO(data), filename, timer, request.args.get("compact") == "1",
+        decode_rgb if content_type == RAW_RGB_TYPE else decode_image, mode,
+    )
+    response = Response(body, status, mimetype="application/json")
+    timer.lap(SERIALIZE)
+    return response
+
+@app.route("/predict/batch", methods=["POST"])
+def predict_batch():
+    files = request.files.getlist("files") + request.files.getlist("file")
+    if not files:
+        return jsonify({"error": "No file part"}), 400
+
+    try:
+        uploads = read_batch_uploads(files, app.config["BATCH_MAX_IMAGES"])
+    except UploadTooLarge as e:
+        return jsonify({"error": str(e)}), 413
+    if not uploads:
+        return jsonify({"error": "No images found"}), 400
+
+    # Admission is per chunk, inside iter_batch_predictions; a shed before the first
+    # result raises Overloaded here, which turns into a 503
+    results = iter_batch_predictions(uploads)
+    stream = request.args.get("stream") in ("1", "true") or \
+        request.accept_mimetypes.best == "application/x-ndjson"
+    if stream:
+        first = next(results)
+        lines = (json.dumps(result) + "\n" for result in itertools.chain([first], results))
+        return Response(stream_with_context(lines), mimetype="application/x-ndjson")
+    return jsonify(list(results))
+
+@app.route("/jobs", methods=["POST"])
+def create_job():
+    files = request.files.getlist("files") + request.files.getlist("file")
+    if not files:
+        return jsonify({"error": "No file part"}), 400
+    callback_url = request.form.get("callback_url") or None
+    if callback_url is not None:
+        if not app.config["JOB_CALLBACKS"]:
+            return jsonify({"error": "Job callbacks are disabled"}), 400
+        if not callback_url.startswith(("http://", "https://")):
+            return jsonify({"error": "callback_url must be an http(s) URL"}), 400
+
+    try:
+        uploads = read_batch_uploads(files, app.config["JOB_MAX_IMAGES"])
+    except UploadTooLarge as e:
+        return jsonify({"error": str(e)}), 413
+    if not uploads:
+        return jsonify({"error": "No images found"}), 400
+
+    job = job_runner.submit(uploads, callback_url)
+    job_runner.start()
+    status_url = url_for("job_status", job_id=job["id"])
+    job["status_url"] = status_url
+    return jsonify(job), 202, {"Location": status_url}
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    try:
+        limit = min(max(int(request.args.get("limit", 100)), 1), 1000)
+        job = job_runner.status(job_id, request.args.get("cursor"), limit)
+    except (ValueError, TypeError):
+        return jsonify({"error": "Invalid limit or cursor"}), 400
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job)
+
+# ?from= and ?to= take a date or a date and time; both endpoints select the half-open range [from, to)
+@app.route("/history", methods=["GET"])
+def history_list():
+    disease = request.args.get("disease")
+    if disease and disease not in class_names:
+        return jsonify({"error": "Unknown disease"}), 400
+    try:
+        limit = min(max(int(request.args.get("limit", 50)), 1), 500)
+        items, next_cursor = history_query(
+            query_history,
+            disease=disease,
+            start=request.args.get("from"),
+            end=request.args.get("to"),
+            cursor=request.args.get("cursor"),
+            limit=limit,
+        )
+    except (ValueError, TypeError):
+        return jsonify({"error": "Invalid limit or cursor"}), 400
+    return jsonify({"items": items, "next_cursor": next_cursor})
+
+@app.route("/history/summary", methods=["GET"])
+def history_summary():
+    disease = request.args.get("disease")
+    if disease and disease not in class_names:
+        return jsonify({"error": "Unknown disease"}), 400
+    try:
+        days = history_query(daily_counts, disease=disease, start=request.args.get("from"), end=request.args.get("to"))
+    except ValueError:
+        return jsonify({"error": "Invalid from or to"}), 400
+    return jsonify({"days": days})
+
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    return jsonify({"status": "ok"})
+
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    return jsonify(model_status), 200 if model_status["state"] == "ready" else 503
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route("/stats", methods=["GET"])
+def stats():
     return jsonify({
-        "success": True,
-        "image_path": file_path,
-        "disease": disease,
-        "confidence": confidence,
-        "info": disease_info[disease]
+        "batcher": batcher.stats(),
+        "admission": admission_gate.stats(),
+        "cache": prediction_cache.stats(),
+        "history": history_writer.stats(),
+        "jobs": job_runner.stats(),
     })
 
 if __name__ == "__main__":
+    start_model_loading()
     app.run(debug=False, port=700)
@@ -0,0 +1,175 @@
+import argparse
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from io import BytesIO
+from urllib.parse import unquote
+
+from starlette.applications import Starlette
+from starlette.datastructures import UploadFile
+from starlette.exceptions import HTTPException
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Route
+
+import app as plantguard
+from admission import Overloaded
+
+# Async (ASGI) variant of the /, /diseases, /upload and /upload/raw routes:
+#
+#   python asgi_app.py --port 700
+#   uvicorn asgi_app:app --port 700 --workers 4
+#
+# Request bodies are received on the event loop, so a slow client holding an
+# upload open costs a coroutine rather than a thread. Once the whole file is in
+# memory, app.classify_upload (cache, admission, decode, inference, history) runs
+# on a dedicated executor, and the response bytes are the same as Flask's.
+
+# Threads that may block in the admission gate or on the micro-batcher; sized so
+# waiting happens in the gate's bounded queue, not in the executor's
+INFERENCE_WORKERS = int(os.environ.get(
+    "ASGI_INFERENCE_WORKERS",
+    plantguard.app.config["ADMISSION_MAX_IN_FLIGHT"] + plantguard.app.config["ADMISSION_MAX_QUEUE"],
+))
+executor = ThreadPoolExecutor(max_workers=INFERENCE_WORKERS, thread_name_prefix="asgi-inference")
+
+def json_response(payload, status=200, headers=None):
+    return Response(plantguard.json_body(payload), status_code=status, headers=headers, media_type="application/json")
+
+def precomputed(request, page):
+    status, body, headers = page.respond(request.headers.get("accept-encoding"), request.headers.get("if-none-match"))
+    return Response(body, status_code=status, headers=headers)
+
+def limit_body(receive, limit):
+    # Enforce MAX_CONTENT_LENGTH while the body streams in, chunked uploads included
+    received = 0
+
+    async def wrapped():
+        nonlocal received
+        message = await receive()
+        if message["type"] == "http.request":
+            received += len(message.get("body", b""))
+            if received > limit:
+                raise HTTPException(413)
+        return message
+
+    return wrapped
+
+async def index(request):
+    return precomputed(request, plantguard.INDEX_PAGE)
+
+async def diseases(request):
+    return precomputed(request, plantguard.DISEASES_PAGE)
+
+def timed(endpoint, handler):
+    # Per-request stage timer and request metrics, as the Flask hooks record them
+    async def run(request):
+        timer = plantguard.new_timer()
+        response = None
+        try:
+            response = await handler(request, timer)
+            return response
+        finally:
+            header = plantguard.record_request(
+                endpoint, response.status_code if response is not None else 500, timer,
+                plantguard.app.config["SERVER_TIMING"] or request.query_params.get("timing") == "1",
+            )
+            if header and response is not None:
+                response.headers["Server-Timing"] = header
+    return run
+
+async def classify(request, timer, data, filename, decode=plantguard.decode_image):
+    try:
+        mode = plantguard.tta_mode(request.query_params.get("tta"))
+    except ValueError as e:
+        return json_response({"error": str(e)}, 400)
+    loop = asyncio.get_running_loop()
+    try:
+        body, status = await loop.run_in_executor(
+            executor, plantguard.classify_upload, BytesIO(data), filename, timer,
+            request.query_params.get("compact") == "1", decode, mode)
+    except Overloaded as e:
+        timer.lap(plantguard.QUEUE)
+        return json_response({"error": "Server busy, retry later", "reason": e.reason}, 503,
+                             {"Retry-After": str(e.retry_after)})
+    response = Response(body, status_code=status, media_type="application/json")
+    timer.lap(plantguard.SERIALIZE)
+    return response
+
+async def upload(request, timer):
+    limit = plantguard.app.config["MAX_CONTENT_LENGTH"]
+    if int(request.headers.get("content-length") or 0) > limit:
+        return json_response({"error": "File too large"}, 413)
+    request = Request(request.scope, limit_body(request.receive, limit))
+    try:
+        form = await request.form(max_files=1)
+    except HTTPException as e:
+        if e.status_code == 413:
+            return json_response({"error": "File too large"}, 413)
+        raise
+    try:
+        file = form.get("file")
+        if not isinstance(file, UploadFile):
+            return json_response({"error": "No file part"}, 400)
+        timer.lap(plantguard.PARSE)
+        if not file.filename:
+            return json_response({"error": "No selected file"}, 400)
+        data = await file.read()
+    finally:
+        await form.close()
+    return await classify(request, timer, data, file.filename)
+
+async def upload_raw(request, timer):
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    limit = plantguard.raw_body_limit(content_type)
+    if limit is None:
+        return json_response({"error": "Unsupported Content-Type (use %s or %s)" % (
+            plantguard.RAW_RGB_TYPE, ", ".join(sorted(plantguard.RAW_IMAGE_TYPES)))}, 415)
+    if int(request.headers.get("content-length") or 0) > limit:
+        return json_response({"error": "Payload too large (max %d bytes)" % limit}, 413)
+    data = bytearray()
+    async for chunk in request.stream():
+        data += chunk
+        if len(data) > limit:
+            break  # no need to receive the rest
+    data = bytes(data)
+    timer.lap(plantguard.PARSE)
+    rejected = plantguard.check_raw_upload(content_type, data)
+    if rejected is not None:
+        return Response(rejected[0], status_code=rejected[1], media_type="application/json")
+
+    rgb = content_type == plantguard.RAW_RGB_TYPE
+    extension = ".rgb" if rgb else plantguard.RAW_IMAGE_TYPES[content_type]
+    filename = (os.path.splitext(unquote(request.headers.get("x-filename", "")))[0] or "upload") + extension
+    return await classify(request, timer, data, filename, plantguard.decode_rgb if rgb else plantguard.decode_image)
+
+@asynccontextmanager
+async def lifespan(app):
+    plantguard.start_model_loading()
+    yield
+    executor.shutdown(wait=True)
+    plantguard.shutdown()
+
+app = Starlette(
+    routes=[
+        Route("/", index, methods=["GET"]),
+        Route("/diseases", diseases, methods=["GET"]),
+        Route("/upload", timed("upload", upload), methods=["POST"]),
+        Route("/upload/raw", timed("upload_raw", upload_raw), methods=["POST"]),
+    ],
+    lifespan=lifespan,
+)
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Run the async PlantGuard server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=700)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+    uvicorn.run("asgi_app:app", host=args.host, port=args.port, workers=args.workers)
+
+if __name__ == "__main__":
+    main()
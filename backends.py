@@ -0,0 +1,110 @@
+import os
+
+import numpy as np
+
+# Inference backends share one interface: predict(batch) -> softmax probabilities.
+# batch is float32 (N, 224, 224, 3), already scaled by preprocess_inplace.
+
+class KerasBackend:
+    name = "keras"
+
+    def __init__(self, path, num_threads=None):
+        import tensorflow as tf
+        if num_threads:
+            try:
+                tf.config.threading.set_intra_op_parallelism_threads(num_threads)
+                tf.config.threading.set_inter_op_parallelism_threads(1)
+            except RuntimeError:
+                pass  # TF runtime already initialised in this process; keep its pools
+        self.model = tf.keras.models.load_model(path, compile=False)
+
+    def predict(self, batch):
+        return np.asarray(self.model.predict_on_batch(batch))
+
+class TFLiteBackend:
+    name = "tflite"
+
+    def __init__(self, path, num_threads=None, xnnpack=True):
+        try:
+            from ai_edge_litert.interpreter import Interpreter, OpResolverType
+        except ImportError:
+            try:
+                from tflite_runtime.interpreter import Interpreter, OpResolverType
+            except ImportError:
+                import tensorflow as tf
+                Interpreter, OpResolverType = tf.lite.Interpreter, tf.lite.experimental.OpResolverType
+        # The default XNNPACK delegate repacks every weight into private memory, so
+        # each process holds its own copy. Without it the builtin kernels read the
+        # weights straight from the memory-mapped file, shared with every other
+        # process serving it, at several times the latency.
+        resolver = OpResolverType.AUTO if xnnpack else OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES
+        self.interpreter = Interpreter(model_path=path, num_threads=num_threads, experimental_op_resolver_type=resolver)
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+        self.batch_size = None
+
+    def _resize(self, batch_size):
+        # The interpreter has a static shape; re-plan only when the batch size changes
+        if batch_size != self.batch_size:
+            self.interpreter.resize_tensor_input(self.input["index"], (batch_size, 224, 224, 3))
+            self.interpreter.allocate_tensors()
+            self.input = self.interpreter.get_input_details()[0]
+            self.output = self.interpreter.get_output_details()[0]
+            self.batch_size = batch_size
+
+    def predict(self, batch):
+        self._resize(len(batch))
+        if self.input["dtype"] != np.float32:
+            # Fully integer model: quantize the input with the tensor's own scale
+            scale, zero_point = self.input["quantization"]
+            batch = np.clip(np.round(batch / scale + zero_point), *_dtype_range(self.input["dtype"]))
+            batch = batch.astype(self.input["dtype"])
+        self.interpreter.set_tensor(self.input["index"], batch)
+        self.interpreter.invoke()
+        output = self.interpreter.get_tensor(self.output["index"])
+        if self.output["dtype"] != np.float32:
+            scale, zero_point = self.output["quantization"]
+            output = (output.astype(np.float32) - zero_point) * scale
+        return output
+
+class OnnxBackend:
+    name = "onnx"
+
+    def __init__(self, path, num_threads=None):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+            options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, batch):
+        return self.session.run(None, {self.input_name: batch})[0]
+
+BACKENDS = {
+    "keras": KerasBackend,
+    "tflite": TFLiteBackend,
+    "onnx": OnnxBackend,
+}
+
+def _dtype_range(dtype):
+    info = np.iinfo(dtype)
+    return info.min, info.max
+
+def backend_for_path(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".tflite":
+        return "tflite"
+    if ext == ".onnx":
+        return "onnx"
+    return "keras"
+
+def load_backend(path, kind=None, num_threads=None, xnnpack=True):
+    kind = kind or backend_for_path(path)
+    if kind not in BACKENDS:
+        raise ValueError("Unknown inference backend %r (expected one of %s)" % (kind, ", ".join(BACKENDS)))
+    if kind == "tflite":
+        return TFLiteBackend(path, num_threads=num_threads, xnnpack=xnnpack)
+    return BACKENDS[kind](path, num_threads=num_threads)
@@ -0,0 +1,127 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from backends import load_backend
+from benchmarks.bench_slow_clients import server_resources
+from convert_model import calibration_files
+from preprocessing import load_image_array, new_batch
+
+# Compare inference backends on the same inputs. Each artifact runs in its own
+# process so peak RSS is attributable to that backend alone; the first artifact
+# is the reference for top-1 agreement. private_dirty_mb is the memory a process
+# cannot share with others serving the same file (weights repacked by XNNPACK,
+# arenas); compare with --no-xnnpack for .tflite artifacts.
+#
+#   python -m benchmarks.bench_backends model.h5 models/model_float16.tflite \
+#       models/model_int8.tflite models/model_int8.onnx --images "MangoLeafBD Dataset/test"
+
+def make_inputs(images_dir, count, seed=0):
+    if images_dir:
+        files = calibration_files(images_dir, count, seed=seed)
+        batch = new_batch(len(files))
+        for i, path in enumerate(files):
+            load_image_array(path, out=batch[i:i + 1])
+        return batch
+    # No dataset: uniform noise in the preprocessed [-1, 1] range
+    return np.random.default_rng(seed).uniform(-1, 1, size=(count, 224, 224, 3)).astype(np.float32)
+
+def percentile_ms(samples, q):
+    return float(np.percentile(samples, q) * 1000.0)
+
+def run_child(path, inputs_path, batch_sizes, iterations, threads, xnnpack):
+    inputs = np.load(inputs_path, mmap_mode="r")
+    start = time.perf_counter()
+    backend = load_backend(path, num_threads=threads, xnnpack=xnnpack)
+    load_seconds = time.perf_counter() - start
+
+    predictions = []
+    size = max(batch_sizes)
+    for offset in range(0, len(inputs), size):
+        predictions.append(backend.predict(np.ascontiguousarray(inputs[offset:offset + size])))
+    predictions = np.concatenate(predictions)
+
+    results = []
+    for batch_size in batch_sizes:
+        batch = np.ascontiguousarray(inputs[:batch_size])
+        if len(batch) < batch_size:
+            batch = np.resize(batch, (batch_size,) + batch.shape[1:])
+        backend.predict(batch)  # warm-up for this shape
+        samples = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            backend.predict(batch)
+            samples.append(time.perf_counter() - start)
+        results.append({
+            "batch_size": batch_size,
+            "p50_ms": percentile_ms(samples, 50),
+            "p95_ms": percentile_ms(samples, 95),
+            "images_per_second": batch_size / float(np.median(samples)),
+        })
+
+    return {
+        "artifact": path,
+        "backend": backend.name,
+        "size_mb": os.path.getsize(path) / 1e6,
+        "load_seconds": load_seconds,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+        "private_dirty_mb": server_resources(os.getpid())["private_dirty_mb"],
+        "xnnpack": xnnpack if backend.name == "tflite" else None,
+        "latency": results,
+        "top1": predictions.argmax(axis=1).tolist(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Keras / TFLite / ONNX Runtime artifacts")
+    parser.add_argument("artifacts", nargs="+")
+    parser.add_argument("--images", default=None, help="class-folder dataset to draw inputs from")
+    parser.add_argument("--count", type=int, default=128)
+    parser.add_argument("--batch-sizes", default="1,8,32")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--no-xnnpack", action="store_true", help="run .tflite artifacts without the XNNPACK delegate")
+    parser.add_argument("--output", default=None, help="write the JSON report here instead of stdout")
+    parser.add_argument("--child-inputs", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    batch_sizes = [int(size) for size in args.batch_sizes.split(",")]
+
+    if args.child_inputs:
+        report = run_child(args.artifacts[0], args.child_inputs, batch_sizes, args.iterations, args.threads,
+                           not args.no_xnnpack)
+        json.dump(report, sys.stdout)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        inputs_path = os.path.join(tmp, "inputs.npy")
+        np.save(inputs_path, make_inputs(args.images, args.count))
+        reports = []
+        for path in args.artifacts:
+            cmd = [sys.executable, "-m", "benchmarks.bench_backends", path,
+                   "--child-inputs", inputs_path, "--batch-sizes", args.batch_sizes,
+                   "--iterations", str(args.iterations)]
+            if args.threads:
+                cmd += ["--threads", str(args.threads)]
+            if args.no_xnnpack:
+                cmd += ["--no-xnnpack"]
+            out = subprocess.run(cmd, check=True, stdout=subprocess.PIPE).stdout
+            reports.append(json.loads(out.decode().strip().splitlines()[-1]))
+
+    reference = np.asarray(reports[0]["top1"])
+    for report in reports:
+        report["top1_agreement"] = float(np.mean(np.asarray(report.pop("top1")) == reference))
+
+    text = json.dumps(reports, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
+
+if __name__ == "__main__":
+    main()
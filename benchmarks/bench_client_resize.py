@@ -0,0 +1,107 @@
+import argparse
+import json
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from app import decode_rgb
+from convert_model import calibration_files
+from preprocessing import decode_image, new_batch, preprocess_inplace
+
+# What the page's client-side downscaling saves: upload bytes (and transfer time
+# on slow links) and server decode time, for the original photo, the ~299 px JPEG
+# the page now sends to /upload/raw, and a raw 224x224 RGB tensor. With --model,
+# also the top-1 agreement between predictions on the original and the resized JPEG.
+#
+#   python -m benchmarks.bench_client_resize --images "MangoLeafBD Dataset/test" --model model.h5
+
+SHORT_SIDE = 299
+QUALITY = 85
+
+def client_jpeg(data):
+    # What the INDEX_TEMPLATE canvas does: short side to 299 px, JPEG quality 0.85
+    with Image.open(BytesIO(data)) as img:
+        img = img.convert("RGB")
+        scale = min(1.0, SHORT_SIDE / min(img.size))
+        size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+        img = img.resize(size, Image.BICUBIC)
+        out = BytesIO()
+        img.save(out, format="JPEG", quality=QUALITY)
+    return out.getvalue()
+
+def client_rgb(data):
+    out = np.empty((224, 224, 3), dtype=np.uint8)
+    decode_image(BytesIO(data), out)
+    return out.tobytes()
+
+def decode_seconds(decode, data, repeat):
+    out = new_batch(1)[0]
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        decode(BytesIO(data), out)
+        samples.append(time.perf_counter() - start)
+    return float(np.median(samples))
+
+def main():
+    parser = argparse.ArgumentParser(description="Bytes and server decode time saved by client-side downscaling")
+    parser.add_argument("--images", default=None, help="class-folder dataset (default: img.jpg)")
+    parser.add_argument("--count", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--link-kbps", default="50,384,2000", help="link speeds for upload time estimates")
+    parser.add_argument("--model", default=None, help="also compare top-1 predictions on original vs resized")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    files = calibration_files(args.images, args.count) if args.images else ["img.jpg"]
+    modes = {"original": [], "client_jpeg": [], "raw_rgb": []}
+    decode = {"original": [], "client_jpeg": [], "raw_rgb": []}
+    originals, resized = [], []
+    for path in files:
+        with open(path, "rb") as f:
+            data = f.read()
+        small, rgb = client_jpeg(data), client_rgb(data)
+        for mode, payload, fn in (("original", data, decode_image), ("client_jpeg", small, decode_image),
+                                  ("raw_rgb", rgb, decode_rgb)):
+            modes[mode].append(len(payload))
+            decode[mode].append(decode_seconds(fn, payload, args.repeat))
+        originals.append(data)
+        resized.append(small)
+
+    links = [float(kbps) for kbps in args.link_kbps.split(",")]
+    report = {"images": len(files), "modes": {}}
+    for mode in modes:
+        mean_bytes = float(np.mean(modes[mode]))
+        report["modes"][mode] = {
+            "mean_bytes": mean_bytes,
+            "mean_decode_ms": float(np.mean(decode[mode]) * 1000.0),
+            "upload_seconds": {"%g_kbps" % kbps: mean_bytes * 8 / (kbps * 1000.0) for kbps in links},
+        }
+    base = report["modes"]["original"]
+    for mode in ("client_jpeg", "raw_rgb"):
+        entry = report["modes"][mode]
+        entry["bytes_saved_pct"] = 100.0 * (1.0 - entry["mean_bytes"] / base["mean_bytes"])
+        entry["decode_ms_saved"] = base["mean_decode_ms"] - entry["mean_decode_ms"]
+
+    if args.model:
+        from backends import load_backend
+        backend = load_backend(args.model)
+
+        def top1(payloads):
+            batch = new_batch(len(payloads))
+            for i, payload in enumerate(payloads):
+                decode_image(BytesIO(payload), batch[i])
+            return backend.predict(preprocess_inplace(batch)).argmax(axis=1)
+
+        report["top1_agreement"] = float(np.mean(top1(originals) == top1(resized)))
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import argparse
+import json
+import time
+
+from train import (HEIGHT_SHIFT_RANGE, HORIZONTAL_FLIP, IMAGE_SIZE, ROTATION_RANGE, SHEAR_RANGE,
+                   WIDTH_SHIFT_RANGE, ZOOM_RANGE, build_dataset)
+
+# Images/second of the notebook's ImageDataGenerator.flow_from_directory versus
+# the tf.data pipeline in train.py, over full epochs of the same directory.
+#
+#   python -m benchmarks.bench_input_pipeline --data-dir "MangoLeafBD Dataset/train"
+
+def make_generator(directory, batch_size):
+    from tensorflow.keras.preprocessing.image import ImageDataGenerator
+    datagen = ImageDataGenerator(
+        rescale=1./255,
+        rotation_range=ROTATION_RANGE,
+        width_shift_range=WIDTH_SHIFT_RANGE,
+        height_shift_range=HEIGHT_SHIFT_RANGE,
+        shear_range=SHEAR_RANGE,
+        zoom_range=ZOOM_RANGE,
+        horizontal_flip=HORIZONTAL_FLIP,
+        fill_mode='nearest')
+    return datagen.flow_from_directory(directory, target_size=IMAGE_SIZE, batch_size=batch_size,
+                                       class_mode='categorical')
+
+def time_generator(directory, batch_size, epochs):
+    generator = make_generator(directory, batch_size)
+    results = []
+    for epoch in range(epochs):
+        start = time.perf_counter()
+        images = 0
+        for _ in range(len(generator)):
+            x, _ = next(generator)
+            images += len(x)
+        results.append(images / (time.perf_counter() - start))
+    return results
+
+def time_dataset(directory, batch_size, epochs, cache):
+    dataset, _ = build_dataset(directory, batch_size=batch_size, training=True, cache=cache)
+    results = []
+    for epoch in range(epochs):
+        start = time.perf_counter()
+        images = 0
+        for x, _ in dataset:
+            images += int(x.shape[0])
+        results.append(images / (time.perf_counter() - start))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ImageDataGenerator against the tf.data pipeline")
+    parser.add_argument("--data-dir", default="MangoLeafBD Dataset/train")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--epochs", type=int, default=3)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    report = {
+        "data_dir": args.data_dir,
+        "batch_size": args.batch_size,
+        "image_data_generator": time_generator(args.data_dir, args.batch_size, args.epochs),
+        "tf_data_no_cache": time_dataset(args.data_dir, args.batch_size, args.epochs, None),
+        "tf_data_memory_cache": time_dataset(args.data_dir, args.batch_size, args.epochs, ""),
+    }
+    report["units"] = "images/second per epoch"
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
+
+if __name__ == "__main__":
+    main()
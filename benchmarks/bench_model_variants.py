@@ -0,0 +1,100 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+# CPU latency is what the serving workers see; hide GPUs before TensorFlow loads
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "-1")
+
+from backends import load_backend
+from calibration import load_temperature, reliability, temperature_scale
+from train import build_dataset
+
+# Compare classifier-head variants (train.py --variant, optionally distilled):
+# parameter count, artifact size, CPU latency, accuracy and calibration (ECE,
+# NLL, Brier; also after temperature scaling when the artifact has a
+# calibration file) on the test split.
+#
+#   python train.py --variant gap --distill-from model.h5 --output model_gap.h5
+#   python -m benchmarks.bench_model_variants model.h5 model_gap.h5 model_attention.h5 \
+#       --test-dir "MangoLeafBD Dataset/test"
+#
+# Test images go through train.py's evaluation pipeline, so --scale must match
+# the one the models were trained with.
+
+def parameter_count(backend):
+    model = getattr(backend, "model", None)
+    return int(model.count_params()) if model is not None else None
+
+def latency(backend, batch_sizes, iterations, seed=0):
+    rng = np.random.default_rng(seed)
+    results = []
+    for batch_size in batch_sizes:
+        batch = rng.uniform(-1, 1, size=(batch_size, 224, 224, 3)).astype(np.float32)
+        backend.predict(batch)  # warm-up for this shape
+        samples = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            backend.predict(batch)
+            samples.append(time.perf_counter() - start)
+        results.append({
+            "batch_size": batch_size,
+            "p50_ms": float(np.percentile(samples, 50) * 1000.0),
+            "p95_ms": float(np.percentile(samples, 95) * 1000.0),
+        })
+    return results
+
+def evaluate(backend, test_set, temperature, bins):
+    outputs, targets = [], []
+    for images, labels in test_set:
+        outputs.append(backend.predict(np.asarray(images)))
+        targets.append(np.asarray(labels).argmax(axis=1))
+    probabilities, labels = np.concatenate(outputs), np.concatenate(targets)
+    report = {"raw": reliability(probabilities, labels, bins)}
+    if temperature != 1.0:
+        report["calibrated"] = dict(reliability(temperature_scale(probabilities, temperature), labels, bins),
+                                    temperature=temperature)
+    for entry in report.values():
+        del entry["bins"]
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare model variants on size, CPU latency and accuracy")
+    parser.add_argument("artifacts", nargs="+")
+    parser.add_argument("--test-dir", default="MangoLeafBD Dataset/test")
+    parser.add_argument("--scale", choices=("rescale", "inception"), default="rescale")
+    parser.add_argument("--batch-size", type=int, default=32, help="batch size for the accuracy pass")
+    parser.add_argument("--batch-sizes", default="1,32", help="batch sizes for the latency measurement")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--bins", type=int, default=15, help="confidence bins for ECE")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+    batch_sizes = [int(size) for size in args.batch_sizes.split(",")]
+
+    test_set, _ = build_dataset(args.test_dir, batch_size=args.batch_size, training=False,
+                                cache=None, scale=args.scale)
+    reports = []
+    for path in args.artifacts:
+        backend = load_backend(path, num_threads=args.threads)
+        reliabilities = evaluate(backend, test_set, load_temperature(path), args.bins)
+        reports.append({
+            "artifact": path,
+            "backend": backend.name,
+            "parameters": parameter_count(backend),
+            "size_mb": os.path.getsize(path) / 1e6,
+            "latency": latency(backend, batch_sizes, args.iterations),
+            "test_accuracy": reliabilities["raw"]["accuracy"],
+            "reliability": reliabilities,
+        })
+
+    text = json.dumps(reports, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
+
+if __name__ == "__main__":
+    main()
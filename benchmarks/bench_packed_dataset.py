@@ -0,0 +1,110 @@
+import argparse
+import json
+import os
+import resource
+import tempfile
+import time
+
+import image_pack
+from benchmarks.bench_input_pipeline import make_generator
+from image_pack import PackedImages
+from classes import labelled_files
+from train import build_dataset
+
+# Epoch time and I/O of the notebook's flow_from_directory, train.py's tf.data
+# pipeline over the JPEG folders, and the same pipeline over an image_pack.py
+# store. "numpy_views" iterates the store's batches with no TensorFlow at all,
+# the floor for reading it.
+#
+# I/O per epoch comes from /proc/self/io: rchar counts read() calls (JPEG files),
+# read_bytes what actually came off the disk; pages of a memory-mapped shard only
+# show up in read_bytes and major page faults. Once the page cache is warm both
+# drop to ~0 for the packed store, so the first epoch is the cold one.
+#
+#   python -m benchmarks.bench_packed_dataset --data-dir "MangoLeafBD Dataset/train" --packed-dir packed/train
+
+def io_counters():
+    counters = {}
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                key, value = line.split(":")
+                counters[key] = int(value)
+    except OSError:
+        pass  # not Linux
+    counters["major_faults"] = resource.getrusage(resource.RUSAGE_SELF).ru_majflt
+    return counters
+
+def time_epochs(batches, epochs):
+    # batches() returns a fresh iterable of (images, labels) for one epoch
+    results = []
+    for _ in range(epochs):
+        before = io_counters()
+        start = time.perf_counter()
+        images = 0
+        for x, _ in batches():
+            images += int(x.shape[0])
+        seconds = time.perf_counter() - start
+        after = io_counters()
+        results.append({
+            "seconds": seconds,
+            "images_per_second": images / seconds,
+            "rchar_mb": (after.get("rchar", 0) - before.get("rchar", 0)) / 1e6,
+            "read_mb": (after.get("read_bytes", 0) - before.get("read_bytes", 0)) / 1e6,
+            "major_faults": after["major_faults"] - before["major_faults"],
+        })
+    return results
+
+def generator_epochs(directory, batch_size, epochs):
+    generator = make_generator(directory, batch_size)
+    return time_epochs(lambda: (next(generator) for _ in range(len(generator))), epochs)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark a packed dataset against JPEG folders")
+    parser.add_argument("--data-dir", default="MangoLeafBD Dataset/train")
+    parser.add_argument("--packed-dir", default=None, help="image_pack.py store of --data-dir (default: pack to a temp dir)")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--epochs", type=int, default=3)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    paths, labels, classes = labelled_files(args.data_dir)
+    temp = None
+    if args.packed_dir is None:
+        temp = tempfile.TemporaryDirectory()
+        args.packed_dir = temp.name
+        start = time.perf_counter()
+        PackedImages.write(args.packed_dir, image_pack.training_chunks(paths, labels, 256), classes,
+                           "training", args.data_dir)
+        pack_seconds = time.perf_counter() - start
+    else:
+        pack_seconds = None
+    store = PackedImages(args.packed_dir)
+
+    def dataset_epochs(directory):
+        dataset, _ = build_dataset(directory, batch_size=args.batch_size, training=True, cache=None)
+        return time_epochs(lambda: dataset, args.epochs)
+
+    report = {
+        "data_dir": args.data_dir,
+        "packed_dir": None if temp is not None else args.packed_dir,
+        "batch_size": args.batch_size,
+        "images": len(store),
+        "source_mb": sum(os.path.getsize(path) for path in paths) / 1e6,
+        "packed_mb": store.nbytes / 1e6,
+        "pack_seconds": pack_seconds,
+        "flow_from_directory": generator_epochs(args.data_dir, args.batch_size, args.epochs),
+        "tf_data_jpeg": dataset_epochs(args.data_dir),
+        "tf_data_packed": dataset_epochs(args.packed_dir),
+        "numpy_views": time_epochs(lambda: store.batches(args.batch_size), args.epochs),
+    }
+    if temp is not None:
+        temp.cleanup()
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
+
+if __name__ == "__main__":
+    main()
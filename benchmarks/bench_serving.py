@@ -0,0 +1,268 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import numpy as np
+
+from benchmarks.bench_slow_clients import (free_port, make_image, multipart_body, send_upload, server_resources,
+                                           wait_ready)
+
+# What the serving stack delivers, end to end, as one JSON report:
+#   cold_start   process start -> app imported -> model loaded and warmed -> first prediction
+#   latency      predict_disease() on one image (decode, micro-batcher, forward)
+#   stages       decode, resize, preprocess_input, forward, serialize of one /upload, timed apart
+#   throughput   forward passes at several batch sizes
+#   http         POST /upload against the Flask app at several client concurrencies
+#   memory       peak RSS of the in-process run and of the HTTP server
+#
+# Without model.h5 (or with --synthetic) a small randomly initialised Keras model
+# with the same input and output shape stands in, so the suite runs offline and
+# the serving overhead around the model can still be tracked. --synthetic
+# inception builds the real architecture with random weights instead, for
+# representative forward-pass cost without the trained file.
+#
+#   python -m benchmarks.bench_serving --output bench/serving.json
+#   python -m benchmarks.bench_serving --synthetic tiny --http-concurrency 1,8,32
+#   BATCH_MAX_SIZE=32 python -m benchmarks.bench_serving --baseline bench/serving.json
+#
+# Serving settings (BATCH_MAX_SIZE, DECODE_WORKERS, INFERENCE_BACKEND, ...) come
+# from the environment as they do for app.py and are recorded in the report.
+
+SYNTHETIC_MODELS = ("tiny", "inception")
+CONFIG_KEYS = ("MODEL_PATH", "INFERENCE_BACKEND", "INFERENCE_THREADS", "TEMPERATURE", "BATCH_MAX_SIZE",
+               "BATCH_TIMEOUT_MS", "ADMISSION_MAX_IN_FLIGHT", "ADMISSION_MAX_QUEUE", "DECODE_WORKERS",
+               "WARMUP_BATCH_SIZES", "TTA_MODE", "TOP_K")
+
+def synthetic_model(path, kind="tiny", num_classes=6, seed=0):
+    import tensorflow as tf
+    tf.keras.utils.set_random_seed(seed)
+    if kind == "inception":
+        from train import build_model
+        model = build_model(num_classes=num_classes, weights=None)
+    else:
+        model = tf.keras.Sequential([
+            tf.keras.layers.Input((224, 224, 3)),
+            tf.keras.layers.Conv2D(16, 3, strides=4, activation="relu"),
+            tf.keras.layers.Conv2D(32, 3, strides=2, activation="relu"),
+            tf.keras.layers.GlobalAveragePooling2D(),
+            tf.keras.layers.Dense(num_classes, activation="softmax"),
+        ])
+    model.save(path)
+    return path
+
+def summary_ms(samples):
+    samples = np.asarray(samples) * 1000.0
+    return {
+        "p50_ms": float(np.percentile(samples, 50)),
+        "p95_ms": float(np.percentile(samples, 95)),
+        "p99_ms": float(np.percentile(samples, 99)),
+        "mean_ms": float(samples.mean()),
+    }
+
+def stage_breakdown(app, backend, data, iterations):
+    # preprocessing.decode_image split in two (draft decode + convert, then resize), then the rest of /upload
+    from PIL import Image
+    from preprocessing import TARGET_SIZE, new_batch, preprocess_inplace
+    from calibration import temperature_scale
+    batch = new_batch(1)
+    times = {stage: [] for stage in ("decode", "resize", "preprocess", "forward", "serialize")}
+    for _ in range(iterations):
+        start = time.perf_counter()
+        with Image.open(BytesIO(data)) as img:
+            img.draft("RGB", TARGET_SIZE)
+            img = img.convert("RGB")
+        decoded = time.perf_counter()
+        if img.size != TARGET_SIZE:
+            img = img.resize(TARGET_SIZE, Image.NEAREST)
+        batch[0] = np.asarray(img)
+        resized = time.perf_counter()
+        preprocess_inplace(batch)
+        preprocessed = time.perf_counter()
+        prediction = temperature_scale(backend.predict(batch), app.app.config["TEMPERATURE"])
+        forwarded = time.perf_counter()
+        app.upload_payload(app.serving_results(prediction)[0], None)
+        done = time.perf_counter()
+        for stage, (a, b) in zip(times, ((start, decoded), (decoded, resized), (resized, preprocessed),
+                                         (preprocessed, forwarded), (forwarded, done))):
+            times[stage].append(b - a)
+    return {stage: summary_ms(samples) for stage, samples in times.items()}
+
+def batch_throughput(backend, batch_sizes, iterations, seed=0):
+    inputs = np.random.default_rng(seed).uniform(-1, 1, size=(max(batch_sizes), 224, 224, 3)).astype(np.float32)
+    results = []
+    for batch_size in batch_sizes:
+        batch = np.ascontiguousarray(inputs[:batch_size])
+        backend.predict(batch)  # warm-up for this shape
+        samples = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            backend.predict(batch)
+            samples.append(time.perf_counter() - start)
+        results.append(dict(summary_ms(samples), batch_size=batch_size,
+                            images_per_second=batch_size / float(np.median(samples))))
+    return results
+
+def run_child(args, started_at):
+    """In-process part of the suite, in a fresh process so cold start and peak RSS are its own."""
+    start = time.perf_counter()
+    import app
+    import_seconds = time.perf_counter() - start
+    app.get_model()
+    image = make_image(args.image)
+    with tempfile.NamedTemporaryFile(suffix=".jpg") as f:
+        f.write(image)
+        f.flush()
+        first = time.perf_counter()
+        app.predict_disease(f.name)
+        first_prediction_seconds = time.perf_counter() - first
+        cold_start = {
+            "import_app_seconds": import_seconds,
+            "load_seconds": app.model_status["load_seconds"],
+            "warmup_seconds": app.model_status["warmup_seconds"],
+            "first_prediction_ms": first_prediction_seconds * 1000.0,
+            # Wall clock from the parent's Popen, so interpreter start-up is included
+            "process_to_first_prediction_seconds": time.time() - started_at,
+            "rss_after_first_prediction_mb": server_resources(os.getpid())["rss_mb"],
+        }
+
+        samples = []
+        for _ in range(args.iterations):
+            began = time.perf_counter()
+            app.predict_disease(f.name)
+            samples.append(time.perf_counter() - began)
+
+    backend = app.get_model()
+    report = {
+        "config": {key: app.app.config[key] for key in CONFIG_KEYS},
+        "backend": backend.name,
+        "cold_start": cold_start,
+        "latency": summary_ms(samples),
+        "stages": stage_breakdown(app, backend, image, args.iterations),
+        "throughput": batch_throughput(backend, args.batch_sizes, args.iterations),
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+    }
+    app.shutdown()
+    return report
+
+def http_load(args, env):
+    port = free_port()
+    cmd = [sys.executable, "-m", "benchmarks.bench_slow_clients", "--serve", "flask",
+           "--port", str(port), "--threads", str(args.http_threads)]
+    server = subprocess.Popen(cmd, env=env)
+    try:
+        wait_ready(port, multipart_body(make_image(args.image)))
+        results = []
+        seed = 1
+        for concurrency in args.http_concurrency:
+            # Distinct images so every request misses the prediction cache
+            bodies = [multipart_body(make_image(None, seed=seed + i)) for i in range(args.http_requests)]
+            seed += args.http_requests
+            start = time.perf_counter()
+            with ThreadPoolExecutor(concurrency) as pool:
+                responses = list(pool.map(lambda body: send_upload(port, body), bodies))
+            wall = time.perf_counter() - start
+            ok = [seconds for status, seconds in responses if status == 200]
+            statuses = {}
+            for status, _ in responses:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+            results.append(dict(summary_ms(ok) if ok else {}, concurrency=concurrency, requests=len(bodies),
+                                statuses=statuses, requests_per_second=len(ok) / wall))
+        resources = server_resources(server.pid)
+    finally:
+        server.terminate()
+        server.wait()
+    return results, resources
+
+def flatten(report, prefix=""):
+    values = {}
+    for key, value in report.items() if isinstance(report, dict) else enumerate(report):
+        name = "%s%s" % (prefix, key)
+        if isinstance(value, (dict, list)):
+            values.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[name] = value
+    return values
+
+def compare(report, baseline):
+    """Every numeric value present in both reports, with current / baseline."""
+    current, previous = flatten(report), flatten(baseline)
+    return {
+        key: {"baseline": previous[key], "current": current[key],
+              "ratio": current[key] / previous[key] if previous[key] else None}
+        for key in sorted(current.keys() & previous.keys())
+        if not key.startswith(("config.", "meta.", "vs_baseline."))
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the serving stack: cold start, latency, throughput, HTTP, memory")
+    parser.add_argument("--model", default=os.environ.get("MODEL_PATH", "model.h5"))
+    parser.add_argument("--synthetic", choices=SYNTHETIC_MODELS, default=None,
+                        help="benchmark a randomly initialised stand-in model (default when --model is missing: tiny)")
+    parser.add_argument("--image", default=None, help="JPEG to classify (default: a generated 640x480 image)")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--batch-sizes", default="1,8,16,32")
+    parser.add_argument("--http-concurrency", default="1,4,16", help="comma-separated client counts; empty to skip")
+    parser.add_argument("--http-requests", type=int, default=100, help="uploads per concurrency level")
+    parser.add_argument("--http-threads", type=int, default=16, help="request threads of the Flask server")
+    parser.add_argument("--baseline", default=None, help="earlier report to compare against")
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--child", type=float, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.batch_sizes = [int(size) for size in args.batch_sizes.split(",")]
+    args.http_concurrency = [int(n) for n in args.http_concurrency.split(",") if n]
+
+    if args.child is not None:
+        json.dump(run_child(args, args.child), sys.stdout)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        synthetic = args.synthetic or (None if os.path.exists(args.model) else "tiny")
+        if synthetic:
+            args.model = synthetic_model(os.path.join(tmp, "synthetic_%s.h5" % synthetic), synthetic)
+        # Keep benchmark traffic out of the real history database, upload folder and job spool
+        env = dict(os.environ, MODEL_PATH=args.model, SAVE_UPLOADS="0",
+                   HISTORY_DB=os.path.join(tmp, "history.db"), JOBS_DIR=os.path.join(tmp, "jobs"))
+
+        cmd = [sys.executable, "-m", "benchmarks.bench_serving", "--child", repr(time.time()),
+               "--iterations", str(args.iterations), "--batch-sizes", ",".join(map(str, args.batch_sizes))]
+        if args.image:
+            cmd += ["--image", args.image]
+        out = subprocess.run(cmd, env=env, check=True, stdout=subprocess.PIPE).stdout
+        child = json.loads(out.decode().strip().splitlines()[-1])
+        report = {"meta": {
+            "synthetic": synthetic,
+            "model_mb": os.path.getsize(args.model) / 1e6,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count(),
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }}
+        report.update(child)
+        if synthetic:
+            report["config"]["MODEL_PATH"] = None  # a temp file; meta.synthetic says what it was
+        report["memory"] = {"in_process_peak_rss_mb": report.pop("peak_rss_mb")}
+        if args.http_concurrency:
+            report["http"], server = http_load(args, env)
+            report["memory"]["http_server_peak_rss_mb"] = server["peak_rss_mb"]
+            report["memory"]["http_server_threads"] = server["threads"]
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["vs_baseline"] = compare(report, json.load(f))
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
+
+if __name__ == "__main__":
+    main()
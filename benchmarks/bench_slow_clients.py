@@ -0,0 +1,208 @@
+import argparse
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import numpy as np
+
+# Concurrency under slow uploads: the Flask app on a fixed pool of request
+# threads (as a threaded WSGI worker runs it) against the ASGI variant on one
+# event loop. Many slow clients trickle upload bodies while probe clients send
+# normal uploads; the report shows whether the probes still get through and how
+# long they take.
+#
+#   python -m benchmarks.bench_slow_clients --slow-clients 200 --threads 16
+#
+# Servers run as subprocesses with the current MODEL_PATH / INFERENCE_BACKEND.
+
+BOUNDARY = "plantguard-bench"
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def make_image(path=None, seed=0):
+    if path:
+        with open(path, "rb") as f:
+            return f.read()
+    from PIL import Image
+    pixels = np.random.default_rng(seed).integers(0, 256, size=(480, 640, 3), dtype=np.uint8)
+    out = BytesIO()
+    Image.fromarray(pixels).save(out, format="JPEG", quality=85)
+    return out.getvalue()
+
+def multipart_body(data, filename="leaf.jpg"):
+    return (
+        ("--%s\r\nContent-Disposition: form-data; name=\"file\"; filename=\"%s\"\r\n"
+         "Content-Type: image/jpeg\r\n\r\n" % (BOUNDARY, filename)).encode()
+        + data + ("\r\n--%s--\r\n" % BOUNDARY).encode()
+    )
+
+def send_upload(port, body, rate=None, timeout=120.0):
+    """POST body to /upload, at rate bytes/second if given; returns (status, seconds)."""
+    start = time.perf_counter()
+    with socket.create_connection(("127.0.0.1", port), timeout=timeout) as sock:
+        head = ("POST /upload HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n"
+                "Content-Type: multipart/form-data; boundary=%s\r\nContent-Length: %d\r\n\r\n"
+                % (BOUNDARY, len(body))).encode()
+        sock.sendall(head)
+        if rate:
+            step = max(1, int(rate / 10))
+            for offset in range(0, len(body), step):
+                sock.sendall(body[offset:offset + step])
+                time.sleep(0.1)
+        else:
+            sock.sendall(body)
+        response = b""
+        while b"\r\n" not in response:
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            response += chunk
+    status = int(response.split(b" ", 2)[1]) if response.startswith(b"HTTP/") else 0
+    return status, time.perf_counter() - start
+
+def serve(kind, port, threads):
+    if kind == "asgi":
+        import uvicorn
+        uvicorn.run("asgi_app:app", host="127.0.0.1", port=port, log_level="warning")
+        return
+    from werkzeug.serving import BaseWSGIServer
+    import app as plantguard
+
+    class PooledWSGIServer(BaseWSGIServer):
+        # A fixed number of request threads, like a threaded WSGI worker
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.pool = ThreadPoolExecutor(threads)
+
+        def process_request(self, request, client_address):
+            self.pool.submit(self._handle, request, client_address)
+
+        def _handle(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    plantguard.start_model_loading()
+    PooledWSGIServer("127.0.0.1", port, plantguard.app).serve_forever()
+
+def server_resources(pid):
+    threads = rss_mb = peak_rss_mb = private_dirty_mb = None
+    with open("/proc/%d/status" % pid) as f:
+        for line in f:
+            if line.startswith("Threads:"):
+                threads = int(line.split()[1])
+            elif line.startswith("VmRSS:"):
+                rss_mb = int(line.split()[1]) / 1024.0
+            elif line.startswith("VmHWM:"):
+                peak_rss_mb = int(line.split()[1]) / 1024.0
+    try:
+        # Memory no other process can share: what each extra serve.py worker costs
+        with open("/proc/%d/smaps_rollup" % pid) as f:
+            for line in f:
+                if line.startswith("Private_Dirty:"):
+                    private_dirty_mb = int(line.split()[1]) / 1024.0
+    except OSError:
+        pass  # kernel without smaps_rollup
+    return {"threads": threads, "rss_mb": rss_mb, "peak_rss_mb": peak_rss_mb, "private_dirty_mb": private_dirty_mb}
+
+def wait_ready(port, body, timeout=300.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen("http://127.0.0.1:%d/" % port, timeout=5).read()
+            # First upload waits for the model to load and warm up
+            if send_upload(port, body)[0] == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError("server on port %d did not become ready" % port)
+
+def run(kind, args, image, probe_images):
+    port = free_port()
+    env = dict(os.environ, SAVE_UPLOADS="0")
+    cmd = [sys.executable, "-m", "benchmarks.bench_slow_clients", "--serve", kind,
+           "--port", str(port), "--threads", str(args.threads)]
+    server = subprocess.Popen(cmd, env=env)
+    try:
+        wait_ready(port, multipart_body(image))
+        slow_body = multipart_body(image, "slow.jpg")
+        slow_results = []
+        slow_threads = [
+            threading.Thread(target=lambda: slow_results.append(send_upload(port, slow_body, args.slow_rate)))
+            for _ in range(args.slow_clients)
+        ]
+        for thread in slow_threads:
+            thread.start()
+        time.sleep(1.0)  # let the slow clients occupy their connections
+
+        during = server_resources(server.pid)
+        with ThreadPoolExecutor(args.probe_concurrency) as pool:
+            probes = list(pool.map(lambda data: send_upload(port, multipart_body(data), timeout=args.probe_timeout),
+                                   probe_images))
+        for thread in slow_threads:
+            thread.join()
+    finally:
+        server.terminate()
+        server.wait()
+
+    probe_seconds = [seconds for status, seconds in probes if status == 200]
+    return {
+        "server": kind,
+        "probe_ok": len(probe_seconds),
+        "probe_failed": len(probes) - len(probe_seconds),
+        "probe_p50_ms": float(np.percentile(probe_seconds, 50) * 1000.0) if probe_seconds else None,
+        "probe_p95_ms": float(np.percentile(probe_seconds, 95) * 1000.0) if probe_seconds else None,
+        "probe_max_ms": float(max(probe_seconds) * 1000.0) if probe_seconds else None,
+        "slow_ok": sum(status == 200 for status, _ in slow_results),
+        "slow_seconds_mean": float(np.mean([seconds for _, seconds in slow_results])) if slow_results else None,
+        "server_during_load": during,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare Flask and ASGI serving under slow uploads")
+    parser.add_argument("--servers", default="flask,asgi")
+    parser.add_argument("--threads", type=int, default=16, help="request threads of the Flask server")
+    parser.add_argument("--slow-clients", type=int, default=200)
+    parser.add_argument("--slow-rate", type=float, default=20000, help="bytes/second per slow client")
+    parser.add_argument("--probes", type=int, default=50)
+    parser.add_argument("--probe-concurrency", type=int, default=4)
+    parser.add_argument("--probe-timeout", type=float, default=30.0)
+    parser.add_argument("--image", default=None, help="JPEG to upload (default: a generated 640x480 image)")
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--serve", choices=("flask", "asgi"), default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port, args.threads)
+        return
+
+    image = make_image(args.image)
+    # Distinct probe images so every probe misses the prediction cache
+    probe_images = [make_image(None, seed=i + 1) for i in range(args.probes)]
+    reports = [run(kind, args, image, probe_images) for kind in args.servers.split(",")]
+
+    text = json.dumps(reports, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import argparse
+import json
+import os
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+import tiles
+from backends import load_backend
+from preprocessing import new_batch
+
+# Wall time of tiled inference (POST /predict/tiles) on a large photo, per stage:
+# decode at the working size, leaf mask and tile selection, tile extraction, and
+# the single batched forward pass. Without --image a 12 MP "branch" photo is
+# generated: leafy patches on a sky/soil background.
+#
+#   python -m benchmarks.bench_tiles --model model.h5
+#   python -m benchmarks.bench_tiles --model models/model_int8.tflite --image branch.jpg --max-tiles 32
+
+def synthetic_photo(width=4000, height=3000, seed=0):
+    rng = np.random.default_rng(seed)
+    pixels = np.empty((height, width, 3), dtype=np.uint8)
+    pixels[: height // 2] = (150, 190, 230)   # sky
+    pixels[height // 2:] = (120, 95, 70)      # soil
+    for _ in range(12):
+        cy, cx = rng.integers(0, height), rng.integers(0, width)
+        ry, rx = rng.integers(80, 350, size=2)
+        y0, y1, x0, x1 = max(0, cy - ry), min(height, cy + ry), max(0, cx - rx), min(width, cx + rx)
+        pixels[y0:y1, x0:x1] = (rng.integers(30, 90), rng.integers(110, 200), rng.integers(20, 80))
+    pixels += rng.integers(0, 12, size=pixels.shape, dtype=np.uint8)
+    out = BytesIO()
+    Image.fromarray(pixels).save(out, format="JPEG", quality=90)
+    return out.getvalue()
+
+def run(backend, data, args, use_mask):
+    times = {}
+    start = time.perf_counter()
+    image, original = tiles.decode_working(BytesIO(data), args.max_side, args.max_tiles, args.overlap)
+    times["decode_ms"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    ys, xs = tiles.grid_offsets(image.shape[0], args.overlap), tiles.grid_offsets(image.shape[1], args.overlap)
+    coverage = tiles.tile_coverage(tiles.leaf_mask(image), ys, xs)
+    keep = tiles.select(coverage, args.min_leaf, args.max_tiles, use_mask)
+    rows, cols = np.nonzero(keep)
+    times["mask_ms"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = tiles.extract(image, zip(ys[rows], xs[cols]), new_batch(len(rows)))
+    times["extract_ms"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    predictions = backend.predict(batch)
+    tiles.aggregate(predictions, coverage[keep])
+    times["inference_ms"] = time.perf_counter() - start
+
+    report = {key: seconds * 1000.0 for key, seconds in times.items()}
+    report["total_ms"] = sum(report.values())
+    report.update(original=list(original), working=[image.shape[1], image.shape[0]],
+                  grid=[len(ys), len(xs)], scored=int(len(rows)))
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Time tiled inference on a large photo")
+    parser.add_argument("--model", default=os.environ.get("MODEL_PATH", "model.h5"))
+    parser.add_argument("--image", default=None, help="photo to tile (default: a generated 12 MP image)")
+    parser.add_argument("--max-side", type=int, default=1120)
+    parser.add_argument("--max-tiles", type=int, default=48)
+    parser.add_argument("--overlap", type=float, default=0.25)
+    parser.add_argument("--min-leaf", type=float, default=0.1)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    if args.image:
+        with open(args.image, "rb") as f:
+            data = f.read()
+    else:
+        data = synthetic_photo()
+    backend = load_backend(args.model, num_threads=args.threads)
+
+    reports = []
+    for use_mask in (True, False):
+        run(backend, data, args, use_mask)  # warm-up for this batch shape
+        runs = [run(backend, data, args, use_mask) for _ in range(args.repeat)]
+        report = {key: value for key, value in runs[0].items() if not key.endswith("_ms")}
+        report["mask"] = use_mask
+        for key in runs[0]:
+            if key.endswith("_ms"):
+                report[key] = float(np.median([r[key] for r in runs]))
+        reports.append(report)
+
+    text = json.dumps({"bytes": len(data), "runs": reports}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
+
+if __name__ == "__main__":
+    main()
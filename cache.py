@@ -0,0 +1,224 @@
+import hashlib
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+def content_key(data, model_version):
+    digest = hashlib.sha256(data)
+    digest.update(model_version.encode())
+    return digest.hexdigest()
+
+def file_digest(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+def connect(db_path):
+    db = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS prediction_cache ("
+        "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)"
+    )
+    # Pruning walks rows oldest first
+    db.execute("CREATE INDEX IF NOT EXISTS idx_prediction_cache_created ON prediction_cache (created)")
+    return db
+
+class PredictionCache:
+    """Bounded LRU of prediction results with an optional SQLite tier that survives restarts.
+
+    The SQLite tier is written by a background thread in batched commits, so put()
+    never waits on the disk; a full write queue drops the entry (it is still in
+    memory). The same thread deletes rows older than ttl and keeps at most
+    max_db_entries rows, dropping the oldest.
+    """
+
+    def __init__(self, max_entries=10000, ttl=0, db_path=None, max_db_entries=None, max_queue=10000,
+                 batch_size=256, flush_interval=0.5, prune_interval=60.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.db_path = db_path
+        self.max_db_entries = max_db_entries or 10 * max_entries
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.prune_interval = prune_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.rows_written = 0
+        self.rows_pruned = 0
+        self.dropped = 0
+        self.errors = 0
+        self._worker = None
+        self._pid = None
+        self._closed = False
+        # Read connection for get(), under its own lock so lookups never wait on a memory hit
+        self.db = None
+        self.db_lock = threading.Lock()
+        if db_path:
+            self.db = connect(db_path)
+
+    def _expired(self, created, now):
+        return self.ttl > 0 and now - created > self.ttl
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                created, value = entry
+                if not self._expired(created, now):
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.entries[key]
+        if self.db is not None:
+            with self.db_lock:
+                row = self.db.execute(
+                    "SELECT value, created FROM prediction_cache WHERE key = ?", (key,)
+                ).fetchone()
+            if row is not None and not self._expired(row[1], now):
+                value = json.loads(row[0])
+                with self.lock:
+                    self._insert(key, value, row[1])
+                    self.hits += 1
+                    self.disk_hits += 1
+                return value
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, value):
+        now = time.time()
+        with self.lock:
+            self._insert(key, value, now)
+        if self.db is None or self._closed:
+            return
+        self._ensure_worker()
+        try:
+            self.queue.put_nowait((key, json.dumps(value), now))
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._pid == os.getpid() and self._worker.is_alive():
+            return
+        with self.lock:
+            if self._worker is None or self._pid != os.getpid() or not self._worker.is_alive():
+                self._pid = os.getpid()
+                self._worker = threading.Thread(target=self._run, name="cache-writer", daemon=True)
+                self._worker.start()
+
+    def _drain(self):
+        try:
+            items = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        while len(items) < self.batch_size:
+            try:
+                items.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def _run(self):
+        db = connect(self.db_path)
+        pruned_at = None
+        while True:
+            items = self._drain()
+            stop = None in items
+            rows = [item for item in items if item is not None]
+            if rows:
+                self._write(db, rows)
+            if stop or pruned_at is None or time.monotonic() - pruned_at >= self.prune_interval:
+                self._prune(db)
+                pruned_at = time.monotonic()
+            if stop:
+                db.close()
+                return
+
+    def _write(self, db, rows):
+        try:
+            db.execute("BEGIN")
+            db.executemany("INSERT OR REPLACE INTO prediction_cache (key, value, created) VALUES (?, ?, ?)", rows)
+            db.execute("COMMIT")
+        except sqlite3.Error:
+            if db.in_transaction:
+                db.execute("ROLLBACK")
+            with self.lock:
+                self.errors += 1
+            return
+        with self.lock:
+            self.rows_written += len(rows)
+
+    def _prune(self, db):
+        try:
+            db.execute("BEGIN")
+            deleted = 0
+            if self.ttl > 0:
+                deleted += db.execute("DELETE FROM prediction_cache WHERE created < ?",
+                                      (time.time() - self.ttl,)).rowcount
+            # Everything at or before the first row past the newest max_db_entries
+            deleted += db.execute(
+                "DELETE FROM prediction_cache WHERE created <= "
+                "(SELECT created FROM prediction_cache ORDER BY created DESC LIMIT 1 OFFSET ?)",
+                (self.max_db_entries,),
+            ).rowcount
+            db.execute("COMMIT")
+        except sqlite3.Error:
+            if db.in_transaction:
+                db.execute("ROLLBACK")
+            with self.lock:
+                self.errors += 1
+            return
+        with self.lock:
+            self.rows_pruned += deleted
+
+    def close(self, timeout=10.0):
+        # Flush queued writes, then stop the thread
+        if self._closed:
+            return
+        self._closed = True
+        if self._worker is None or self._pid != os.getpid() or not self._worker.is_alive():
+            return
+        self.queue.put(None)
+        self._worker.join(timeout)
+
+    def _insert(self, key, value, created):
+        self.entries[key] = (created, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "db_max_entries": self.max_db_entries if self.db is not None else None,
+                "db_queued": self.queue.qsize(),
+                "db_rows_written": self.rows_written,
+                "db_rows_pruned": self.rows_pruned,
+                "db_dropped": self.dropped,
+                "db_errors": self.errors,
+            }
@@ -0,0 +1,152 @@
+import argparse
+import json
+import math
+import os
+
+import numpy as np
+
+from preprocessing import decode_image, new_batch, preprocess_inplace
+
+# Post-processing of the model's softmax output, a whole batch at a time:
+# temperature scaling, top-k and reliability metrics. The model ends in a
+# softmax, so log-probabilities stand in for its logits (softmax(log p / T)
+# equals softmax(z / T)). The temperature is fitted offline on a labelled split
+# and saved next to the model, where app.py and classify.py pick it up:
+#
+#   python calibration.py --model model.h5 --data-dir "MangoLeafBD Dataset/test"
+
+EPSILON = 1e-7
+
+def calibration_path(model_path):
+    # model.h5 -> model.calibration.json, models/model_int8.tflite -> models/model_int8.calibration.json
+    return os.path.splitext(model_path)[0] + ".calibration.json"
+
+def load_temperature(model_path):
+    """Fitted temperature for model_path, or 1.0 (no scaling) if it was never calibrated."""
+    try:
+        with open(calibration_path(model_path)) as f:
+            return float(json.load(f)["temperature"])
+    except FileNotFoundError:
+        return 1.0
+
+def temperature_scale(probabilities, temperature):
+    # (N, C) probabilities -> (N, C) probabilities of softmax(log p / T)
+    probabilities = np.asarray(probabilities, dtype=np.float32)
+    if temperature == 1.0:
+        return probabilities
+    logits = np.log(np.maximum(probabilities, EPSILON)) / temperature
+    logits -= logits.max(axis=1, keepdims=True)
+    np.exp(logits, out=logits)
+    logits /= logits.sum(axis=1, keepdims=True)
+    return logits
+
+def top_k(probabilities, k):
+    """(indices, values), each (N, k): the k most probable classes per row, most probable first."""
+    probabilities = np.asarray(probabilities)
+    k = max(1, min(k, probabilities.shape[1]))
+    indices = np.argpartition(-probabilities, k - 1, axis=1)[:, :k]
+    values = np.take_along_axis(probabilities, indices, axis=1)
+    order = np.argsort(-values, axis=1, kind="stable")
+    return np.take_along_axis(indices, order, axis=1), np.take_along_axis(values, order, axis=1)
+
+def nll(probabilities, labels):
+    picked = probabilities[np.arange(len(labels)), labels]
+    return float(-np.mean(np.log(np.maximum(picked, EPSILON))))
+
+def fit_temperature(probabilities, labels, low=0.05, high=20.0, iterations=60):
+    # Negative log-likelihood is convex in 1/T, so a golden-section search over 1/T finds the minimum
+    loss = lambda beta: nll(temperature_scale(probabilities, 1.0 / beta), labels)
+    ratio = (math.sqrt(5.0) - 1.0) / 2.0
+    a, b = 1.0 / high, 1.0 / low
+    c, d = b - ratio * (b - a), a + ratio * (b - a)
+    fc, fd = loss(c), loss(d)
+    for _ in range(iterations):
+        if fc < fd:
+            b, d, fd = d, c, fc
+            c = b - ratio * (b - a)
+            fc = loss(c)
+        else:
+            a, c, fc = c, d, fd
+            d = a + ratio * (b - a)
+            fd = loss(d)
+    return 2.0 / (a + b)
+
+def reliability(probabilities, labels, bins=15):
+    """Accuracy, expected/maximum calibration error, NLL and Brier score of (N, C) probabilities."""
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    labels = np.asarray(labels)
+    confidence = probabilities.max(axis=1)
+    correct = probabilities.argmax(axis=1) == labels
+    # Bin i holds confidences in (i/bins, (i+1)/bins]
+    index = np.clip(np.ceil(confidence * bins).astype(int) - 1, 0, bins - 1)
+    counts = np.bincount(index, minlength=bins)
+    bin_accuracy = np.bincount(index, weights=correct, minlength=bins) / np.maximum(counts, 1)
+    bin_confidence = np.bincount(index, weights=confidence, minlength=bins) / np.maximum(counts, 1)
+    gaps = np.abs(bin_accuracy - bin_confidence)
+    one_hot = np.zeros_like(probabilities)
+    one_hot[np.arange(len(labels)), labels] = 1.0
+    return {
+        "images": int(len(labels)),
+        "accuracy": float(correct.mean()),
+        "mean_confidence": float(confidence.mean()),
+        "ece": float(np.sum(gaps * counts) / len(labels)),
+        "mce": float(gaps[counts > 0].max()),
+        "nll": nll(probabilities, labels),
+        "brier": float(np.mean(np.sum((probabilities - one_hot) ** 2, axis=1))),
+        "bins": [
+            {"upper": (i + 1) / bins, "count": int(counts[i]),
+             "accuracy": float(bin_accuracy[i]), "confidence": float(bin_confidence[i])}
+            for i in range(bins) if counts[i]
+        ],
+    }
+
+def predict_files(backend, paths, batch_size):
+    # Serving preprocessing (draft decode, nearest resize, [-1, 1]) so the fit matches what app.py sees
+    outputs = []
+    for start in range(0, len(paths), batch_size):
+        chunk = paths[start:start + batch_size]
+        batch = new_batch(len(chunk))
+        for i, path in enumerate(chunk):
+            decode_image(path, batch[i])
+        outputs.append(backend.predict(preprocess_inplace(batch)))
+    return np.concatenate(outputs)
+
+def main():
+    from backends import load_backend
+    from cache import file_digest
+
+    parser = argparse.ArgumentParser(description="Fit a softmax temperature on a labelled split")
+    parser.add_argument("--model", default=os.environ.get("MODEL_PATH", "model.h5"))
+    parser.add_argument("--backend", default=os.environ.get("INFERENCE_BACKEND") or None)
+    parser.add_argument("--data-dir", default="MangoLeafBD Dataset/test", help="class-folder dataset")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--bins", type=int, default=15)
+    parser.add_argument("--output", default=None, help="default: next to the model, MODEL.calibration.json")
+    args = parser.parse_args()
+
+    from classes import labelled_files  # classes.py imports this module
+    paths, labels, classes = labelled_files(args.data_dir)
+    backend = load_backend(args.model, args.backend, num_threads=args.threads)
+    probabilities = predict_files(backend, paths, args.batch_size)
+    temperature = fit_temperature(probabilities, labels)
+    report = {
+        "temperature": temperature,
+        "model": os.path.basename(args.model),
+        "model_digest": file_digest(args.model),
+        "data_dir": args.data_dir,
+        "classes": classes,
+        "before": reliability(probabilities, labels, args.bins),
+        "after": reliability(temperature_scale(probabilities, temperature), labels, args.bins),
+    }
+
+    output = args.output or calibration_path(args.model)
+    with open(output + ".tmp", "w") as f:
+        json.dump(report, f, indent=2)
+    os.replace(output + ".tmp", output)
+    print("temperature %.4f  ece %.4f -> %.4f  nll %.4f -> %.4f  (%s)" % (
+        temperature, report["before"]["ece"], report["after"]["ece"],
+        report["before"]["nll"], report["after"]["nll"], output))
+
+if __name__ == "__main__":
+    main()
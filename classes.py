@@ -0,0 +1,69 @@
+import os
+
+import numpy as np
+
+from calibration import top_k
+
+# The model's classes and the post-processing of its output into results,
+# shared by app.py and the offline tools (classify.py, evaluate.py). Unlike
+# app.py, importing this module starts nothing and touches no files.
+
+# Class mapping: output index -> disease (the sorted class folders of the training set)
+class_names = [
+    'Anthracnose',
+    'Bacterial Canker',
+    'Cutting Weevil',
+    'Die Back',
+    'Gall Midge',
+    'Healthy'
+]
+
+# Files accepted as images everywhere: /predict/batch, /jobs, classify.py, and the
+# labelled splits read by train.py, image_pack.py, calibration.py, evaluate.py and
+# convert_model.py. Both PIL (serving) and tf.io.decode_image (training) read them.
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".gif", ".webp"}
+
+def labelled_files(directory):
+    """(paths, labels, class folder names) of a class-folder dataset.
+
+    Same discovery and ordering as flow_from_directory: class index = position of
+    the folder in sorted order, images found recursively below it, sorted.
+    """
+    classes = sorted(d for d in os.listdir(directory) if os.path.isdir(os.path.join(directory, d)))
+    if not classes:
+        raise ValueError("No class folders found in %s" % directory)
+    paths, labels = [], []
+    for index, name in enumerate(classes):
+        for root, _, files in sorted(os.walk(os.path.join(directory, name))):
+            for f in sorted(files):
+                if os.path.splitext(f)[1].lower() in IMAGE_EXTENSIONS:
+                    paths.append(os.path.join(root, f))
+                    labels.append(index)
+    return paths, np.asarray(labels, dtype=np.int64), classes
+
+# Every prediction lists its TOP_K classes and is flagged uncertain when the top
+# confidence is below UNCERTAIN_THRESHOLD percent (same variables as app.py's config)
+TOP_K = int(os.environ.get("TOP_K", 3))
+UNCERTAIN_THRESHOLD = float(os.environ.get("UNCERTAIN_THRESHOLD", 60))
+
+def prediction_result(prediction):
+    index = int(np.argmax(prediction))
+    return class_names[index], float(prediction[index]) * 100
+
+def prediction_results(predictions, k=None, uncertain_threshold=None):
+    """Result dicts (disease, confidence, top_k, uncertain) for a (N, classes) batch of predictions.
+
+    top_k is a list of [class_id, confidence] pairs, most likely first.
+    """
+    indices, values = top_k(predictions, k or TOP_K)
+    values = values * 100.0
+    uncertain = values[:, 0] < (UNCERTAIN_THRESHOLD if uncertain_threshold is None else uncertain_threshold)
+    return [
+        {
+            "disease": class_names[row_indices[0]],
+            "confidence": float(row_values[0]),
+            "top_k": [[int(index), float(value)] for index, value in zip(row_indices, row_values)],
+            "uncertain": bool(row_uncertain),
+        }
+        for row_indices, row_values, row_uncertain in zip(indices, values, uncertain)
+    ]
@@ -0,0 +1,258 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from backends import load_backend
+from calibration import load_temperature, temperature_scale
+from classes import IMAGE_EXTENSIONS, class_names, prediction_results
+from preprocessing import INPUT_SHAPE, decode_image, preprocess_inplace
+
+# Offline bulk classification of a directory tree, without the Flask app:
+#
+#   python classify.py "MangoLeafBD Dataset/test" --output results.csv
+#   python classify.py /data/week42 --output week42_parquet --format parquet --workers 8
+#
+# Files are discovered lazily and decoded in a process pool (same decode as
+# predict_disease()) while the previous batch is in the forward pass. Results
+# stream to the output, and every path whose row has been written is appended
+# to a checkpoint file; rerunning the same command skips those paths. A crash
+# between writing rows and checkpointing them can repeat at most one batch.
+# Confidences are calibrated with the model's calibration file, if any; top_k
+# holds a JSON list of [disease, confidence] pairs.
+
+FIELDS = ["path", "disease", "confidence", "uncertain", "top_k", "error"]
+
+def iter_images(root):
+    # Depth-first, sorted per directory, so runs over the same tree agree on order
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+        except OSError as e:
+            print("skipping %s: %s" % (directory, e), file=sys.stderr)
+            continue
+        subdirectories = []
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirectories.append(entry.path)
+            elif os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS:
+                yield os.path.relpath(entry.path, root)
+        stack.extend(reversed(subdirectories))
+
+def decode_files(root, paths):
+    # Runs in a pool process; uint8 keeps the pickled result 4x smaller than float32
+    images = np.zeros((len(paths),) + INPUT_SHAPE, dtype=np.uint8)
+    errors = [None] * len(paths)
+    for i, path in enumerate(paths):
+        try:
+            decode_image(os.path.join(root, path), images[i])
+        except Exception as e:
+            errors[i] = "%s: %s" % (type(e).__name__, e)
+    return images, errors
+
+class Checkpoint:
+    """Append-only list of completed paths, one per line."""
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.done.update(line.rstrip("\n") for line in f if line.endswith("\n"))
+        self.file = open(path, "a", encoding="utf-8")
+
+    def add(self, paths):
+        if paths:
+            self.file.write("".join(path + "\n" for path in paths))
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+class CsvSink:
+    def __init__(self, path):
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        if exists:
+            with open(path, newline="", encoding="utf-8") as f:
+                header = next(csv.reader(f), [])
+            if header != FIELDS:
+                raise ValueError("%s has columns %s, expected %s" % (path, ",".join(header), ",".join(FIELDS)))
+        self.file = open(path, "a", newline="", encoding="utf-8")
+        self.writer = csv.DictWriter(self.file, FIELDS)
+        if not exists:
+            self.writer.writeheader()
+
+    def write(self, rows):
+        # Returns the rows that are now durable and may be checkpointed
+        self.writer.writerows(rows)
+        self.file.flush()
+        return rows
+
+    def close(self):
+        self.file.close()
+        return []
+
+class ParquetSink:
+    """Directory of part files; a part is only checkpointed once it is complete on disk."""
+
+    def __init__(self, directory, rows_per_file):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa, self.pq = pa, pq
+        self.directory = directory
+        self.rows_per_file = rows_per_file
+        self.pending = []
+        os.makedirs(directory, exist_ok=True)
+        self.part = sum(1 for name in os.listdir(directory) if name.endswith(".parquet"))
+        self.schema = pa.schema([("path", pa.string()), ("disease", pa.string()),
+                                 ("confidence", pa.float64()), ("uncertain", pa.bool_()),
+                                 ("top_k", pa.string()), ("error", pa.string())])
+
+    def write(self, rows):
+        self.pending.extend(rows)
+        if len(self.pending) < self.rows_per_file:
+            return []
+        return self._flush()
+
+    def _flush(self):
+        rows, self.pending = self.pending, []
+        if not rows:
+            return []
+        table = self.pa.Table.from_pylist(rows, schema=self.schema)
+        path = os.path.join(self.directory, "part-%05d.parquet" % self.part)
+        self.pq.write_table(table, path + ".tmp")
+        os.replace(path + ".tmp", path)
+        self.part += 1
+        return rows
+
+    def close(self):
+        return self._flush()
+
+class Progress:
+    def __init__(self, interval):
+        self.interval = interval
+        self.started = self.last = time.perf_counter()
+        self.last_count = 0
+        self.count = 0
+        self.failed = 0
+
+    def update(self, count, failed, force=False):
+        self.count += count
+        self.failed += failed
+        now = time.perf_counter()
+        if not force and now - self.last < self.interval:
+            return
+        recent = (self.count - self.last_count) / max(now - self.last, 1e-9)
+        overall = self.count / max(now - self.started, 1e-9)
+        print("%d images (%d failed) - %.1f img/s now, %.1f img/s overall"
+              % (self.count, self.failed, recent, overall), file=sys.stderr, flush=True)
+        self.last, self.last_count = now, self.count
+
+def batches(paths, size):
+    batch = []
+    for path in paths:
+        batch.append(path)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def submit_batch(pool, root, paths, chunk_size):
+    return paths, [pool.submit(decode_files, root, paths[i:i + chunk_size])
+                   for i in range(0, len(paths), chunk_size)]
+
+def classify_batch(backend, paths, futures, temperature=1.0, k=None):
+    images, errors = [], []
+    for future in futures:
+        chunk_images, chunk_errors = future.result()
+        images.append(chunk_images)
+        errors.extend(chunk_errors)
+    ok = np.asarray([error is None for error in errors])
+    batch = preprocess_inplace(np.concatenate(images)[ok].astype(np.float32))
+    results = iter(prediction_results(temperature_scale(backend.predict(batch), temperature), k)) \
+        if len(batch) else iter(())
+    rows = []
+    for path, error in zip(paths, errors):
+        if error is not None:
+            rows.append({"path": path, "disease": None, "confidence": None, "uncertain": None,
+                         "top_k": None, "error": error})
+        else:
+            result = next(results)
+            rows.append({
+                "path": path,
+                "disease": result["disease"],
+                "confidence": result["confidence"],
+                "uncertain": result["uncertain"],
+                "top_k": json.dumps([[class_names[index], value] for index, value in result["top_k"]]),
+                "error": None,
+            })
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Classify every image under a directory tree")
+    parser.add_argument("root")
+    parser.add_argument("--output", default="predictions.csv",
+                        help="CSV file, or a directory of part files with --format parquet")
+    parser.add_argument("--format", choices=("csv", "parquet"), default=None,
+                        help="default: parquet if --output ends in .parquet or is a directory, else csv")
+    parser.add_argument("--checkpoint", default=None, help="completed-paths file (default: OUTPUT.done)")
+    parser.add_argument("--model", default=os.environ.get("MODEL_PATH", "model.h5"))
+    parser.add_argument("--backend", default=os.environ.get("INFERENCE_BACKEND") or None)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="decode processes")
+    parser.add_argument("--threads", type=int, default=None, help="inference threads")
+    parser.add_argument("--top-k", type=int, default=None, help="classes listed per image (default: TOP_K)")
+    parser.add_argument("--decode-chunk", type=int, default=32, help="images per decode task")
+    parser.add_argument("--prefetch", type=int, default=2, help="batches decoded ahead of inference")
+    parser.add_argument("--rows-per-file", type=int, default=50000, help="rows per parquet part file")
+    parser.add_argument("--progress-interval", type=float, default=5.0, help="seconds between progress lines")
+    args = parser.parse_args()
+
+    output_format = args.format or (
+        "parquet" if args.output.endswith(".parquet") or os.path.isdir(args.output) else "csv")
+    checkpoint = Checkpoint(args.checkpoint or args.output.rstrip("/") + ".done")
+    sink = CsvSink(args.output) if output_format == "csv" else ParquetSink(args.output, args.rows_per_file)
+    if checkpoint.done:
+        print("resuming: %d files already classified" % len(checkpoint.done), file=sys.stderr)
+
+    # Fork the decode workers before the backend loads, so they never inherit
+    # TensorFlow / ONNX Runtime threads; with fork all workers start on first submit
+    pool = ProcessPoolExecutor(args.workers, mp_context=multiprocessing.get_context("fork"))
+    pool.submit(int).result()
+    backend = load_backend(args.model, args.backend, num_threads=args.threads)
+    temperature = load_temperature(args.model)
+    progress = Progress(args.progress_interval)
+
+    def finish(entry):
+        rows = classify_batch(backend, *entry, temperature, args.top_k)
+        checkpoint.add([row["path"] for row in sink.write(rows)])
+        progress.update(len(rows), sum(row["error"] is not None for row in rows))
+
+    todo = (path for path in iter_images(args.root) if path not in checkpoint.done)
+    in_flight = deque()
+    try:
+        for paths in batches(todo, args.batch_size):
+            in_flight.append(submit_batch(pool, args.root, paths, args.decode_chunk))
+            if len(in_flight) > args.prefetch:
+                finish(in_flight.popleft())
+        while in_flight:
+            finish(in_flight.popleft())
+        checkpoint.add([row["path"] for row in sink.close()])
+        progress.update(0, 0, force=True)
+    finally:
+        pool.shutdown(cancel_futures=True)
+        checkpoint.close()
+
+if __name__ == "__main__":
+    main()
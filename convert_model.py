@@ -0,0 +1,121 @@
+import argparse
+import os
+import random
+
+from classes import labelled_files
+from preprocessing import load_image_array
+
+# Export the trained Keras model to TFLite and ONNX, as float16 and
+# post-training int8 artifacts. Calibration images are drawn from a
+# class-folder dataset laid out like "MangoLeafBD Dataset/train/<class>/*.jpg".
+#
+#   python convert_model.py --model model.h5 --calibration-dir "MangoLeafBD Dataset/train"
+
+def calibration_files(dataset_dir, count, seed=0):
+    # Same number of images from every class folder so no class dominates the ranges
+    paths, labels, classes = labelled_files(dataset_dir)
+    rng = random.Random(seed)
+    per_class = max(1, count // len(classes))
+    files = []
+    for index in range(len(classes)):
+        images = [path for path, label in zip(paths, labels) if label == index]
+        rng.shuffle(images)
+        files.extend(images[:per_class])
+    return files
+
+def calibration_batches(dataset_dir, count):
+    for path in calibration_files(dataset_dir, count):
+        yield load_image_array(path)
+
+def export_tflite(model, out_dir, dataset_dir, count):
+    import tensorflow as tf
+    paths = []
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.target_spec.supported_types = [tf.float16]
+    paths.append(_write(os.path.join(out_dir, "model_float16.tflite"), converter.convert()))
+
+    if dataset_dir:
+        # Weights and activations in int8; input/output stay float32 so serving
+        # preprocessing is unchanged
+        converter = tf.lite.TFLiteConverter.from_keras_model(model)
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = lambda: ([batch] for batch in calibration_batches(dataset_dir, count))
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8, tf.lite.OpsSet.TFLITE_BUILTINS]
+        paths.append(_write(os.path.join(out_dir, "model_int8.tflite"), converter.convert()))
+    return paths
+
+def export_onnx(model, out_dir, dataset_dir, count, opset):
+    import tensorflow as tf
+    import tf2onnx
+    import onnx
+    paths = []
+
+    float32_path = os.path.join(out_dir, "model.onnx")
+    spec = (tf.TensorSpec((None, 224, 224, 3), tf.float32, name="input"),)
+    forward = tf.function(lambda x: model(x, training=False))
+    tf2onnx.convert.from_function(forward, input_signature=spec, opset=opset, output_path=float32_path)
+    paths.append(float32_path)
+
+    try:
+        from onnxconverter_common import float16
+    except ImportError:
+        print("onnxconverter-common not installed; skipping float16 ONNX export")
+    else:
+        float16_path = os.path.join(out_dir, "model_float16.onnx")
+        onnx.save(float16.convert_float_to_float16(onnx.load(float32_path), keep_io_types=True), float16_path)
+        paths.append(float16_path)
+
+    if dataset_dir:
+        from onnxruntime.quantization import CalibrationDataReader, QuantType, quantize_static
+
+        class Reader(CalibrationDataReader):
+            def __init__(self):
+                self.batches = calibration_batches(dataset_dir, count)
+
+            def get_next(self):
+                batch = next(self.batches, None)
+                return None if batch is None else {"input": batch}
+
+        int8_path = os.path.join(out_dir, "model_int8.onnx")
+        quantize_static(
+            float32_path, int8_path, Reader(),
+            per_channel=True, weight_type=QuantType.QInt8, activation_type=QuantType.QUInt8,
+        )
+        paths.append(int8_path)
+    return paths
+
+def _write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+def main():
+    parser = argparse.ArgumentParser(description="Export model.h5 to TFLite / ONNX float16 and int8 artifacts")
+    parser.add_argument("--model", default="model.h5")
+    parser.add_argument("--out-dir", default="models")
+    parser.add_argument("--calibration-dir", default=None,
+                        help="class-folder dataset used for int8 calibration, e.g. 'MangoLeafBD Dataset/train'")
+    parser.add_argument("--calibration-count", type=int, default=300)
+    parser.add_argument("--formats", default="tflite,onnx")
+    parser.add_argument("--opset", type=int, default=13)
+    args = parser.parse_args()
+
+    import tensorflow as tf
+    os.makedirs(args.out_dir, exist_ok=True)
+    model = tf.keras.models.load_model(args.model, compile=False)
+    if not args.calibration_dir:
+        print("No --calibration-dir given; int8 artifacts will be skipped")
+
+    formats = args.formats.split(",")
+    paths = []
+    if "tflite" in formats:
+        paths += export_tflite(model, args.out_dir, args.calibration_dir, args.calibration_count)
+    if "onnx" in formats:
+        paths += export_onnx(model, args.out_dir, args.calibration_dir, args.calibration_count, args.opset)
+    for path in paths:
+        print("%s  %.1f MB" % (path, os.path.getsize(path) / 1e6))
+
+if __name__ == "__main__":
+    main()
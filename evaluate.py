@@ -0,0 +1,242 @@
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from backends import load_backend
+from calibration import load_temperature, reliability, temperature_scale
+from classes import class_names, labelled_files
+from classify import batches, submit_batch
+from image_pack import PackedImages
+from preprocessing import new_batch, preprocess_inplace
+
+# Test-split evaluation of one or more model artifacts with exactly the serving
+# preprocessing (draft decode, nearest resize, [-1, 1]) and no augmentation,
+# unlike the notebook, whose test_set comes from train_datagen:
+#
+#   python evaluate.py model.h5 models/model_int8.tflite model_gap.h5 --data-dir "MangoLeafBD Dataset/test"
+#
+# Every batch is decoded once (in classify.py's decode pool, one batch ahead) and
+# passed to all artifacts in turn, so comparing N artifacts does not decode the
+# split N times. --data-dir may also be an image_pack.py store packed with
+# --decoder serving, which skips decoding altogether. Per artifact the report has
+# the confusion matrix over classes.class_names (rows: true class, columns:
+# predicted), per-class precision, recall and images/second, forward-pass
+# latency per batch, and agreement with the first artifact. Confidences are
+# temperature-scaled as app.py serves them.
+
+def dataset_batches(data_dir, batch_size, workers, prefetch):
+    """(class names, iterator of (uint8 images, labels, unreadable paths)) over a labelled split."""
+    if PackedImages.is_packed(data_dir):
+        store = PackedImages(data_dir)
+        if store.meta["decoder"] != "serving":
+            raise ValueError("%s was packed with the %s decoder; evaluation needs "
+                             "image_pack.py --decoder serving" % (data_dir, store.meta["decoder"]))
+        # Files the packer could not decode are reported with the first batch
+        skipped = store.meta.get("skipped", [])
+        return store.classes, ((images, labels, skipped if i == 0 else [])
+                               for i, (images, labels) in enumerate(store.batches(batch_size)))
+    paths, labels, classes = labelled_files(data_dir)
+    return classes, _decoded_batches(data_dir, paths, labels, batch_size, workers, prefetch)
+
+def _decoded_batches(root, paths, labels, batch_size, workers, prefetch):
+    rel = [os.path.relpath(path, root) for path in paths]
+    pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("fork"))
+    in_flight = deque()
+    try:
+        offset = 0
+        for chunk in batches(rel, batch_size):
+            in_flight.append((offset, submit_batch(pool, root, chunk, max(1, len(chunk) // workers))))
+            offset += len(chunk)
+            if len(in_flight) > prefetch:
+                yield _collect(labels, *in_flight.popleft())
+        while in_flight:
+            yield _collect(labels, *in_flight.popleft())
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+def _collect(labels, offset, entry):
+    chunk, futures = entry
+    images, errors = [], []
+    for future in futures:
+        chunk_images, chunk_errors = future.result()
+        images.append(chunk_images)
+        errors.extend(chunk_errors)
+    ok = np.asarray([error is None for error in errors])
+    unreadable = [path for path, error in zip(chunk, errors) if error is not None]
+    return np.concatenate(images)[ok], labels[offset:offset + len(chunk)][ok], unreadable
+
+def confusion_metrics(confusion, seconds, names):
+    """Per-class precision, recall, support and images/second from a (true, predicted) count matrix."""
+    confusion = np.asarray(confusion)
+    true_positive = np.diag(confusion).astype(np.float64)
+    predicted, support = confusion.sum(axis=0), confusion.sum(axis=1)
+    per_class = []
+    for i, name in enumerate(names):
+        per_class.append({
+            "class": name,
+            "support": int(support[i]),
+            "precision": true_positive[i] / predicted[i] if predicted[i] else None,
+            "recall": true_positive[i] / support[i] if support[i] else None,
+            "images_per_second": support[i] / seconds[i] if seconds[i] else None,
+        })
+    present = [entry for entry in per_class if entry["support"]]
+    return per_class, {
+        "accuracy": float(true_positive.sum() / max(1, confusion.sum())),
+        "macro_precision": float(np.mean([entry["precision"] or 0.0 for entry in present])) if present else None,
+        "macro_recall": float(np.mean([entry["recall"] for entry in present])) if present else None,
+    }
+
+class Evaluation:
+    """Running results of one artifact over the streamed split."""
+
+    def __init__(self, path, backend, num_classes):
+        self.path = path
+        self.backend = backend
+        self.temperature = load_temperature(path)
+        self.confusion = np.zeros((num_classes, num_classes), dtype=np.int64)
+        self.class_seconds = np.zeros(num_classes)
+        self.batch_seconds = []
+        self.images = 0
+        self.probabilities = []
+        self.labels = []
+
+    def update(self, batch, labels):
+        start = time.perf_counter()
+        probabilities = self.backend.predict(batch)
+        seconds = time.perf_counter() - start
+        if probabilities.shape[1] != self.confusion.shape[0]:
+            raise ValueError("%s predicts %d classes, class_names has %d" % (
+                self.path, probabilities.shape[1], self.confusion.shape[0]))
+        probabilities = temperature_scale(probabilities, self.temperature)
+        np.add.at(self.confusion, (labels, probabilities.argmax(axis=1)), 1)
+        # The batch's forward time, split over its images' true classes
+        self.class_seconds += np.bincount(labels, minlength=len(self.class_seconds)) * (seconds / len(labels))
+        self.batch_seconds.append(seconds)
+        self.images += len(labels)
+        self.probabilities.append(probabilities)
+        self.labels.append(labels)
+
+    def report(self, bins):
+        probabilities, labels = np.concatenate(self.probabilities), np.concatenate(self.labels)
+        per_class, overall = confusion_metrics(self.confusion, self.class_seconds, class_names)
+        calibration = reliability(probabilities, labels, bins)
+        del calibration["bins"]
+        samples = np.asarray(self.batch_seconds) * 1000.0
+        return dict(overall, **{
+            "artifact": self.path,
+            "backend": self.backend.name,
+            "temperature": self.temperature,
+            "images": self.images,
+            "latency": {
+                "batches": len(samples),
+                "p50_ms": float(np.percentile(samples, 50)),
+                "p95_ms": float(np.percentile(samples, 95)),
+                "max_ms": float(samples.max()),
+                "ms_per_image": float(samples.sum() / self.images),
+                "images_per_second": self.images / (samples.sum() / 1000.0),
+            },
+            "calibration": calibration,
+            "per_class": per_class,
+            "confusion_matrix": self.confusion.tolist(),
+        }), probabilities.argmax(axis=1)
+
+def print_summary(report):
+    width = max(len("true \\ predicted"), max(len("%d %s" % (i, name)) for i, name in enumerate(class_names)))
+    for entry in report["artifacts"]:
+        print("\n%s (%s)  accuracy %.4f  macro P %.4f  R %.4f  %.1f images/s  agreement %.4f" % (
+            entry["artifact"], entry["backend"], entry["accuracy"], entry["macro_precision"],
+            entry["macro_recall"], entry["latency"]["images_per_second"], entry["agreement"]))
+        print("%-*s  %s  %9s %9s %9s" % (width, "true \\ predicted", " ".join("%5d" % i for i in range(len(class_names))),
+                                         "precision", "recall", "img/s"))
+        for i, (row, metrics) in enumerate(zip(entry["confusion_matrix"], entry["per_class"])):
+            print("%-*s  %s  %9s %9s %9s" % (
+                width, "%d %s" % (i, class_names[i]), " ".join("%5d" % count for count in row),
+                "-" if metrics["precision"] is None else "%.4f" % metrics["precision"],
+                "-" if metrics["recall"] is None else "%.4f" % metrics["recall"],
+                "-" if metrics["images_per_second"] is None else "%.1f" % metrics["images_per_second"]))
+    print("\n%d images, %.2fs waiting for decode (%d unreadable)" % (
+        report["images"], report["decode_wait_seconds"], len(report["unreadable"])))
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate model artifacts on a labelled split with serving preprocessing")
+    parser.add_argument("artifacts", nargs="*", help="model files (default: MODEL_PATH or model.h5)")
+    parser.add_argument("--data-dir", default="MangoLeafBD Dataset/test",
+                        help="class-folder dataset or an image_pack.py --decoder serving store")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="decode processes")
+    parser.add_argument("--prefetch", type=int, default=2, help="batches decoded ahead of inference")
+    parser.add_argument("--threads", type=int, default=None, help="inference threads")
+    parser.add_argument("--bins", type=int, default=15, help="confidence bins for ECE")
+    parser.add_argument("--output", default=None, help="write the JSON report here")
+    args = parser.parse_args()
+    artifacts = args.artifacts or [os.environ.get("MODEL_PATH", "model.h5")]
+
+    # The decode pool forks on the first batch, before any backend loads (see classify.py)
+    try:
+        classes, source = dataset_batches(args.data_dir, args.batch_size, args.workers, args.prefetch)
+    except ValueError as e:
+        parser.error(str(e))
+    unknown = [name for name in classes if name not in class_names]
+    if unknown:
+        parser.error("class folders not in classes.class_names: %s" % ", ".join(unknown))
+    class_ids = np.asarray([class_names.index(name) for name in classes])
+    start = time.perf_counter()
+    first = next(source, None)
+    decode_wait = time.perf_counter() - start
+    if first is None:
+        parser.error("No images found in %s" % args.data_dir)
+
+    evaluations = []
+    for path in artifacts:
+        backend = load_backend(path, num_threads=args.threads)
+        backend.predict(new_batch(len(first[0])))  # warm-up outside the timed passes
+        evaluations.append(Evaluation(path, backend, len(class_names)))
+
+    unreadable, images = [], 0
+    batch = new_batch(args.batch_size)
+    item = first
+    while item is not None:
+        decoded, labels, failed = item
+        unreadable.extend(failed)
+        if len(decoded):
+            # One float32 conversion per batch, shared by every artifact
+            inputs = batch[:len(decoded)]
+            inputs[...] = decoded
+            preprocess_inplace(inputs)
+            labels = class_ids[np.asarray(labels, dtype=np.int64)]
+            for evaluation in evaluations:
+                evaluation.update(inputs, labels)
+            images += len(decoded)
+        start = time.perf_counter()
+        item = next(source, None)
+        decode_wait += time.perf_counter() - start
+
+    reports = []
+    reference = None
+    for evaluation in evaluations:
+        entry, top1 = evaluation.report(args.bins)
+        reference = top1 if reference is None else reference
+        entry["agreement"] = float(np.mean(top1 == reference))
+        reports.append(entry)
+    report = {
+        "data_dir": args.data_dir,
+        "classes": class_names,
+        "images": images,
+        "unreadable": unreadable,
+        # Time spent waiting for decoded batches; decoding overlaps inference
+        "decode_wait_seconds": decode_wait,
+        "artifacts": reports,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    print_summary(report)
+
+if __name__ == "__main__":
+    main()
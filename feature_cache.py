@@ -0,0 +1,104 @@
+import itertools
+
+import numpy as np
+import tensorflow as tf
+
+from sharded_store import ShardedStore, read_meta, shuffled
+
+# Precomputed activations of the frozen part of the network, so the trainable
+# layers and the classifier head can be retrained without re-running the
+# backbone every epoch.
+#
+# Store layout (one directory per dataset split):
+#   meta.json                 signature, boundary shapes, shard sizes
+#   labels.npy                int16 class index per row
+#   shard_00000_<k>.npy       float16 activations of boundary tensor k
+#
+# Shards are sharded_store.py files, so several sweeps can share one page cache.
+
+def _is_frozen(layer):
+    return isinstance(layer, tf.keras.layers.InputLayer) or not layer.trainable
+
+def _as_list(tensors):
+    return list(tensors) if isinstance(tensors, (list, tuple)) else [tensors]
+
+def split_frozen(model):
+    """Split model into (extractor, tail) at the frozen/trainable boundary.
+
+    extractor maps the image input to every frozen tensor a trainable layer
+    consumes; tail rebuilds the trainable layers (sharing their weights with
+    model) on top of Inputs for those tensors.
+    """
+    boundary = []
+    mapping = {}
+    for layer in model.layers:
+        if _is_frozen(layer):
+            continue
+        inputs = layer.input
+        new_inputs = []
+        for tensor in _as_list(inputs):
+            key = id(tensor)
+            if key not in mapping:
+                if not _is_frozen(tensor._keras_history[0]):
+                    raise ValueError("Layer %s consumes an unmapped trainable tensor" % layer.name)
+                boundary.append(tensor)
+                mapping[key] = tf.keras.Input(shape=tensor.shape[1:], dtype=tensor.dtype,
+                                              name="cached_%s" % tensor._keras_history[0].name)
+            new_inputs.append(mapping[key])
+        outputs = layer(new_inputs if isinstance(inputs, (list, tuple)) else new_inputs[0])
+        for old, new in zip(_as_list(layer.output), _as_list(outputs)):
+            mapping[id(old)] = new
+
+    extractor = tf.keras.Model(model.input, boundary)
+    tail = tf.keras.Model([mapping[id(t)] for t in boundary], mapping[id(model.output)])
+    return extractor, tail
+
+class FeatureStore(ShardedStore):
+    @staticmethod
+    def _file_name(shard, k):
+        return "shard_%05d_%d.npy" % (shard, k)
+
+    @staticmethod
+    def _num_arrays(meta):
+        return len(meta["shapes"])
+
+    @staticmethod
+    def matches(directory, signature):
+        meta = read_meta(directory)
+        return meta is not None and meta.get("signature") == signature
+
+    @classmethod
+    def write(cls, directory, extractor, dataset, signature, shard_size=2048):
+        """Run extractor once over dataset of (images, labels) batches and store the results."""
+        shapes = [list(t.shape[1:]) for t in _as_list(extractor.output)]
+
+        def chunks():
+            for images, batch_labels in dataset:
+                outputs = _as_list(extractor.predict_on_batch(images))
+                yield outputs, np.argmax(np.asarray(batch_labels), axis=1)
+
+        return cls._write(directory, chunks(), [(shape, np.float16) for shape in shapes],
+                          {"signature": signature, "shapes": shapes}, shard_size)
+
+    def gather(self, rows):
+        """float32 activations of the given global rows, one array per boundary tensor."""
+        return tuple(self._gather(rows, [(shape, np.float32) for shape in self.meta["shapes"]]))
+
+    def dataset(self, batch_size, num_classes, shuffle=True, seed=0):
+        shapes = [tuple(shape) for shape in self.meta["shapes"]]
+        epochs = itertools.count()
+
+        def batches():
+            # tf.data calls this once per epoch; each epoch gets its own permutation
+            epoch_seed = (seed, next(epochs))
+            rows = shuffled(len(self), epoch_seed) if shuffle else np.arange(len(self))
+            for start in range(0, len(rows), batch_size):
+                index = rows[start:start + batch_size]
+                labels = np.eye(num_classes, dtype=np.float32)[self.labels[index]]
+                yield self.gather(index), labels
+
+        signature = (
+            tuple(tf.TensorSpec((None,) + shape, tf.float32) for shape in shapes),
+            tf.TensorSpec((None, num_classes), tf.float32),
+        )
+        return tf.data.Dataset.from_generator(batches, output_signature=signature).prefetch(tf.data.AUTOTUNE)
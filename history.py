@@ -0,0 +1,283 @@
+import base64
+import json
+import os
+import queue
+import sqlite3
+import threading
+from datetime import date, datetime, timedelta, timezone
+
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    filename TEXT NOT NULL,
+    disease TEXT NOT NULL,
+    confidence REAL NOT NULL,
+    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+# Both indexes implicitly end in id (the rowid), which the keyset cursor relies on.
+HISTORY_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_history_timestamp ON history (timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_history_disease_timestamp ON history (disease, timestamp)",
+]
+
+# Per-day counts kept current by a trigger, so aggregates never scan history
+SUMMARY_SCHEMA = [
+    """
+    CREATE TABLE history_daily (
+        day TEXT NOT NULL,
+        disease TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (day, disease)
+    ) WITHOUT ROWID
+    """,
+    """
+    INSERT INTO history_daily (day, disease, count)
+    SELECT date(timestamp), disease, COUNT(*) FROM history GROUP BY date(timestamp), disease
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS history_daily_insert AFTER INSERT ON history
+    BEGIN
+        INSERT INTO history_daily (day, disease, count) VALUES (date(NEW.timestamp), NEW.disease, 1)
+        ON CONFLICT (day, disease) DO UPDATE SET count = count + 1;
+    END
+    """,
+]
+
+def connect(db_path):
+    db = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    ensure_schema(db)
+    return db
+
+def ensure_schema(db):
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        db.execute(HISTORY_SCHEMA)
+        for statement in HISTORY_INDEXES:
+            db.execute(statement)
+        exists = db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'history_daily'").fetchone()
+        if not exists:
+            # One-off backfill from existing rows, then the trigger takes over
+            for statement in SUMMARY_SCHEMA:
+                db.execute(statement)
+        db.execute("COMMIT")
+    except Exception:
+        db.execute("ROLLBACK")
+        raise
+
+def utc_timestamp():
+    # Same text format SQLite's CURRENT_TIMESTAMP produces
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+class HistoryWriter:
+    """Background thread that persists uploads and history rows off the request path."""
+
+    def __init__(self, db_path, max_queue=10000, overflow="drop", batch_size=256, flush_interval=0.5):
+        if overflow not in ("drop", "block"):
+            raise ValueError("overflow must be 'drop' or 'block', not %r" % overflow)
+        self.db_path = db_path
+        self.overflow = overflow
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.lock = threading.Lock()
+        self.rows_written = 0
+        self.files_written = 0
+        self.dropped = 0
+        self.errors = 0
+        self._worker = None
+        self._pid = None
+        self._closed = False
+
+    def record(self, filename, disease, confidence):
+        return self._put(("row", (filename, disease, confidence, utc_timestamp())))
+
+    def save_file(self, path, data):
+        return self._put(("file", (path, data)))
+
+    def _put(self, item):
+        if self._closed:
+            return False
+        self._ensure_worker()
+        if self.overflow == "block":
+            self.queue.put(item)
+            return True
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            return False
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._pid == os.getpid() and self._worker.is_alive():
+            return
+        with self.lock:
+            if self._worker is None or self._pid != os.getpid() or not self._worker.is_alive():
+                self._pid = os.getpid()
+                self._worker = threading.Thread(target=self._run, name="history-writer", daemon=True)
+                self._worker.start()
+
+    def _drain(self):
+        try:
+            items = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        while len(items) < self.batch_size:
+            try:
+                items.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def _run(self):
+        db = connect(self.db_path)
+        while True:
+            items = self._drain()
+            if not items:
+                continue
+            stop = any(kind == "stop" for kind, _ in items)
+            self._write(db, [item for item in items if item[0] != "stop"])
+            for _ in items:
+                self.queue.task_done()
+            if stop:
+                db.close()
+                return
+
+    def _write(self, db, items):
+        # Files first so every committed row refers to an image that exists
+        files = 0
+        for kind, payload in items:
+            if kind == "file":
+                path, data = payload
+                try:
+                    with open(path, "wb") as f:
+                        f.write(data)
+                    files += 1
+                except OSError:
+                    with self.lock:
+                        self.errors += 1
+        rows = [payload for kind, payload in items if kind == "row"]
+        if rows:
+            try:
+                db.execute("BEGIN")
+                db.executemany(
+                    "INSERT INTO history (filename, disease, confidence, timestamp) VALUES (?, ?, ?, ?)",
+                    rows,
+                )
+                db.execute("COMMIT")
+            except sqlite3.Error:
+                if db.in_transaction:
+                    db.execute("ROLLBACK")
+                with self.lock:
+                    self.errors += 1
+                rows = []
+        with self.lock:
+            self.files_written += files
+            self.rows_written += len(rows)
+
+    def close(self, timeout=10.0):
+        # Flush everything queued so far, then stop the thread
+        if self._closed:
+            return
+        self._closed = True
+        if self._worker is None or self._pid != os.getpid() or not self._worker.is_alive():
+            return
+        self.queue.put(("stop", None))
+        self._worker.join(timeout)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "queued": self.queue.qsize(),
+                "overflow": self.overflow,
+                "rows_written": self.rows_written,
+                "files_written": self.files_written,
+                "dropped": self.dropped,
+                "errors": self.errors,
+            }
+
+def encode_cursor(timestamp, row_id):
+    return base64.urlsafe_b64encode(json.dumps([timestamp, row_id]).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    padded = cursor + "=" * (-len(cursor) % 4)
+    timestamp, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    return str(timestamp), int(row_id)
+
+def normalize_time(value):
+    # Accept "2025-05-04", "2025-05-04T18:10:53" or "2025-05-04 18:10:53"
+    return value.replace("T", " ").rstrip("Z") if value else None
+
+def day_bounds(start=None, end=None):
+    """(first day, first day after the range) of history_daily rows overlapping [start, end).
+
+    The daily table counts whole days, so a day is in range if any part of it
+    is: an end with a time of day past midnight keeps that day.
+    """
+    first = normalize_time(start)[:10] if start else None
+    stop = None
+    if end:
+        end = normalize_time(end)
+        stop = date.fromisoformat(end[:10])
+        if end[10:].strip(" :0."):
+            stop += timedelta(days=1)
+        stop = stop.isoformat()
+    return first, stop
+
+def query_history(db, disease=None, start=None, end=None, cursor=None, limit=50):
+    """Newest first, keyset-paginated on (timestamp, id) so every page is an index range scan.
+
+    start and end bound the timestamp as the half-open range [start, end), as in daily_counts.
+    """
+    clauses, params = [], []
+    if disease:
+        clauses.append("disease = ?")
+        params.append(disease)
+    if start:
+        clauses.append("timestamp >= ?")
+        params.append(normalize_time(start))
+    if end:
+        clauses.append("timestamp < ?")
+        params.append(normalize_time(end))
+    if cursor:
+        clauses.append("(timestamp, id) < (?, ?)")
+        params.extend(decode_cursor(cursor))
+    sql = "SELECT id, filename, disease, confidence, timestamp FROM history"
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    sql += " ORDER BY timestamp DESC, id DESC LIMIT ?"
+    rows = db.execute(sql, params + [limit + 1]).fetchall()
+
+    items = [
+        {"id": row[0], "filename": row[1], "disease": row[2], "confidence": row[3], "timestamp": row[4]}
+        for row in rows[:limit]
+    ]
+    next_cursor = None
+    if len(rows) > limit:
+        last = items[-1]
+        next_cursor = encode_cursor(last["timestamp"], last["id"])
+    return items, next_cursor
+
+def daily_counts(db, disease=None, start=None, end=None):
+    # Per-day counts over [start, end), the same half-open range as query_history (see day_bounds)
+    clauses, params = [], []
+    if disease:
+        clauses.append("disease = ?")
+        params.append(disease)
+    first, stop = day_bounds(start, end)
+    if first:
+        clauses.append("day >= ?")
+        params.append(first)
+    if stop:
+        clauses.append("day < ?")
+        params.append(stop)
+    sql = "SELECT day, disease, count FROM history_daily"
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    sql += " ORDER BY day, disease"
+    return [{"day": day, "disease": name, "count": count} for day, name, count in db.execute(sql, params)]
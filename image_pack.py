@@ -0,0 +1,142 @@
+import argparse
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import UnidentifiedImageError
+
+from classes import labelled_files
+from preprocessing import INPUT_SHAPE, decode_image
+from sharded_store import ShardedStore, read_meta, shuffled
+
+# Class-folder datasets packed into memory-mappable uint8 arrays, so training
+# and evaluation stop decoding the same JPEGs every epoch.
+#
+# Store layout (one directory per dataset split):
+#   meta.json              classes, shard sizes, how images were decoded, skipped files
+#   labels.npy             int16 class index per row
+#   images_00000.npy       uint8 (rows, 224, 224, 3) per shard
+#
+# Shards are sharded_store.py files. Contiguous row ranges come back as views of
+# the mapping (no copy, no decode); shuffled batches gather their rows from
+# across the shards, and only the pages a batch touches are read.
+#
+#   python image_pack.py "MangoLeafBD Dataset/train" packed/train
+#   python train.py --train-dir packed/train --test-dir packed/test
+
+FORMAT = "packed-images-v1"
+DECODERS = ("training", "serving")
+
+class PackedImages(ShardedStore):
+    def __init__(self, directory):
+        super().__init__(directory)
+        self.classes = self.meta["classes"]
+
+    @staticmethod
+    def _file_name(shard, k):
+        return "images_%05d.npy" % shard
+
+    @staticmethod
+    def _num_arrays(meta):
+        return 1
+
+    @staticmethod
+    def is_packed(directory):
+        meta = read_meta(directory)
+        return meta is not None and meta.get("format") == FORMAT
+
+    def gather(self, rows):
+        """uint8 images of the given global rows."""
+        return self._gather(rows, [(INPUT_SHAPE, np.uint8)])[0]
+
+    def batches(self, batch_size, shuffle=False, seed=0, num_shards=1, shard_index=0):
+        """(uint8 images, int labels) batches.
+
+        Without shuffle, batches follow the store's order, and a batch inside
+        one shard is a view into the mapped file. With shuffle, batches come from
+        one permutation of all rows.
+        num_shards/shard_index pick every num_shards-th row, as tf.data's shard() does.
+        """
+        if num_shards == 1 and not shuffle:
+            for start in range(0, len(self), batch_size):
+                stop = min(len(self), start + batch_size)
+                shard = int(np.searchsorted(self.offsets, start, side="right")) - 1
+                base = int(self.offsets[shard])
+                if stop <= self.offsets[shard + 1]:
+                    yield self.shards[shard][0][start - base:stop - base], self.labels[start:stop]
+                else:
+                    yield self.gather(np.arange(start, stop)), self.labels[start:stop]
+            return
+        rows = np.arange(shard_index, len(self), num_shards)
+        if shuffle:
+            rows = shuffled(rows, seed)
+        for start in range(0, len(rows), batch_size):
+            index = rows[start:start + batch_size]
+            yield self.gather(index), self.labels[index]
+
+    @classmethod
+    def write(cls, directory, chunks, classes, decoder, source, shard_size=4096, skipped=()):
+        """Write (uint8 images, labels) chunks as a store; meta.json goes last and marks it complete."""
+        # skipped may still be filling while chunks are consumed, so it is not copied here
+        meta = {"format": FORMAT, "classes": classes, "image_shape": list(INPUT_SHAPE), "decoder": decoder,
+                "source": source, "skipped": skipped}
+        chunks = (([images], chunk_labels) for images, chunk_labels in chunks)
+        return cls._write(directory, chunks, [(INPUT_SHAPE, np.uint8)], meta, shard_size)
+
+def training_chunks(paths, labels, chunk_size):
+    # train.py's decode (tf.io + nearest resize), so packed and unpacked training see the same pixels
+    import tensorflow as tf
+    from train import decode_and_resize
+    ds = tf.data.Dataset.from_tensor_slices((paths, labels))
+    ds = ds.map(lambda path, label: (decode_and_resize(path), label), num_parallel_calls=tf.data.AUTOTUNE)
+    for images, chunk_labels in ds.batch(chunk_size).prefetch(2):
+        yield images.numpy(), chunk_labels.numpy()
+
+def _decode(path, out):
+    try:
+        decode_image(path, out)
+        return True
+    except (UnidentifiedImageError, OSError):
+        return False
+
+def serving_chunks(paths, labels, chunk_size, workers, skipped):
+    # app.py's decode (PIL draft + nearest resize), for evaluating what the server would see.
+    # Unreadable files are left out of the store and appended to skipped.
+    with ThreadPoolExecutor(workers) as pool:
+        for start in range(0, len(paths), chunk_size):
+            chunk = paths[start:start + chunk_size]
+            images = np.empty((len(chunk),) + INPUT_SHAPE, dtype=np.uint8)
+            ok = np.asarray(list(pool.map(_decode, chunk, images)), dtype=bool)
+            skipped.extend(path for path, decoded in zip(chunk, ok) if not decoded)
+            yield images[ok], labels[start:start + chunk_size][ok]
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack a class-folder dataset into memory-mappable uint8 shards")
+    parser.add_argument("source", help="class-folder dataset, e.g. \"MangoLeafBD Dataset/train\"")
+    parser.add_argument("output", help="directory for the packed store")
+    parser.add_argument("--decoder", choices=DECODERS, default="training",
+                        help="training: train.py's tf.io decode; serving: app.py's PIL decode")
+    parser.add_argument("--shard-size", type=int, default=4096, help="images per shard file")
+    parser.add_argument("--chunk-size", type=int, default=256)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="decode threads (serving decoder)")
+    args = parser.parse_args()
+
+    paths, labels, classes = labelled_files(args.source)
+    if not paths:
+        parser.error("No images found in %s" % args.source)
+    skipped = []
+    if args.decoder == "training":
+        chunks = training_chunks(paths, labels, args.chunk_size)
+    else:
+        chunks = serving_chunks(paths, labels, args.chunk_size, args.workers, skipped)
+    store = PackedImages.write(args.output, chunks, classes, args.decoder, args.source, args.shard_size, skipped)
+    source_bytes = sum(os.path.getsize(path) for path in paths)
+    print("%d images, %d classes, %d shards: %.1f MB of source files -> %.1f MB packed (%s)" % (
+        len(store), len(classes), len(store.shards), source_bytes / 1e6, store.nbytes / 1e6, args.output))
+    if skipped:
+        print("Skipped %d unreadable files:" % len(skipped))
+        for path in skipped:
+            print("  %s" % path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,398 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import urllib.request
+import uuid
+from datetime import datetime, timezone
+
+import history
+
+# Asynchronous batch jobs. A submission is spooled to disk and recorded in
+# SQLite before its id is returned; worker threads claim queued jobs, classify
+# their images a chunk at a time and commit each chunk's results together with
+# the job's progress. A running job holds a lease that every commit renews, so
+# jobs left behind by a crashed or restarted process are picked up again and
+# continue after their last committed chunk. Each claim takes a fresh
+# lease_token and every write is conditional on it, so a worker whose lease was
+# taken over (it stalled past the lease) cannot commit over the new owner.
+
+logger = logging.getLogger(__name__)
+
+JOBS_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        state TEXT NOT NULL,
+        total INTEGER NOT NULL,
+        processed INTEGER NOT NULL DEFAULT 0,
+        failed INTEGER NOT NULL DEFAULT 0,
+        callback_url TEXT,
+        error TEXT,
+        created_at REAL NOT NULL,
+        started_at REAL,
+        heartbeat_at REAL,
+        lease_token TEXT,
+        finished_at REAL,
+        processing_seconds REAL NOT NULL DEFAULT 0
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_jobs_state_created ON jobs (state, created_at)",
+    """
+    CREATE TABLE IF NOT EXISTS job_items (
+        job_id TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        filename TEXT NOT NULL,
+        done INTEGER NOT NULL DEFAULT 0,
+        disease TEXT,
+        confidence REAL,
+        uncertain INTEGER,
+        top_k TEXT,
+        error TEXT,
+        PRIMARY KEY (job_id, seq)
+    ) WITHOUT ROWID
+    """,
+]
+
+JOB_STATES = ("queued", "running", "done", "failed")
+
+class LeaseLost(Exception):
+    """The job was claimed by another worker after this one's lease expired."""
+
+    def __init__(self, job_id):
+        super().__init__("Lease on job %s was taken over" % job_id)
+        self.job_id = job_id
+
+def connect(db_path):
+    db = history.connect(db_path)
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        for statement in JOBS_SCHEMA:
+            db.execute(statement)
+        columns = [row[1] for row in db.execute("PRAGMA table_info(jobs)")]
+        if "lease_token" not in columns:
+            # Databases created before leases had owners
+            db.execute("ALTER TABLE jobs ADD COLUMN lease_token TEXT")
+        db.execute("COMMIT")
+    except Exception:
+        db.execute("ROLLBACK")
+        raise
+    return db
+
+def _timestamp(seconds):
+    # Same text format as the history table's timestamps
+    if seconds is None:
+        return None
+    return datetime.fromtimestamp(seconds, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+def claim_job(db, lease):
+    """Mark the oldest runnable job as running and return (id, lease token), or None.
+
+    Runnable means queued, or running with a lease that expired more than
+    lease seconds ago (its process died). Safe across processes sharing the db.
+    """
+    now = time.time()
+    token = uuid.uuid4().hex
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        row = db.execute(
+            "SELECT id FROM jobs WHERE state = 'queued' OR (state = 'running' AND heartbeat_at < ?) "
+            "ORDER BY created_at LIMIT 1",
+            (now - lease,),
+        ).fetchone()
+        if row is not None:
+            db.execute(
+                "UPDATE jobs SET state = 'running', started_at = COALESCE(started_at, ?), heartbeat_at = ?, "
+                "lease_token = ? WHERE id = ?",
+                (now, now, token, row[0]),
+            )
+        db.execute("COMMIT")
+    except Exception:
+        db.execute("ROLLBACK")
+        raise
+    return (row[0], token) if row is not None else None
+
+def _renew(db, job_id, token, seconds=0.0):
+    # Heartbeat (and processing time) only while the lease is still ours; False if it was taken over
+    return db.execute(
+        "UPDATE jobs SET heartbeat_at = ?, processing_seconds = processing_seconds + ? "
+        "WHERE id = ? AND lease_token = ? AND state = 'running'",
+        (time.time(), seconds, job_id, token),
+    ).rowcount == 1
+
+def renew_lease(db, job_id, token):
+    """Heartbeat a running job between commits; raises LeaseLost if another worker took it."""
+    if not _renew(db, job_id, token):
+        raise LeaseLost(job_id)
+
+def pending_items(db, job_id):
+    return db.execute(
+        "SELECT seq, filename FROM job_items WHERE job_id = ? AND done = 0 ORDER BY seq", (job_id,)
+    ).fetchall()
+
+def record_results(db, job_id, token, rows, seconds):
+    """Store one chunk's results and progress in one transaction, if the lease is still ours.
+
+    rows are (seq, disease, confidence, uncertain, top_k list, error). processed
+    and failed grow by the items this call flipped to done, so results for items
+    that are already done change nothing. Raises LeaseLost, writing nothing, if
+    another worker claimed the job.
+    """
+    update = ("UPDATE job_items SET done = 1, disease = ?, confidence = ?, uncertain = ?, top_k = ?, error = ? "
+              "WHERE job_id = ? AND seq = ? AND done = 0")
+    values = [(disease, confidence, uncertain, None if top_k is None else json.dumps(top_k), error, job_id, seq)
+              for seq, disease, confidence, uncertain, top_k, error in rows]
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        if not _renew(db, job_id, token, seconds):
+            raise LeaseLost(job_id)
+        succeeded = db.executemany(update, [row for row in values if row[4] is None]).rowcount
+        failed = db.executemany(update, [row for row in values if row[4] is not None]).rowcount
+        db.execute("UPDATE jobs SET processed = processed + ?, failed = failed + ? WHERE id = ?",
+                   (succeeded + failed, failed, job_id))
+        db.execute("COMMIT")
+    except Exception:
+        db.execute("ROLLBACK")
+        raise
+
+def finish_job(db, job_id, token, state, error=None):
+    """Move a running job to state (done, failed, or queued to hand it back); False if the lease was taken over."""
+    finished_at = None if state == "queued" else time.time()
+    return db.execute(
+        "UPDATE jobs SET state = ?, error = ?, finished_at = ? WHERE id = ? AND lease_token = ? AND state = 'running'",
+        (state, error, finished_at, job_id, token),
+    ).rowcount == 1
+
+def get_job(db, job_id):
+    row = db.execute(
+        "SELECT id, state, total, processed, failed, error, created_at, started_at, finished_at, "
+        "processing_seconds FROM jobs WHERE id = ?",
+        (job_id,),
+    ).fetchone()
+    if row is None:
+        return None
+    job_id, state, total, processed, failed, error, created_at, started_at, finished_at, processing = row
+    end = finished_at if finished_at is not None else time.time()
+    return {
+        "id": job_id,
+        "state": state,
+        "total": total,
+        "processed": processed,
+        "failed": failed,
+        "progress": processed / total if total else 1.0,
+        "error": error,
+        "created_at": _timestamp(created_at),
+        "started_at": _timestamp(started_at),
+        "finished_at": _timestamp(finished_at),
+        # Time from submission to the first worker picking the job up
+        "queue_seconds": (started_at if started_at is not None else end) - created_at,
+        "processing_seconds": processing,
+        "images_per_second": processed / processing if processing else None,
+    }
+
+def job_results(db, job_id, cursor=None, limit=100):
+    # Finished items in submission order, keyset-paginated on seq
+    rows = db.execute(
+        "SELECT seq, filename, disease, confidence, uncertain, top_k, error FROM job_items "
+        "WHERE job_id = ? AND done = 1 AND seq > ? ORDER BY seq LIMIT ?",
+        (job_id, -1 if cursor is None else int(cursor), limit + 1),
+    ).fetchall()
+    items = []
+    for seq, filename, disease, confidence, uncertain, top_k, error in rows[:limit]:
+        if error is not None:
+            items.append({"seq": seq, "filename": filename, "success": False, "error": error})
+        else:
+            items.append({"seq": seq, "filename": filename, "success": True, "disease": disease,
+                          "confidence": confidence, "uncertain": bool(uncertain), "top_k": json.loads(top_k)})
+    next_cursor = str(items[-1]["seq"]) if len(rows) > limit else None
+    return items, next_cursor
+
+class JobRunner:
+    """Durable job queue in db_path with a pool of worker threads.
+
+    process(paths, heartbeat) classifies one chunk of spooled image files and
+    returns, per path, (disease, confidence, uncertain, top_k, error); it runs on
+    the worker threads and should call heartbeat() while it waits (for admission,
+    say), which keeps the job's lease and raises LeaseLost if it is gone.
+    on_start(queue_seconds) and on_progress(images, seconds) are optional hooks
+    for metrics.
+    """
+
+    def __init__(self, db_path, spool_dir, process, workers=1, chunk_size=32, lease=60.0, poll_interval=1.0,
+                 callbacks=False, on_start=None, on_progress=None):
+        self.db_path = db_path
+        self.spool_dir = spool_dir
+        self.process = process
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.callbacks = callbacks
+        self.on_start = on_start
+        self.on_progress = on_progress
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.threads = []
+        self._pid = None
+        self._db = None
+        self._workers_pid = None
+        self.completed = 0
+        self.callback_errors = 0
+        self.worker_errors = 0
+
+    def _connection(self):
+        # Request-side connection, shared under self.lock
+        if self._db is None or self._pid != os.getpid():
+            self._db = connect(self.db_path)
+            self._pid = os.getpid()
+        return self._db
+
+    def submit(self, uploads, callback_url=None):
+        """Spool [(name, bytes)] and queue them as one job; returns the job's status dict."""
+        job_id = uuid.uuid4().hex
+        directory = os.path.join(self.spool_dir, job_id)
+        os.makedirs(directory)
+        names = []
+        for seq, (name, data) in enumerate(uploads):
+            with open(os.path.join(directory, "%06d%s" % (seq, os.path.splitext(name)[1].lower())), "wb") as f:
+                f.write(data)
+            names.append(name)
+        with self.lock:
+            db = self._connection()
+            db.execute("BEGIN")
+            try:
+                db.execute("INSERT INTO jobs (id, state, total, callback_url, created_at) VALUES (?, 'queued', ?, ?, ?)",
+                           (job_id, len(names), callback_url, time.time()))
+                db.executemany("INSERT INTO job_items (job_id, seq, filename) VALUES (?, ?, ?)",
+                               [(job_id, seq, name) for seq, name in enumerate(names)])
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                shutil.rmtree(directory, ignore_errors=True)
+                raise
+            job = get_job(db, job_id)
+        self.wakeup.set()
+        return job
+
+    def status(self, job_id, cursor=None, limit=100):
+        """Status dict with one page of results, or None for an unknown id."""
+        with self.lock:
+            db = self._connection()
+            job = get_job(db, job_id)
+            if job is not None:
+                job["results"], job["next_cursor"] = job_results(db, job_id, cursor, limit)
+        return job
+
+    def start(self):
+        with self.lock:
+            if self._workers_pid == os.getpid():
+                return
+            self._workers_pid = os.getpid()
+            self.threads = [
+                threading.Thread(target=self._run, name="job-worker-%d" % i, daemon=True)
+                for i in range(self.workers)
+            ]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self, timeout=10.0):
+        # Chunks in progress finish and commit; the rest of the job stays queued for the next start
+        self.stopping.set()
+        self.wakeup.set()
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def _run(self):
+        db = None
+        while not self.stopping.is_set():
+            try:
+                if db is None:
+                    db = connect(self.db_path)
+                claimed = claim_job(db, self.lease)
+                if claimed is None:
+                    self.wakeup.wait(self.poll_interval)
+                    self.wakeup.clear()
+                    continue
+                self._run_job(db, *claimed)
+            except Exception:
+                # A locked or unavailable database must not end the thread; an unfinished
+                # job stays running and is claimed again once its lease expires
+                logger.exception("Job worker error, retrying in %.1fs", self.poll_interval)
+                with self.lock:
+                    self.worker_errors += 1
+                if db is not None and db.in_transaction:
+                    db.execute("ROLLBACK")
+                self.stopping.wait(self.poll_interval)
+        if db is not None:
+            db.close()
+
+    def _heartbeat(self, db, job_id, token):
+        # Renews at most every lease / 4 seconds however often process() calls it
+        renewed = [time.monotonic()]
+
+        def heartbeat():
+            if time.monotonic() - renewed[0] >= self.lease / 4:
+                renew_lease(db, job_id, token)
+                renewed[0] = time.monotonic()
+        return heartbeat
+
+    def _run_job(self, db, job_id, token):
+        job = get_job(db, job_id)
+        if job["processed"] == 0 and self.on_start is not None:
+            self.on_start(job["queue_seconds"])
+        directory = os.path.join(self.spool_dir, job_id)
+        heartbeat = self._heartbeat(db, job_id, token)
+        try:
+            spooled = {int(name[:6]): os.path.join(directory, name) for name in os.listdir(directory)}
+            items = pending_items(db, job_id)
+            for start in range(0, len(items), self.chunk_size):
+                if self.stopping.is_set():
+                    # Hand the rest back to the queue instead of waiting out the lease
+                    finish_job(db, job_id, token, "queued")
+                    return
+                chunk = items[start:start + self.chunk_size]
+                began = time.perf_counter()
+                results = self.process([spooled[seq] for seq, _ in chunk], heartbeat)
+                seconds = time.perf_counter() - began
+                record_results(db, job_id, token,
+                               [(seq,) + tuple(result) for (seq, _), result in zip(chunk, results)], seconds)
+                if self.on_progress is not None:
+                    self.on_progress(len(chunk), seconds)
+            finished = finish_job(db, job_id, token, "done")
+        except LeaseLost:
+            return  # the new owner carries on from the last committed chunk
+        except Exception as e:
+            finished = finish_job(db, job_id, token, "failed", str(e))
+        if not finished:
+            return
+        shutil.rmtree(directory, ignore_errors=True)
+        with self.lock:
+            self.completed += 1
+        self._notify(db, job_id)
+
+    def _notify(self, db, job_id):
+        # Webhook-style completion notice: POST the final status (without results) to callback_url
+        row = db.execute("SELECT callback_url FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if not self.callbacks or row is None or not row[0]:
+            return
+        request = urllib.request.Request(row[0], data=json.dumps(get_job(db, job_id)).encode(),
+                                         headers={"Content-Type": "application/json"}, method="POST")
+        try:
+            urllib.request.urlopen(request, timeout=10).close()
+        except OSError:
+            with self.lock:
+                self.callback_errors += 1
+
+    def stats(self):
+        with self.lock:
+            counts = dict(self._connection().execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+            return {
+                "workers": self.workers,
+                "jobs": {state: counts.get(state, 0) for state in JOB_STATES},
+                "completed_here": self.completed,
+                "callback_errors": self.callback_errors,
+                "worker_errors": self.worker_errors,
+            }
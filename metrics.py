@@ -0,0 +1,173 @@
+import bisect
+import threading
+import time
+
+# Minimal Prometheus text-format metrics. Every series is created up front (or on
+# first use of a label value) so recording on the request path only bumps
+# preallocated counters under a lock.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _format_labels(names, values, extra=""):
+    pairs = ['%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+             for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{%s}" % ",".join(pairs) if pairs else ""
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Value:
+    __slots__ = ("lock", "value")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self, name, labelnames, values):
+        yield "%s%s %s" % (name, _format_labels(labelnames, values), _format_value(self.value))
+
+class _Buckets:
+    __slots__ = ("lock", "bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.lock = threading.Lock()
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def samples(self, name, labelnames, values):
+        with self.lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        cumulative = 0
+        for bound, bucket_count in zip(self.bounds + (float("inf"),), counts):
+            cumulative += bucket_count
+            le = 'le="%s"' % _format_value(float(bound))
+            yield "%s_bucket%s %d" % (name, _format_labels(labelnames, values, le), cumulative)
+        yield "%s_sum%s %s" % (name, _format_labels(labelnames, values), _format_value(total))
+        yield "%s_count%s %d" % (name, _format_labels(labelnames, values), count)
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=(), registry=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.children = {}
+        if not self.labelnames:
+            self._default = self.labels()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.get(values)
+                if child is None:
+                    child = self.children[values] = self._new_child()
+        return child
+
+    def render(self):
+        lines = ["# HELP %s %s" % (self.name, self.help), "# TYPE %s %s" % (self.name, self.kind)]
+        for values, child in sorted(self.children.items()):
+            lines.extend(child.samples(self.name, self.labelnames, values))
+        return "\n".join(lines)
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value):
+        self._default.set(value)
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS, registry=None):
+        self.buckets = tuple(buckets)
+        super().__init__(name, help, labelnames, registry)
+
+    def _new_child(self):
+        return _Buckets(self.buckets)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+class CallbackMetric:
+    """Value read from existing state (cache counters, queue depth) at scrape time."""
+
+    def __init__(self, name, help, kind, fn, registry=None):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.fn = fn
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def render(self):
+        return "# HELP %s %s\n# TYPE %s %s\n%s %s" % (
+            self.name, self.help, self.name, self.kind, self.name, _format_value(self.fn()))
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def render(self):
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+REGISTRY = Registry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+class StageTimer:
+    """Per-thread, reusable stage stopwatch: lap(i) charges the time since the last mark to stage i."""
+
+    def __init__(self, stages):
+        self.stages = stages
+        self.times = [0.0] * len(stages)
+        self.started = 0.0
+        self.mark = 0.0
+
+    def start(self):
+        for i in range(len(self.times)):
+            self.times[i] = 0.0
+        self.started = self.mark = time.perf_counter()
+
+    def lap(self, index):
+        now = time.perf_counter()
+        self.times[index] += now - self.mark
+        self.mark = now
+
+    def server_timing(self):
+        return ", ".join("%s;dur=%.2f" % (name, self.times[i] * 1000.0)
+                         for i, name in enumerate(self.stages) if self.times[i])
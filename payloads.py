@@ -0,0 +1,69 @@
+import gzip
+import hashlib
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; without it only gzip is offered
+    brotli = None
+
+# Response bodies that never change while the process runs (the index page, the
+# disease catalogue), rendered and compressed once at startup. Each encoding has
+# its own strong ETag, so a revalidation costs a header comparison and a 304.
+
+def _accepted(accept_encoding):
+    # {coding: q} from an Accept-Encoding header
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding.strip().lower()] = q
+    return accepted
+
+class PrecomputedResponse:
+    def __init__(self, body, content_type, cache_control="no-cache"):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        self.content_type = content_type
+        self.cache_control = cache_control
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        # (encoding, body, etag), most preferred first
+        self.variants = []
+        if brotli is not None:
+            self.variants.append(("br", brotli.compress(body, quality=11), '"%s-br"' % digest))
+        # mtime=0 keeps the gzip bytes identical across restarts and workers sharing an ETag
+        self.variants.append(("gzip", gzip.compress(body, compresslevel=9, mtime=0), '"%s-gz"' % digest))
+        self.identity = (None, body, '"%s"' % digest)
+
+    def select(self, accept_encoding):
+        accepted = _accepted(accept_encoding)
+        for variant in self.variants:
+            q = accepted.get(variant[0], accepted.get("*", 0.0))
+            # Only compress when it actually saves bytes
+            if q > 0 and len(variant[1]) < len(self.identity[1]):
+                return variant
+        return self.identity
+
+    def respond(self, accept_encoding, if_none_match):
+        """(status, body, headers) for a GET with the given request headers."""
+        encoding, body, etag = self.select(accept_encoding)
+        headers = {
+            "ETag": etag,
+            "Cache-Control": self.cache_control,
+            "Vary": "Accept-Encoding",
+        }
+        # If-None-Match uses weak comparison, so W/"x" matches "x"
+        if if_none_match and (if_none_match.strip() == "*" or
+                              etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]):
+            return 304, b"", headers
+        headers["Content-Type"] = self.content_type
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return 200, body, headers
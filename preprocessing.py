@@ -0,0 +1,44 @@
+import threading
+
+import numpy as np
+from PIL import Image
+
+# (width, height) fed to InceptionV3
+TARGET_SIZE = (224, 224)
+INPUT_SHAPE = (TARGET_SIZE[1], TARGET_SIZE[0], 3)
+
+_local = threading.local()
+
+def new_batch(batch_size):
+    return np.empty((batch_size,) + INPUT_SHAPE, dtype=np.float32)
+
+def thread_buffer():
+    # Reusable single-image input buffer, one per request thread
+    buffer = getattr(_local, "buffer", None)
+    if buffer is None:
+        buffer = _local.buffer = new_batch(1)
+    return buffer
+
+def decode_image(source, out, target_size=TARGET_SIZE):
+    # source is a path or a file-like object; out is a (224, 224, 3) view to fill
+    with Image.open(source) as img:
+        # JPEG only: let the decoder scale by 1/2, 1/4 or 1/8 in the IDCT so a
+        # multi-megapixel photo is never fully materialised (no-op for other formats)
+        img.draft("RGB", target_size)
+        img = img.convert("RGB")
+        if img.size != target_size:
+            img = img.resize(target_size, Image.NEAREST)
+        out[...] = np.asarray(img)
+    return out
+
+def preprocess_inplace(batch):
+    # Same scaling as inception_v3.preprocess_input ([-1, 1]) without allocating
+    batch /= 127.5
+    batch -= 1.0
+    return batch
+
+def load_image_array(source, out=None):
+    if out is None:
+        out = new_batch(1)
+    decode_image(source, out[0])
+    return preprocess_inplace(out)
@@ -0,0 +1,119 @@
+import argparse
+import os
+import signal
+import socket
+import sys
+import time
+
+# Production launcher: one listening socket, N pre-forked worker processes, each
+# pinned to its own slice of cores with inference threads sized to match.
+#
+#   python serve.py --workers 8 --cores-per-worker 4 --port 700
+#
+# Workers fork before TensorFlow is imported (app.py loads the model lazily), so
+# each one initialises its own runtime and holds its own copy of the weights. The
+# TFLite interpreter memory-maps a .tflite file, but its default XNNPACK delegate
+# repacks the weights into private memory. TFLITE_XNNPACK=0 leaves them in the
+# shared mapping, which pays off only with a small BATCH_MAX_SIZE: the builtin
+# kernels' activation arena grows faster with batch size (README, Production
+# Serving, has the per-worker Private_Dirty measurements).
+
+def core_slices(workers, cores_per_worker):
+    cores = sorted(os.sched_getaffinity(0))
+    if cores_per_worker is None:
+        cores_per_worker = max(1, len(cores) // workers)
+    slices = []
+    for i in range(workers):
+        start = (i * cores_per_worker) % len(cores)
+        slices.append(cores[start:start + cores_per_worker] or cores[:cores_per_worker])
+    return slices
+
+def run_worker(fd, host, port, cores, threads_per_worker):
+    os.sched_setaffinity(0, cores)
+    threads = str(threads_per_worker or len(cores))
+    # Must be set before TensorFlow / ONNX Runtime / OpenMP initialise
+    os.environ["INFERENCE_THREADS"] = threads
+    os.environ["TF_NUM_INTRAOP_THREADS"] = threads
+    os.environ["TF_NUM_INTEROP_THREADS"] = "1"
+    os.environ["OMP_NUM_THREADS"] = threads
+    os.environ.setdefault("DECODE_WORKERS", threads)
+
+    from werkzeug.serving import make_server
+    import app as plantguard
+
+    plantguard.start_model_loading()
+    server = make_server(host, port, plantguard.app, threaded=True, fd=fd)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print("worker %d serving on cores %s" % (os.getpid(), ",".join(map(str, cores))), flush=True)
+    try:
+        server.serve_forever()
+    finally:
+        # Workers leave via os._exit, which skips atexit; flush pending history here
+        plantguard.shutdown()
+
+def spawn(sock, args, cores):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            run_worker(sock.fileno(), args.host, args.port, cores, args.threads_per_worker)
+        finally:
+            os._exit(0)
+    return pid
+
+def main():
+    parser = argparse.ArgumentParser(description="Run PlantGuard with pinned worker processes")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=700)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: cores / cores-per-worker)")
+    parser.add_argument("--cores-per-worker", type=int, default=None)
+    parser.add_argument("--threads-per-worker", type=int, default=None,
+                        help="inference threads per worker (default: cores in its slice)")
+    parser.add_argument("--backlog", type=int, default=1024)
+    args = parser.parse_args()
+
+    available = len(os.sched_getaffinity(0))
+    if args.workers is None:
+        args.workers = max(1, available // (args.cores_per_worker or 4))
+    slices = core_slices(args.workers, args.cores_per_worker)
+
+    family = socket.AF_INET6 if ":" in args.host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(args.backlog)
+    sock.set_inheritable(True)
+
+    workers = {spawn(sock, args, cores): cores for cores in slices}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    # Supervise: restart workers that die until asked to stop
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        cores = workers.pop(pid, None)
+        if cores is not None and not stopping:
+            print("worker %d exited (%d); restarting" % (pid, status), file=sys.stderr, flush=True)
+            time.sleep(1)
+            workers[spawn(sock, args, cores)] = cores
+    sock.close()
+
+if __name__ == "__main__":
+    main()
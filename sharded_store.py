@@ -0,0 +1,121 @@
+import json
+import os
+
+import numpy as np
+
+# Row-aligned arrays split across plain .npy shard files, shared by
+# image_pack.py (uint8 images) and feature_cache.py (float16 activations).
+#
+# Store layout (one directory per dataset split):
+#   meta.json              written last: its presence marks a complete store
+#   labels.npy             int16 class index per row
+#   <shard files>          one file per array and shard, named by the subclass
+#
+# Shards are opened with mmap_mode="r", so reading a batch only touches the
+# pages it needs and several readers can share one page cache.
+
+def read_meta(directory):
+    """meta.json of a complete store, or None."""
+    path = os.path.join(directory, "meta.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def shuffled(rows, seed):
+    # One permutation across every shard: rows are written in class-folder
+    # order, so shuffling only within a shard would give class-blocked epochs.
+    return np.random.default_rng(seed).permutation(rows)
+
+class ShardedStore:
+    def __init__(self, directory):
+        self.directory = directory
+        self.meta = read_meta(directory)
+        if self.meta is None:
+            raise FileNotFoundError("No complete store in %s" % directory)
+        self.labels = np.load(os.path.join(directory, "labels.npy"), mmap_mode="r")
+        self.shards = [
+            [np.load(os.path.join(directory, self._file_name(i, k)), mmap_mode="r")
+             for k in range(self._num_arrays(self.meta))]
+            for i in range(len(self.meta["shard_sizes"]))
+        ]
+        self.offsets = np.cumsum([0] + self.meta["shard_sizes"])
+
+    @staticmethod
+    def _file_name(shard, k):
+        raise NotImplementedError
+
+    @staticmethod
+    def _num_arrays(meta):
+        raise NotImplementedError
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for arrays in self.shards for array in arrays)
+
+    def _gather(self, rows, specs):
+        """Arrays of the given global rows, one per (shape, dtype) in specs.
+
+        Rows are grouped by shard and read in sorted order within each shard,
+        so each mmap is read in increasing offset order.
+        """
+        outputs = [np.empty((len(rows),) + tuple(shape), dtype=dtype) for shape, dtype in specs]
+        shard_of = np.searchsorted(self.offsets, rows, side="right") - 1
+        for shard in np.unique(shard_of):
+            positions = np.nonzero(shard_of == shard)[0]
+            local = rows[positions] - self.offsets[shard]
+            order = np.argsort(local)
+            positions, local = positions[order], local[order]
+            for out, array in zip(outputs, self.shards[shard]):
+                out[positions] = array[local]
+        return outputs
+
+    @classmethod
+    def _write(cls, directory, chunks, specs, meta, shard_size):
+        """Write ([arrays], labels) chunks, one array per (shape, dtype) in specs, then meta.json."""
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(os.path.join(directory, "meta.json")):
+            # Rewriting in place: the old store is incomplete until the new meta.json is written
+            os.remove(os.path.join(directory, "meta.json"))
+        labels, shard_sizes = [], []
+        arrays, filled = None, 0
+
+        def close_shard():
+            shard = len(shard_sizes)
+            for k, array in enumerate(arrays):
+                array.flush()
+                if filled < shard_size:
+                    # Trim the preallocated tail of the last shard
+                    np.save(os.path.join(directory, cls._file_name(shard, k)), np.array(array[:filled]))
+            shard_sizes.append(filled)
+
+        for values, chunk_labels in chunks:
+            labels.append(np.asarray(chunk_labels, dtype=np.int16))
+            start = 0
+            while start < len(chunk_labels):
+                if arrays is None or filled == shard_size:
+                    if arrays is not None:
+                        close_shard()
+                    shard = len(shard_sizes)
+                    arrays = [
+                        np.lib.format.open_memmap(
+                            os.path.join(directory, cls._file_name(shard, k)),
+                            mode="w+", dtype=dtype, shape=(shard_size,) + tuple(shape))
+                        for k, (shape, dtype) in enumerate(specs)
+                    ]
+                    filled = 0
+                n = min(len(chunk_labels) - start, shard_size - filled)
+                for array, value in zip(arrays, values):
+                    array[filled:filled + n] = value[start:start + n]
+                filled += n
+                start += n
+        if arrays is not None:
+            close_shard()
+
+        np.save(os.path.join(directory, "labels.npy"), np.concatenate(labels) if labels else np.zeros(0, np.int16))
+        with open(os.path.join(directory, "meta.json"), "w") as f:
+            json.dump(dict(meta, shard_sizes=shard_sizes), f, indent=2)
+        return cls(directory)
@@ -0,0 +1,98 @@
+import math
+
+import numpy as np
+from PIL import Image
+
+from preprocessing import TARGET_SIZE, preprocess_inplace
+
+# Tiled inference for photos of whole branches. Instead of squashing the frame
+# into one 224x224 input, the image is decoded at a bounded working size, cut
+# into overlapping 224x224 tiles, and tiles that are mostly background (by an
+# excess-green mask) are skipped. The remaining tiles go to the model as one
+# batch. The working size is chosen so the grid never exceeds max_tiles, which
+# bounds the forward pass; JPEG draft decoding bounds the decode, so a 12 MP
+# photo costs about as much as a 1 MP one.
+
+TILE = TARGET_SIZE[0]
+
+def working_size(width, height, max_side):
+    # Longer side at most max_side, short side never below one tile
+    scale = min(1.0, max_side / max(width, height))
+    scale = max(scale, TILE / min(width, height))
+    return max(TILE, round(width * scale)), max(TILE, round(height * scale))
+
+def grid_offsets(length, overlap):
+    # Evenly spaced tile offsets covering [0, length) with at least `overlap` between neighbours
+    stride = TILE * (1.0 - overlap)
+    count = max(1, math.ceil((length - TILE) / stride) + 1)
+    return np.linspace(0, length - TILE, count).round().astype(int)
+
+def fit_side(width, height, max_side, max_tiles, overlap):
+    """Largest max_side (down from the given one) whose tile grid has at most max_tiles tiles."""
+    side = max_side
+    while side > TILE:
+        w, h = working_size(width, height, side)
+        if len(grid_offsets(w, overlap)) * len(grid_offsets(h, overlap)) <= max_tiles:
+            break
+        side = int(side * 0.9)
+    return side
+
+def decode_working(source, max_side, max_tiles, overlap):
+    """(uint8 (H, W, 3) working image, (width, height) of the original)."""
+    with Image.open(source) as img:
+        original = img.size
+        size = working_size(*original, fit_side(*original, max_side, max_tiles, overlap))
+        # JPEG only: decode at 1/2, 1/4 or 1/8 scale when that is still at least `size`
+        img.draft("RGB", size)
+        img = img.convert("RGB")
+        if img.size != size:
+            img = img.resize(size, Image.BILINEAR, reducing_gap=2.0)
+        return np.asarray(img), original
+
+def leaf_mask(image, threshold=20):
+    # Excess green (2G - R - B): cheap vegetation index, true on leaf pixels
+    image = image.astype(np.int16)
+    return 2 * image[..., 1] - image[..., 0] - image[..., 2] > threshold
+
+def tile_coverage(mask, ys, xs):
+    """(rows, cols) fraction of mask pixels inside every tile, via an integral image."""
+    integral = np.zeros((mask.shape[0] + 1, mask.shape[1] + 1), dtype=np.int32)
+    np.cumsum(np.cumsum(mask, axis=0, dtype=np.int32), axis=1, out=integral[1:, 1:])
+    y0, x0 = ys[:, None], xs[None, :]
+    y1, x1 = y0 + TILE, x0 + TILE
+    inside = integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+    return inside / float(TILE * TILE)
+
+def extract(image, positions, out):
+    # Copy the tiles at (y, x) positions into a preallocated float32 batch and scale it
+    for i, (y, x) in enumerate(positions):
+        out[i] = image[y:y + TILE, x:x + TILE]
+    return preprocess_inplace(out)
+
+def select(coverage, min_leaf, max_tiles, use_mask=True):
+    """Boolean (rows, cols) of tiles worth scoring: enough leaf, at most max_tiles of them.
+
+    With the mask off every tile qualifies. If no tile has enough leaf (dry,
+    badly diseased or oddly lit leaves) the greenest one is scored anyway.
+    """
+    keep = coverage >= min_leaf if use_mask else np.ones(coverage.shape, dtype=bool)
+    if not keep.any():
+        keep = coverage == coverage.max()
+    if keep.sum() > max_tiles:
+        # Only extreme aspect ratios get here; keep the leafiest tiles
+        ranked = np.argsort(-np.where(keep, coverage, -1.0), axis=None, kind="stable")
+        keep = np.zeros(coverage.shape, dtype=bool)
+        keep.flat[ranked[:max_tiles]] = True
+    return keep
+
+def aggregate(predictions, weights, mode="mean"):
+    """Image-level class probabilities from (N, classes) tile predictions.
+
+    "mean" weights each tile by its leaf coverage; "max" takes every class's
+    strongest tile, so one badly affected leaf is not averaged away.
+    """
+    if mode == "max":
+        combined = predictions.max(axis=0)
+        return combined / combined.sum()
+    weights = np.maximum(np.asarray(weights, dtype=np.float64), 0.05)
+    return (predictions * weights[:, None]).sum(axis=0) / weights.sum()
@@ -0,0 +1,339 @@
+import argparse
+import itertools
+import math
+import os
+
+import tensorflow as tf
+
+from classes import labelled_files
+
+# Training code from training_model_inception.ipynb as an importable module.
+# The ImageDataGenerator.flow_from_directory input path is replaced by a tf.data
+# pipeline: parallel decode, a cache of decoded 224x224 images, augmentation
+# applied to whole batches at once, and prefetch.
+#
+#   python train.py --train-dir "MangoLeafBD Dataset/train" --test-dir "MangoLeafBD Dataset/test"
+
+IMAGE_SIZE = (224, 224)
+
+# Augmentation parameters from the notebook's train_datagen
+ROTATION_RANGE = 30.0
+WIDTH_SHIFT_RANGE = 0.2
+HEIGHT_SHIFT_RANGE = 0.2
+SHEAR_RANGE = 0.2
+ZOOM_RANGE = 0.2
+HORIZONTAL_FLIP = True
+
+AUTOTUNE = tf.data.AUTOTUNE
+
+def decode_and_resize(path):
+    image = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+    image = tf.image.resize(image, IMAGE_SIZE, method="nearest")
+    return tf.cast(image, tf.uint8)
+
+def scale_images(images, scale):
+    images = tf.cast(images, tf.float32)
+    if scale == "inception":
+        # inception_v3.preprocess_input, as used by app.py
+        return images / 127.5 - 1.0
+    # rescale=1./255 as in the notebook
+    return images / 255.0
+
+def augmentation_transforms(batch_size, height, width, seed):
+    # One random affine per image, built as [a0, a1, a2, b0, b1, b2, 0, 0]
+    # rows mapping output pixel coordinates to input coordinates
+    seeds = tf.random.experimental.stateless_split(seed, 5)
+    deg = math.pi / 180.0
+    theta = tf.random.stateless_uniform([batch_size], seeds[0], -ROTATION_RANGE, ROTATION_RANGE) * deg
+    tx = tf.random.stateless_uniform([batch_size], seeds[1], -WIDTH_SHIFT_RANGE, WIDTH_SHIFT_RANGE) * width
+    ty = tf.random.stateless_uniform([batch_size], seeds[2], -HEIGHT_SHIFT_RANGE, HEIGHT_SHIFT_RANGE) * height
+    # ImageDataGenerator's shear_range is an angle in degrees
+    shear = tf.random.stateless_uniform([batch_size], seeds[3], -SHEAR_RANGE, SHEAR_RANGE) * deg
+    zoom = tf.random.stateless_uniform([batch_size, 2], seeds[4], 1.0 - ZOOM_RANGE, 1.0 + ZOOM_RANGE)
+    zx, zy = zoom[:, 0], zoom[:, 1]
+
+    cos, sin = tf.cos(theta), tf.sin(theta)
+    # rotation @ shear @ zoom
+    a0, a1 = cos * zx, -tf.sin(theta + shear) * zy
+    b0, b1 = sin * zx, tf.cos(theta + shear) * zy
+    # rotated shift, applied about the image centre
+    cx, cy = (width - 1.0) / 2.0, (height - 1.0) / 2.0
+    a2 = cx - a0 * cx - a1 * cy + cos * tx - sin * ty
+    b2 = cy - b0 * cx - b1 * cy + sin * tx + cos * ty
+    zeros = tf.zeros_like(a0)
+    return tf.stack([a0, a1, a2, b0, b1, b2, zeros, zeros], axis=1)
+
+def augment_batch(images, seed):
+    # images: float32 (N, H, W, 3); seed: int64 [2]
+    shape = tf.shape(images)
+    height, width = tf.cast(shape[1], tf.float32), tf.cast(shape[2], tf.float32)
+    if HORIZONTAL_FLIP:
+        flip_seed = tf.random.experimental.stateless_fold_in(seed, 1)
+        flip = tf.random.stateless_uniform([shape[0]], flip_seed) < 0.5
+        images = tf.where(flip[:, None, None, None], tf.reverse(images, axis=[2]), images)
+    transforms = augmentation_transforms(shape[0], height, width, seed)
+    return tf.raw_ops.ImageProjectiveTransformV3(
+        images=images,
+        transforms=transforms,
+        output_shape=shape[1:3],
+        fill_value=0.0,
+        interpolation="BILINEAR",
+        fill_mode="NEAREST",
+    )
+
+def build_dataset(directory, batch_size=32, training=True, cache="", num_shards=1, shard_index=0,
+                  seed=0, scale="rescale", shuffle_buffer=2048):
+    """Batched (images, one-hot labels) pipeline over a class-folder directory.
+
+    cache: "" keeps decoded images in memory, a path caches them on disk, None disables.
+    Sharding is applied to the sorted file list, so each shard is deterministic.
+    directory may also be a store written by image_pack.py; its images are read
+    from the memory-mapped shards and cache/shuffle_buffer do not apply.
+    """
+    from image_pack import PackedImages
+    if PackedImages.is_packed(directory):
+        store = PackedImages(directory)
+        classes = store.classes
+        ds = packed_batches(store, batch_size, training, seed, num_shards, shard_index)
+    else:
+        paths, labels, classes = labelled_files(directory)
+        if not paths:
+            raise ValueError("No images found in %s" % directory)
+        ds = tf.data.Dataset.from_tensor_slices((paths, labels))
+        if num_shards > 1:
+            ds = ds.shard(num_shards, shard_index)
+        ds = ds.map(lambda path, label: (decode_and_resize(path), label), num_parallel_calls=AUTOTUNE)
+        if cache is not None:
+            ds = ds.cache(cache)
+        if training:
+            ds = ds.shuffle(min(shuffle_buffer, len(paths)), seed=seed, reshuffle_each_iteration=True)
+        ds = ds.batch(batch_size)
+
+    num_classes = len(classes)
+
+    def finish(step, batch):
+        images, labels = batch
+        images = scale_images(images, scale)
+        if training:
+            images = augment_batch(images, tf.stack([tf.cast(seed, tf.int64), step]))
+        return images, tf.one_hot(tf.cast(labels, tf.int32), num_classes)
+
+    # A per-batch seed from a stream that is re-drawn every epoch (each iteration of
+    # the dataset), so batch i gets new augmentation parameters every epoch as with
+    # ImageDataGenerator; enumerate() would restart at 0 and repeat them
+    steps = tf.data.Dataset.random(seed=seed, rerandomize_each_iteration=True)
+    ds = tf.data.Dataset.zip((steps, ds)).map(finish, num_parallel_calls=AUTOTUNE)
+    return ds.prefetch(AUTOTUNE), classes
+
+def packed_batches(store, batch_size, training, seed, num_shards, shard_index):
+    # uint8 batches straight from the mapped shards; a fresh permutation every epoch when training
+    epochs = itertools.count()
+
+    def batches():
+        epoch_seed = (seed, next(epochs)) if training else seed
+        yield from store.batches(batch_size, shuffle=training, seed=epoch_seed,
+                                 num_shards=num_shards, shard_index=shard_index)
+
+    signature = (tf.TensorSpec((None,) + IMAGE_SIZE + (3,), tf.uint8), tf.TensorSpec((None,), tf.int16))
+    return tf.data.Dataset.from_generator(batches, output_signature=signature)
+
+MODEL_VARIANTS = ("flatten", "gap", "attention")
+
+def _attention_pool(features):
+    # Softmax over spatial positions of a 1x1-conv score map, then the weighted
+    # sum of the feature vectors. Built from stock layers so model.h5 loads
+    # without custom objects.
+    from tensorflow.keras.layers import Conv2D, Dot, Reshape, Softmax
+    channels = features.shape[-1]
+    scores = Conv2D(1, 1, name="attention_scores")(features)
+    weights = Softmax(name="attention_weights")(Reshape((-1,))(scores))
+    return Dot(axes=1, name="attention_pool")([weights, Reshape((-1, channels))(features)])
+
+def build_model(num_classes=6, trainable_layers=15, weights="imagenet", learning_rate=0.001, variant="flatten"):
+    """InceptionV3 backbone plus a classifier head.
+
+    flatten is the notebook's head (Flatten -> 2x Dense(512)); its first dense
+    matrix holds most of the model's weights. gap and attention pool the
+    backbone's feature map to one 2048-vector before a single small Dense.
+    """
+    from tensorflow.keras import Model
+    from tensorflow.keras.layers import Dense, Dropout, Flatten, GlobalAveragePooling2D
+    from tensorflow.keras.regularizers import l2
+
+    if variant not in MODEL_VARIANTS:
+        raise ValueError("variant must be one of %s, not %r" % (", ".join(MODEL_VARIANTS), variant))
+
+    inception_v3 = tf.keras.applications.InceptionV3(weights=weights, include_top=False, input_shape=IMAGE_SIZE + (3,))
+    for layer in inception_v3.layers[:-trainable_layers]:
+        layer.trainable = False
+
+    if variant == "flatten":
+        x = Flatten()(inception_v3.output)
+        x = Dense(512, activation='relu', kernel_regularizer=l2(0.001))(x)
+        x = Dropout(0.5)(x)
+        x = Dense(512, activation='relu', kernel_regularizer=l2(0.001))(x)
+        x = Dropout(0.5)(x)
+    else:
+        if variant == "gap":
+            x = GlobalAveragePooling2D()(inception_v3.output)
+        else:
+            x = _attention_pool(inception_v3.output)
+        x = Dense(256, activation='relu', kernel_regularizer=l2(0.001))(x)
+        x = Dropout(0.3)(x)
+    output = Dense(num_classes, activation='softmax')(x)
+
+    model = Model(inputs=inception_v3.input, outputs=output)
+    model.compile(optimizer=tf.keras.optimizers.Adam(learning_rate), loss='categorical_crossentropy', metrics=['accuracy'])
+    return model
+
+def distill(student, teacher, training_set, test_set, epochs, temperature=4.0, alpha=0.5, learning_rate=0.001):
+    """Train student on a mix of the hard labels and teacher's softened predictions.
+
+    Both models output softmax probabilities, so logits are recovered as
+    log(p) before dividing by temperature. The soft term is scaled by T^2 to
+    keep its gradients comparable to the hard term (Hinton et al.).
+    """
+    optimizer = tf.keras.optimizers.Adam(learning_rate)
+    teacher.trainable = False
+
+    def soften(probabilities):
+        return tf.nn.log_softmax(tf.math.log(probabilities + 1e-7) / temperature)
+
+    @tf.function
+    def train_step(images, labels):
+        log_targets = soften(teacher(images, training=False))
+        with tf.GradientTape() as tape:
+            predictions = student(images, training=True)
+            hard = tf.reduce_mean(tf.keras.losses.categorical_crossentropy(labels, predictions))
+            # KL(teacher || student) between the temperature-softened distributions
+            soft = tf.reduce_mean(tf.reduce_sum(tf.exp(log_targets) * (log_targets - soften(predictions)), axis=1))
+            loss = alpha * hard + (1.0 - alpha) * temperature ** 2 * soft
+            if student.losses:
+                loss += tf.add_n(student.losses)
+        gradients = tape.gradient(loss, student.trainable_variables)
+        optimizer.apply_gradients(zip(gradients, student.trainable_variables))
+        return loss, hard, soft
+
+    for epoch in range(epochs):
+        totals, steps = [0.0, 0.0, 0.0], 0
+        for images, labels in training_set:
+            for i, value in enumerate(train_step(images, labels)):
+                totals[i] += float(value)
+            steps += 1
+        _, accuracy = student.evaluate(test_set, verbose=0)
+        print("epoch %d/%d - loss %.4f - hard %.4f - soft %.4f - val_accuracy %.4f"
+              % (epoch + 1, epochs, totals[0] / steps, totals[1] / steps, totals[2] / steps, accuracy), flush=True)
+
+def load_feature_store(directory, extractor, data_dir, signature, batch_size, scale, augmented_copies=0, seed=0):
+    # Reuse a complete store with the same signature; otherwise run the frozen
+    # backbone once (plus optional augmented passes) and write a new one
+    from feature_cache import FeatureStore
+    if FeatureStore.matches(directory, signature):
+        return FeatureStore(directory)
+    dataset, _ = build_dataset(data_dir, batch_size=batch_size, training=False, cache=None, scale=scale)
+    for copy in range(augmented_copies):
+        augmented, _ = build_dataset(data_dir, batch_size=batch_size, training=True, cache=None,
+                                     scale=scale, seed=seed + copy)
+        dataset = dataset.concatenate(augmented)
+    return FeatureStore.write(directory, extractor, dataset, signature)
+
+def train_from_feature_cache(model, args, num_classes):
+    # Only the trainable tail runs per epoch; it shares its layers with model,
+    # so model ends up with the trained weights
+    from feature_cache import split_frozen
+    extractor, tail = split_frozen(model)
+    signature = {
+        "trainable_layers": args.trainable_layers,
+        "scale": args.scale,
+        "weights": args.weights,
+        # Producing-layer names: tensor names (keras_tensor_123) depend on how many
+        # tensors were created earlier in the process
+        "tensors": [t._keras_history[0].name for t in extractor.outputs],
+    }
+    train_store = load_feature_store(
+        os.path.join(args.feature_cache, "train"), extractor, args.train_dir,
+        dict(signature, data_dir=os.path.abspath(args.train_dir), augmented_copies=args.augmented_copies),
+        args.batch_size, args.scale, args.augmented_copies, args.seed,
+    )
+    test_store = load_feature_store(
+        os.path.join(args.feature_cache, "test"), extractor, args.test_dir,
+        dict(signature, data_dir=os.path.abspath(args.test_dir), augmented_copies=0),
+        args.batch_size, args.scale,
+    )
+    tail.compile(optimizer=tf.keras.optimizers.Adam(args.learning_rate), loss='categorical_crossentropy', metrics=['accuracy'])
+    tail.fit(
+        train_store.dataset(args.batch_size, num_classes, seed=args.seed),
+        validation_data=test_store.dataset(args.batch_size, num_classes, shuffle=False),
+        epochs=args.epochs,
+    )
+
+def _weights(name):
+    return None if name == "none" else name
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the InceptionV3 mango leaf classifier")
+    parser.add_argument("--train-dir", default="MangoLeafBD Dataset/train", help="class folders or an image_pack.py store")
+    parser.add_argument("--test-dir", default="MangoLeafBD Dataset/test", help="class folders or an image_pack.py store")
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--cache", default="memory",
+                        help="'memory', 'none', or a file prefix for an on-disk cache of decoded images")
+    parser.add_argument("--scale", choices=("rescale", "inception"), default="rescale",
+                        help="rescale: x/255 as in the notebook; inception: [-1, 1] as app.py serves")
+    parser.add_argument("--num-shards", type=int, default=1)
+    parser.add_argument("--shard-index", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--learning-rate", type=float, default=0.001)
+    parser.add_argument("--trainable-layers", type=int, default=15)
+    parser.add_argument("--weights", default="imagenet", help="backbone initialisation: imagenet or none")
+    parser.add_argument("--variant", choices=MODEL_VARIANTS, default="flatten",
+                        help="classifier head: the notebook's flatten head, or a slim gap / attention pooled head")
+    parser.add_argument("--distill-from", default=None,
+                        help="teacher model (e.g. the current model.h5) whose soft predictions the new model learns")
+    parser.add_argument("--temperature", type=float, default=4.0)
+    parser.add_argument("--alpha", type=float, default=0.5, help="weight of the hard-label loss when distilling")
+    parser.add_argument("--feature-cache", default=None,
+                        help="directory of precomputed frozen-backbone activations; train only the tail from it")
+    parser.add_argument("--augmented-copies", type=int, default=0,
+                        help="extra augmented passes over the training set stored in the feature cache")
+    parser.add_argument("--output", default="model.h5")
+    parser.add_argument("--weights-output", default="mango_leaf_disease.weights.h5")
+    args = parser.parse_args()
+
+    tf.keras.utils.set_random_seed(args.seed)
+    if args.feature_cache and args.distill_from:
+        parser.error("--distill-from needs the teacher to see every augmented image; drop --feature-cache")
+    if args.feature_cache:
+        _, classes = build_dataset(args.train_dir, training=False, cache=None)
+        model = build_model(num_classes=len(classes), trainable_layers=args.trainable_layers,
+                            weights=_weights(args.weights), learning_rate=args.learning_rate,
+                            variant=args.variant)
+        train_from_feature_cache(model, args, len(classes))
+        model.save(args.output)
+        model.save_weights(args.weights_output)
+        return
+
+    cache = {"memory": "", "none": None}.get(args.cache, args.cache)
+    common = dict(batch_size=args.batch_size, seed=args.seed, scale=args.scale,
+                  num_shards=args.num_shards, shard_index=args.shard_index)
+    training_set, classes = build_dataset(args.train_dir, training=True, cache=cache, **common)
+    test_cache = cache + "_test" if cache else cache
+    # Evaluate without augmentation (the notebook reused train_datagen here)
+    test_set, _ = build_dataset(args.test_dir, training=False, cache=test_cache, **common)
+
+    model = build_model(num_classes=len(classes), trainable_layers=args.trainable_layers,
+                        weights=_weights(args.weights), learning_rate=args.learning_rate,
+                        variant=args.variant)
+    model.summary()
+    if args.distill_from:
+        # The teacher must have been trained with the same --scale
+        teacher = tf.keras.models.load_model(args.distill_from, compile=False)
+        distill(model, teacher, training_set, test_set, args.epochs,
+                temperature=args.temperature, alpha=args.alpha, learning_rate=args.learning_rate)
+    else:
+        model.fit(training_set, validation_data=test_set, epochs=args.epochs)
+    model.save(args.output)
+    model.save_weights(args.weights_output)
+
+if __name__ == "__main__":
+    main()
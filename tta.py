@@ -0,0 +1,51 @@
+import math
+
+import numpy as np
+
+from preprocessing import INPUT_SHAPE
+
+# Test-time augmentation. Every variant is a fixed geometric transform, so it is
+# stored as a map from output pixel to source pixel; all variants of an image
+# come out of a single fancy-indexing gather, already batched for one predict
+# call. Transforms work on preprocessed images (the scaling is per pixel) and
+# clamp to the border, like the training augmentation's fill_mode="nearest".
+
+# (horizontal flip, rotation in degrees, zoom, x shift, y shift as image fractions)
+VARIANTS = (
+    (True, 0.0, 1.0, 0.0, 0.0),
+    (False, 10.0, 1.0, 0.0, 0.0),
+    (False, -10.0, 1.0, 0.0, 0.0),
+    (False, 0.0, 1.15, 0.0, 0.0),
+    (True, 0.0, 1.15, 0.0, 0.0),
+    (False, 0.0, 1.1, -0.05, -0.05),
+    (False, 0.0, 1.1, 0.05, 0.05),
+)
+
+def _index_map(flip, degrees, zoom, dx, dy, height=INPUT_SHAPE[0], width=INPUT_SHAPE[1]):
+    # Flat source index for every output pixel (nearest neighbour)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float64)
+    cy, cx = (height - 1) / 2.0, (width - 1) / 2.0
+    u, v = (x - cx) / zoom, (y - cy) / zoom
+    theta = math.radians(degrees)
+    cos, sin = math.cos(theta), math.sin(theta)
+    sx = cos * u + sin * v + cx - dx * width
+    sy = -sin * u + cos * v + cy - dy * height
+    if flip:
+        sx = (width - 1) - sx
+    sx = np.clip(np.rint(sx), 0, width - 1).astype(np.intp)
+    sy = np.clip(np.rint(sy), 0, height - 1).astype(np.intp)
+    return (sy * width + sx).ravel()
+
+INDEX_MAPS = np.stack([_index_map(*variant) for variant in VARIANTS])
+
+def make_variants(image, out=None):
+    """All VARIANTS of one (1, H, W, 3) or (H, W, 3) image as a (len(VARIANTS), H, W, 3) batch."""
+    flat = np.asarray(image, dtype=np.float32).reshape(-1, INPUT_SHAPE[2])
+    if out is None:
+        out = np.empty((len(VARIANTS),) + INPUT_SHAPE, dtype=np.float32)
+    np.take(flat, INDEX_MAPS, axis=0, out=out.reshape(len(VARIANTS), -1, INPUT_SHAPE[2]))
+    return out
+
+def aggregate(base, variant_predictions):
+    # Mean class probabilities over the original and every variant
+    return (np.asarray(base) + np.sum(variant_predictions, axis=0)) / (len(variant_predictions) + 1)